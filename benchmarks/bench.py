@@ -0,0 +1,360 @@
+"""Throughput and latency benchmarks for publishing and polling.
+
+Each case runs in a fresh process, against moto in-process by default,
+against a moto server (or any other endpoint) with `--endpoint-url`, or
+against in-memory queues and topics with `--transport memory`. Results
+are written as JSON lines, one per case, so that runs can be compared. With
+tqp and its dev dependencies installed:
+
+    python benchmarks/bench.py --output before.jsonl
+    python benchmarks/bench.py --batch-sizes 10 --concurrency 1,16
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Event, Lock, Thread
+
+# -----------------------------------------------------------------------------
+
+PREFIX = "bench"
+TOPIC_NAME = "event"
+
+# set in each case's process, None for AWS (or moto)
+transport = None
+
+# -----------------------------------------------------------------------------
+
+
+class Counter:
+    def __init__(self, target):
+        self.target = target
+        self.value = 0
+        self.lock = Lock()
+        self.done = Event()
+
+    def add(self, count=1):
+        with self.lock:
+            self.value += count
+            if self.value >= self.target:
+                self.done.set()
+
+
+def create_poller(*, batch_size, concurrency, **kwargs):
+    from tqp.topic_queue_poller import TopicQueuePoller
+
+    poller = TopicQueuePoller(
+        f"bench-{batch_size}-{concurrency}",
+        prefix=PREFIX,
+        receive_batch_size=batch_size,
+        concurrency=concurrency,
+        transport=transport,
+        **kwargs,
+    )
+    return poller
+
+
+def start_poller(poller):
+    Thread(
+        target=poller.start, kwargs={"ensure_queue": False}, daemon=True
+    ).start()
+
+
+def publish_messages(messages, batch_size=10):
+    from tqp.topic import Topic
+
+    topic = Topic(f"{PREFIX}--{TOPIC_NAME}", transport=transport)
+    for i in range(0, len(messages), batch_size):
+        topic.publish_many(messages[i : i + batch_size])
+
+
+# -----------------------------------------------------------------------------
+
+
+def bench_publish(*, messages, batch_size, mode):
+    from tqp.topic import Topic
+
+    topic = Topic(f"{PREFIX}--{TOPIC_NAME}", transport=transport)
+    topic.publish({"warmup": True})
+
+    payloads = [{"i": i} for i in range(messages)]
+    started_at = time.perf_counter()
+
+    if mode == "publish":
+        for payload in payloads:
+            topic.publish(payload)
+    elif mode == "publish_many":
+        for i in range(0, messages, batch_size):
+            topic.publish_many(payloads[i : i + batch_size])
+    else:
+        with topic.publisher(max_batch=batch_size) as publisher:
+            for payload in payloads:
+                publisher.publish(payload)
+
+    elapsed = time.perf_counter() - started_at
+    return {"messages_per_second": messages / elapsed, "elapsed": elapsed}
+
+
+def bench_throughput(*, messages, batch_size, concurrency, handler_delay):
+    """Drain a queue filled up front: receive, handle and delete"""
+    from tqp.instrumentation import ACK, Listener
+
+    poller = create_poller(batch_size=batch_size, concurrency=concurrency)
+    acked = Counter(messages)
+
+    class AckListener(Listener):
+        def stage_timed(self, poller, stage, duration, count):
+            if stage == ACK:
+                acked.add(count)
+
+    poller.add_listener(AckListener())
+
+    @poller.handler(TOPIC_NAME)
+    def handle(item):
+        if handler_delay:
+            time.sleep(handler_delay)
+
+    poller.ensure_queue()
+    publish_messages([{"i": i} for i in range(messages)])
+
+    started_at = time.perf_counter()
+    start_poller(poller)
+    if not acked.done.wait(timeout=600):
+        raise RuntimeError("timed out waiting for messages to be handled")
+
+    elapsed = time.perf_counter() - started_at
+    return {
+        "messages_per_second": messages / elapsed,
+        "elapsed": elapsed,
+        "stages": poller.metrics.snapshot(),
+    }
+
+
+def bench_latency(
+    *, messages, batch_size, concurrency, handler_delay, publish_rate
+):
+    """Publish at a steady rate and measure end-to-end latency"""
+    from tqp.instrumentation import Histogram
+
+    poller = create_poller(batch_size=batch_size, concurrency=concurrency)
+    latency = Histogram()
+    handled = Counter(messages)
+
+    @poller.handler(TOPIC_NAME)
+    def handle(item):
+        if handler_delay:
+            time.sleep(handler_delay)
+
+        latency.record(time.time() - item["sent_at"])
+        handled.add()
+
+    poller.ensure_queue()
+    start_poller(poller)
+
+    # let the poller start polling
+    time.sleep(0.5)
+
+    for _ in range(messages):
+        publish_messages([{"sent_at": time.time()}])
+        time.sleep(1 / publish_rate)
+
+    if not handled.done.wait(timeout=600):
+        raise RuntimeError("timed out waiting for messages to be handled")
+
+    return {"latency": latency.snapshot(), "stages": poller.metrics.snapshot()}
+
+
+def bench_memory(*, batch_size, concurrency):
+    """Measure the memory held per in-flight message.
+
+    This is approximate, as it includes the memory moto uses to track the
+    messages when running in-process.
+    """
+    poller = create_poller(batch_size=batch_size, concurrency=concurrency)
+    warmed_up = Event()
+    in_flight = Counter(concurrency)
+    release = Event()
+
+    @poller.handler(TOPIC_NAME)
+    def handle(item):
+        if item.get("warmup"):
+            warmed_up.set()
+            return
+
+        in_flight.add()
+        release.wait()
+
+    poller.ensure_queue()
+    tracemalloc.start()
+    start_poller(poller)
+
+    # the clients and threads are set up before the baseline is taken
+    publish_messages([{"warmup": True}])
+    if not warmed_up.wait(timeout=60):
+        raise RuntimeError("timed out waiting for the poller to start")
+
+    time.sleep(0.5)
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    publish_messages([{"data": "x" * 1024} for _ in range(concurrency)])
+    if not in_flight.done.wait(timeout=600):
+        raise RuntimeError("timed out waiting for messages to be in flight")
+
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    release.set()
+
+    return {"bytes_per_message": used / concurrency}
+
+
+BENCHMARKS = {
+    "publish": bench_publish,
+    "throughput": bench_throughput,
+    "latency": bench_latency,
+    "memory": bench_memory,
+}
+
+# -----------------------------------------------------------------------------
+
+
+def run_case(benchmark, params, endpoint_url, transport_name):
+    global transport
+
+    if transport_name == "memory":
+        from tqp.memory import MemoryTransport
+
+        transport = MemoryTransport()
+        return BENCHMARKS[benchmark](**params)
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    if endpoint_url:
+        os.environ["AWS_ENDPOINT_URL"] = endpoint_url
+        return BENCHMARKS[benchmark](**params)
+
+    from moto import mock_aws
+
+    with mock_aws():
+        return BENCHMARKS[benchmark](**params)
+
+
+def iter_cases(args):
+    if "publish" in args.benchmarks:
+        for mode in ("publish", "publish_many", "publisher"):
+            for batch_size in args.batch_sizes:
+                if mode == "publish" and batch_size != args.batch_sizes[0]:
+                    continue
+                yield "publish", {
+                    "messages": args.messages,
+                    "batch_size": batch_size,
+                    "mode": mode,
+                }
+
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            for handler_delay in args.handler_delays:
+                if "throughput" in args.benchmarks:
+                    yield "throughput", {
+                        "messages": args.messages,
+                        "batch_size": batch_size,
+                        "concurrency": concurrency,
+                        "handler_delay": handler_delay,
+                    }
+                if "latency" in args.benchmarks:
+                    yield "latency", {
+                        "messages": args.latency_messages,
+                        "batch_size": batch_size,
+                        "concurrency": concurrency,
+                        "handler_delay": handler_delay,
+                        "publish_rate": args.publish_rate,
+                    }
+
+            if "memory" in args.benchmarks:
+                yield "memory", {
+                    "batch_size": batch_size,
+                    "concurrency": concurrency,
+                }
+
+
+def parse_list(type):
+    return lambda value: [type(item) for item in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--benchmarks",
+        type=parse_list(str),
+        default=list(BENCHMARKS),
+        help="comma separated, from: %(default)s",
+    )
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-messages", type=int, default=100)
+    parser.add_argument(
+        "--publish-rate",
+        type=float,
+        default=50,
+        help="messages per second for the latency benchmark",
+    )
+    parser.add_argument(
+        "--batch-sizes", type=parse_list(int), default=[1, 5, 10]
+    )
+    parser.add_argument(
+        "--concurrency", type=parse_list(int), default=[1, 8, 32]
+    )
+    parser.add_argument(
+        "--handler-delays",
+        type=parse_list(float),
+        default=[0.0, 0.01],
+        help="seconds each handler call sleeps",
+    )
+    parser.add_argument(
+        "--transport", choices=["aws", "memory"], default="aws"
+    )
+    parser.add_argument("--endpoint-url", help="e.g. a moto server")
+    parser.add_argument("--output", help="file to write results to")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "endpoint_url": args.endpoint_url,
+        "transport": args.transport,
+    }
+
+    with output:
+        for benchmark, params in iter_cases(args):
+            # a fresh process per case, so that pollers and memory don't
+            # carry over between cases
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context("spawn")
+            ) as executor:
+                result = executor.submit(
+                    run_case,
+                    benchmark,
+                    params,
+                    args.endpoint_url,
+                    args.transport,
+                ).result()
+
+            record = {
+                "benchmark": benchmark,
+                **params,
+                **result,
+                "environment": environment,
+            }
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+
+
+if __name__ == "__main__":
+    main()
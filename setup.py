@@ -23,13 +23,17 @@ setup(
     keywords="pub sub pubsub flask",
     packages=find_packages(),
     install_requires=("boto3",),
+    entry_points={"console_scripts": ["tqp = tqp.cli:main"]},
     extras_require={
+        "msgpack": ["msgpack"],
+        "orjson": ["orjson"],
+        "zstd": ["zstandard"],
         "dev": [
             "pytest",
             "fourmat~=0.11.1",
             "pre-commit",
             "moto[server]",
             "boto3",
-        ]
+        ],
     },
 )
@@ -0,0 +1,13 @@
+import pytest
+
+from tqp import aws
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture(autouse=True)
+def reset_aws():
+    # clients and topic ARNs must not leak from one mocked test to the next
+    aws.reset()
+    yield
+    aws.reset()
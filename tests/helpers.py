@@ -0,0 +1,9 @@
+import time
+
+# -----------------------------------------------------------------------------
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
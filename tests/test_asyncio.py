@@ -0,0 +1,215 @@
+import asyncio
+import boto3
+import json
+import pytest
+import threading
+from moto import mock_aws
+
+from tqp.asyncio import AsyncTopicQueuePoller
+from tqp.dedup import MemoryDedupStore
+from tqp.memory import MemoryTransport
+from tqp.topic import Topic
+
+# -----------------------------------------------------------------------------
+
+
+@mock_aws
+def test_async_tqp():
+    poller = AsyncTopicQueuePoller("foo", prefix="test", concurrency=10)
+
+    handled_items = []
+    sync_handled_items = []
+
+    @poller.handler("my_event")
+    async def handle_my_event(item):
+        # all messages are handled concurrently on the loop
+        await asyncio.sleep(0.2)
+        handled_items.append(item)
+
+    @poller.handler("my_sync_event")
+    def handle_my_sync_event(item):
+        sync_handled_items.append(item)
+
+    async def run():
+        task = asyncio.create_task(poller.start())
+
+        # making sure poller is polling
+        await asyncio.sleep(0.5)
+
+        sns = boto3.client("sns")
+        for i in range(5):
+            sns.publish(
+                TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+                Message=json.dumps({"i": i}),
+            )
+        sns.publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_sync_event",
+            Message='{"bar": "baz"}',
+        )
+
+        # making sure messages are processed
+        await asyncio.sleep(1)
+        task.cancel()
+
+    # not using asyncio.run, as it would wait on the pending long poll
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
+
+    assert sorted(item["i"] for item in handled_items) == list(range(5))
+    assert sync_handled_items == [{"bar": "baz"}]
+
+
+def test_async_dedup_off_loop():
+    transport = MemoryTransport(max_wait_time=0.1)
+    threads = []
+
+    class RecordingDedupStore(MemoryDedupStore):
+        def _contains(self, message_id):
+            threads.append(threading.get_ident())
+            return super()._contains(message_id)
+
+        def add(self, message_id):
+            threads.append(threading.get_ident())
+            super().add(message_id)
+
+    poller = AsyncTopicQueuePoller(
+        "foo",
+        prefix="test",
+        transport=transport,
+        dedup_store=RecordingDedupStore(),
+    )
+
+    handled_items = []
+
+    @poller.handler("my_event")
+    async def handle_my_event(item):
+        handled_items.append(item)
+
+    async def run():
+        poller.ensure_queue()
+        task = asyncio.create_task(poller.start(ensure_queue=False))
+
+        Topic("test--my_event", transport=transport).publish({"bar": "baz"})
+        while not handled_items:
+            await asyncio.sleep(0.01)
+
+        poller.stop()
+        await task
+
+        # the store may be backed by a database, so it's not called on the
+        # event loop's thread
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+    asyncio.run(run())
+
+
+def test_async_unsupported():
+    with pytest.raises(ValueError):
+        AsyncTopicQueuePoller("foo", max_concurrency=200)
+    with pytest.raises(ValueError):
+        AsyncTopicQueuePoller("foo", fifo=True)
+    with pytest.raises(ValueError):
+        AsyncTopicQueuePoller("foo", slow_handler_threshold=0.5)
+
+    poller = AsyncTopicQueuePoller("foo")
+    with pytest.raises(TypeError):
+        poller.batch_handler("my_event")
+
+
+def test_async_stop():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = AsyncTopicQueuePoller(
+        "foo", prefix="test", transport=transport, concurrency=1
+    )
+
+    handled_items = []
+
+    @poller.handler("my_event")
+    async def handle_my_event(item):
+        await asyncio.sleep(0.5)
+        handled_items.append(item)
+
+    async def run():
+        queue = poller.ensure_queue()
+        Topic("test--my_event", transport=transport).publish_many(range(3))
+
+        task = asyncio.create_task(poller.start(ensure_queue=False))
+        await asyncio.sleep(0.2)
+        poller.stop()
+        await task
+
+        # the messages waiting for the running handler are returned, and
+        # their slots released on the loop
+        assert handled_items == [0]
+        assert queue.attributes["ApproximateNumberOfMessages"] == "2"
+        assert poller._in_flight._value == poller.max_in_flight
+
+    asyncio.run(run())
+
+
+def test_async_stop_during_long_poll():
+    transport = MemoryTransport(max_wait_time=2)
+    poller = AsyncTopicQueuePoller(
+        "foo",
+        prefix="test",
+        transport=transport,
+        concurrency=1,
+        wait_time_seconds=2,
+    )
+
+    @poller.handler("my_event")
+    async def handle_my_event(item):
+        await asyncio.sleep(0.5)
+
+    async def run():
+        queue = poller.ensure_queue()
+        Topic("test--my_event", transport=transport).publish_many(range(3))
+
+        # one message is being handled, and the receiver is long polling for
+        # more
+        task = asyncio.create_task(poller.start(ensure_queue=False))
+        await asyncio.sleep(0.2)
+        poller.stop()
+
+        # the others are returned without waiting for the long poll to end
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        assert queue.attributes["ApproximateNumberOfMessages"] == "2"
+
+        await task
+        assert poller._in_flight._value == poller.max_in_flight
+
+    asyncio.run(run())
+
+
+def test_async_handler_error(caplog):
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = AsyncTopicQueuePoller("foo", prefix="test", transport=transport)
+
+    async def run():
+        queue = poller.ensure_queue()
+        queue.send_message(MessageBody="not json")
+
+        task = asyncio.create_task(poller.start(ensure_queue=False))
+        while not any(r.levelname == "ERROR" for r in caplog.records):
+            await asyncio.sleep(0.01)
+
+        poller.stop()
+        await task
+
+    asyncio.run(run())
+
+    (record,) = [r for r in caplog.records if r.levelname == "ERROR"]
+    assert record.getMessage() == "could not handle message not json"
+
+
+def test_async_stop_before_start():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = AsyncTopicQueuePoller("foo", prefix="test", transport=transport)
+    poller.ensure_queue()
+
+    poller.stop()
+    asyncio.run(asyncio.wait_for(poller.start(ensure_queue=False), 5))
+    assert not poller._stopping.is_set()
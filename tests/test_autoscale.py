@@ -0,0 +1,122 @@
+import time
+from moto import mock_aws
+from threading import Lock, Thread
+from unittest.mock import patch
+
+from tqp.autoscale import Autoscaler
+from tqp.memory import MemoryTransport
+from tqp.threading_utils import ResizableSemaphore
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+
+@mock_aws
+def test_autoscaler():
+    poller = TopicQueuePoller(
+        "foo",
+        concurrency=2,
+        max_concurrency=8,
+        max_in_flight=4,
+        max_receivers=2,
+        receive_batch_size=1,
+    )
+    assert poller.autoscaling
+
+    queue = poller.ensure_queue()
+    poller._in_flight = ResizableSemaphore(poller.max_in_flight)
+    poller._running = ResizableSemaphore(poller.concurrency)
+    autoscaler = Autoscaler(poller, queue, interval=1)
+
+    for _ in range(4):
+        queue.send_message(MessageBody="{}")
+
+    autoscaler.scale()
+    assert (autoscaler.concurrency, autoscaler.receivers) == (4, 2)
+    assert poller._running.value == 4
+    # the prefetch depth is kept
+    assert poller._in_flight.value == 6
+
+    autoscaler.scale()
+    assert (autoscaler.concurrency, autoscaler.receivers) == (4, 2)
+
+    queue.purge()
+    autoscaler.record_receive(1, 0)
+    autoscaler.scale()
+    autoscaler.scale()
+    assert (autoscaler.concurrency, autoscaler.receivers) == (2, 1)
+    assert poller._running.value == 2
+    assert poller._in_flight.value == 4
+
+
+@mock_aws
+def test_autoscaler_receives():
+    poller = TopicQueuePoller("foo", max_concurrency=4)
+    queue = poller.ensure_queue()
+    poller._in_flight = ResizableSemaphore(poller.max_in_flight)
+    poller._running = ResizableSemaphore(poller.concurrency)
+    autoscaler = Autoscaler(poller, queue, interval=1)
+
+    # without the queue attributes, the backlog is inferred from receives
+    with patch.object(autoscaler, "get_backlog", return_value=None):
+        autoscaler.record_receive(5, 5)
+        autoscaler.scale()
+        assert autoscaler.concurrency == 2
+
+        autoscaler.record_receive(5, 5)
+        autoscaler.record_receive(5, 0)
+        autoscaler.scale()
+        assert autoscaler.concurrency == 2
+
+        autoscaler.record_receive(5, 0)
+        autoscaler.scale()
+        assert autoscaler.concurrency == 1
+
+
+def test_autoscaled_concurrency():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller(
+        "foo",
+        prefix="test",
+        transport=transport,
+        concurrency=1,
+        max_concurrency=8,
+        receive_batch_size=10,
+        autoscale_interval=3600,
+    )
+
+    lock = Lock()
+    running = 0
+    peak = 0
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    poller.ensure_queue()
+    Topic("test--my_event", transport=transport).publish_many(range(60))
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+
+    # the worker pool is sized for the maximum, but only as many handlers as
+    # the current concurrency run at once
+    time.sleep(0.3)
+    assert peak == 1
+
+    poller._autoscaler.scale()
+    assert poller._autoscaler.concurrency == 2
+
+    time.sleep(0.3)
+    assert peak == 2
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
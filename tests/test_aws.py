@@ -0,0 +1,57 @@
+from moto import mock_aws
+from threading import Thread
+from unittest.mock import patch
+
+from tqp import aws
+
+# -----------------------------------------------------------------------------
+
+
+def test_get_client():
+    assert aws.get_client("sqs") is aws.get_client("sqs")
+
+    aws.reset()
+    assert aws.get_client("sqs") is not aws.get_client("sns")
+
+
+def test_get_resource_per_thread():
+    resources = []
+
+    def get_resource():
+        resources.append(aws.get_resource("sqs"))
+
+    get_resource()
+    get_resource()
+
+    t = Thread(target=get_resource)
+    t.start()
+    t.join()
+
+    assert resources[0] is resources[1]
+    assert resources[0] is not resources[2]
+
+
+def test_configure():
+    aws.configure(max_pool_connections=20)
+    assert aws.get_client("sqs").meta.config.max_pool_connections == 20
+
+    # never shrinks the pool
+    aws.ensure_max_pool_connections(5)
+    assert aws.get_client("sqs").meta.config.max_pool_connections == 20
+
+    aws.ensure_max_pool_connections(30)
+    assert aws.get_client("sqs").meta.config.max_pool_connections == 30
+
+    aws.configure(aws.DEFAULT_CONFIG)
+
+
+@mock_aws
+def test_get_topic_arn():
+    sns = aws.get_client("sns")
+
+    with patch.object(sns, "create_topic", wraps=sns.create_topic) as create:
+        topic_arn = aws.get_topic_arn("my_event")
+        assert aws.get_topic_arn("my_event") == topic_arn
+
+    assert topic_arn == "arn:aws:sns:us-east-1:123456789012:my_event"
+    create.assert_called_once_with(Name="my_event")
@@ -0,0 +1,23 @@
+import time
+
+from tqp.cache import TTLCache
+
+# -----------------------------------------------------------------------------
+
+
+def test_ttl_cache():
+    cache = TTLCache(max_size=2, ttl=0.1)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is the least recently used
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+    time.sleep(0.2)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
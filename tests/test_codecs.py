@@ -0,0 +1,58 @@
+import pytest
+from moto import mock_aws
+
+from tqp.codecs import get_codec, register_codec
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+MESSAGE = {"id": "123456", "tags": ["foo"] * 100}
+
+
+@pytest.mark.parametrize("name", ("json", "json+gzip", "json+zstd", "msgpack"))
+def test_codec(name):
+    if name == "json+zstd":
+        pytest.importorskip("zstandard")
+    elif name == "msgpack":
+        pytest.importorskip("msgpack")
+
+    codec = get_codec(name)
+    data = codec.encode(MESSAGE)
+
+    assert isinstance(data, str)
+    assert codec.decode(data) == MESSAGE
+
+
+def test_compressed_codec_size():
+    assert len(get_codec("json+gzip").encode(MESSAGE)) < len(
+        get_codec("json").encode(MESSAGE)
+    )
+
+
+def test_register_codec():
+    with pytest.raises(ValueError):
+        register_codec("json", object())
+
+    with pytest.raises(ValueError):
+        get_codec("unknown")
+
+
+@mock_aws
+def test_publish_with_codec():
+    poller = TopicQueuePoller("foo")
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        handled_items.append(item)
+
+    queue = poller.ensure_queue()
+
+    Topic("my_event", codec="json+gzip").publish(MESSAGE)
+    Topic("my_event").publish({"plain": True})
+
+    for msg in queue.receive_messages(MaxNumberOfMessages=10):
+        poller._handle_message(msg)
+
+    assert sorted(handled_items, key=len) == [{"plain": True}, MESSAGE]
@@ -0,0 +1,115 @@
+import boto3
+import json
+import multiprocessing
+import pytest
+import time
+from moto import mock_aws
+from threading import Thread
+
+from tqp.dedup import MemoryDedupStore, SQLiteDedupStore
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    if request.param == "memory":
+        return lambda ttl: MemoryDedupStore(ttl=ttl)
+
+    return lambda ttl: SQLiteDedupStore(tmp_path / "dedup.db", ttl=ttl)
+
+
+def test_dedup_store(make_store):
+    store = make_store(ttl=0.1)
+
+    assert not store.seen("foo")
+    store.add("foo")
+    assert store.seen("foo")
+    assert not store.seen("bar")
+
+    time.sleep(0.1)
+    assert not store.seen("foo")
+
+    assert (store.hits, store.misses) == (1, 3)
+
+
+def test_sqlite_dedup_store_shared(tmp_path):
+    SQLiteDedupStore(tmp_path / "dedup.db").add("foo")
+
+    assert SQLiteDedupStore(tmp_path / "dedup.db").seen("foo")
+
+
+def test_sqlite_dedup_store_fork(tmp_path):
+    store = SQLiteDedupStore(tmp_path / "dedup.db")
+    store.add("foo")
+    connection = store.connection
+
+    def target():
+        # the connection inherited from the parent is not used
+        assert store.connection is not connection
+        assert store.seen("foo")
+        store.add("bar")
+
+    process = multiprocessing.get_context("fork").Process(target=target)
+    process.start()
+    process.join(5)
+
+    assert process.exitcode == 0
+    assert store.connection is connection
+    assert store.seen("bar")
+
+
+@mock_aws
+def test_poller_dedup():
+    poller = TopicQueuePoller(
+        "dedup",
+        prefix="test",
+        dedup_store=MemoryDedupStore(),
+        wait_time_seconds=1,
+    )
+
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        handled_items.append(item)
+
+    queue = poller.ensure_queue()
+
+    # the same SNS message, delivered twice
+    body = json.dumps(
+        {
+            "Type": "Notification",
+            "MessageId": "d3b5c9a4",
+            "TopicArn": "arn:aws:sns:us-east-1:123456789012:test--my_event",
+            "Message": '{"bar": "baz"}',
+        }
+    )
+    queue.send_message(MessageBody=body)
+    queue.send_message(MessageBody=body)
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    time.sleep(1)
+
+    assert handled_items == [{"bar": "baz"}]
+    assert (poller.dedup_store.hits, poller.dedup_store.misses) == (1, 1)
+
+    # the duplicate is deleted too
+    sqs = boto3.client("sqs")
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=queue.url,
+        AttributeNames=[
+            "ApproximateNumberOfMessages",
+            "ApproximateNumberOfMessagesNotVisible",
+        ],
+    )["Attributes"]
+    assert attributes == {
+        "ApproximateNumberOfMessages": "0",
+        "ApproximateNumberOfMessagesNotVisible": "0",
+    }
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,153 @@
+import threading
+import time
+from threading import Event, Thread
+from unittest.mock import Mock
+
+from tqp.diagnostics import SamplingProfiler, SlowHandlerWatchdog
+from tqp.memory import MemoryTransport
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+from .helpers import wait_for
+
+# -----------------------------------------------------------------------------
+
+
+def run_handler(listener, poller, func):
+    """Run `func` as a handler on a thread, as the poller would"""
+    msg = Mock()
+    payload = {"topic": "test--my_event"}
+
+    def target():
+        listener.handler_started(poller, msg, payload)
+        func()
+        listener.handler_finished(poller, msg, payload, None, 0)
+
+    thread = Thread(target=target)
+    thread.start()
+    return thread
+
+
+def test_handler_stats():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller(
+        "diagnostics", prefix="test", transport=transport
+    )
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        if item["fail"]:
+            raise ValueError()
+
+    poller.ensure_queue()
+    Topic("test--my_event", transport=transport).publish_many(
+        [{"fail": False}, {"fail": False}, {"fail": True}]
+    )
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    wait_for(
+        lambda: poller.metrics.handler_snapshot()
+        .get("handle_my_event", {})
+        .get("count")
+        == 3
+    )
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    stats = poller.metrics.handler_snapshot()["handle_my_event"]
+    assert stats["count"] == 3
+    assert stats["errors"] == 1
+
+
+def test_slow_handler_watchdog():
+    poller = Mock()
+    released = Event()
+
+    def stuck_handler():
+        released.wait(5)
+
+    with SlowHandlerWatchdog(0.05, interval=0.01) as watchdog:
+        thread = run_handler(watchdog, poller, stuck_handler)
+        wait_for(lambda: poller.logger.warning.called)
+        released.set()
+        thread.join()
+
+    # warned once, with the stack of the handler
+    poller.logger.warning.assert_called_once()
+    assert "stuck_handler" in poller.logger.warning.call_args[0][-1]
+    poller.logger.info.assert_called_once()
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), interval=0.01)
+
+    def slow_handler():
+        time.sleep(0.2)
+
+    with profiler:
+        run_handler(profiler, Mock(), slow_handler).join()
+        assert not list(tmp_path.iterdir())
+
+        profiler.toggle()
+        run_handler(profiler, Mock(), slow_handler).join()
+        profiler.toggle()
+
+        wait_for(lambda: list(tmp_path.iterdir()))
+
+    lines = (tmp_path / "test--my_event.folded").read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.split(";")[-1].startswith(
+        "slow_handler (test_diagnostics.py:"
+    )
+    assert int(count) > 1
+
+
+def test_poller_slow_handler(caplog):
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller(
+        "diagnostics",
+        prefix="test",
+        transport=transport,
+        slow_handler_threshold=0.1,
+        VisibilityTimeout=1,
+    )
+
+    handled = Event()
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        time.sleep(0.3)
+        handled.set()
+
+    poller.ensure_queue()
+    Topic("test--my_event", transport=transport).publish({})
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    handled.wait(5)
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    (record,) = [r for r in caplog.records if r.levelname == "WARNING"]
+    assert "past 0.1s of the visibility timeout" in record.getMessage()
+    assert "handle_my_event" in record.getMessage()
+
+
+def test_shared_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), interval=0.01)
+
+    def get_profiler_threads():
+        return [t for t in threading.enumerate() if t.name == "tqp-profiler"]
+
+    with profiler:
+        with profiler:
+            assert len(get_profiler_threads()) == 1
+
+        # still sampling for the pollers left
+        assert profiler.thread.is_alive()
+
+    assert not get_profiler_threads()
@@ -0,0 +1,123 @@
+import boto3
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+from moto import mock_aws
+from threading import Event, Thread
+
+from tqp.fifo import GroupScheduler, get_dead_letter_queue_name
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+from .helpers import wait_for
+
+# -----------------------------------------------------------------------------
+
+
+def test_get_dead_letter_queue_name():
+    assert get_dead_letter_queue_name("foo") == "foo-dead-letter"
+    assert get_dead_letter_queue_name("foo.fifo") == "foo-dead-letter.fifo"
+
+
+def test_group_scheduler():
+    processed = []
+    skipped = []
+    released = Event()
+
+    def process(item):
+        if item in (("a", 1), ("b", 1)):
+            released.wait(5)
+        processed.append(item)
+        return item != ("b", 1)
+
+    with ThreadPoolExecutor(4) as executor:
+        scheduler = GroupScheduler(executor, process, skipped.extend)
+        for group, i in [("a", 1), ("b", 1), ("a", 2), ("b", 2), ("c", 1)]:
+            scheduler.submit(group, (group, i))
+
+        # other groups aren't blocked by the first one
+        wait_for(lambda: ("c", 1) in processed)
+        assert ("a", 2) not in processed
+
+        released.set()
+        wait_for(lambda: not scheduler)
+
+    assert processed.index(("a", 1)) < processed.index(("a", 2))
+
+    # the rest of a group is skipped once one of its items fails
+    assert ("b", 2) not in processed
+    assert skipped == [("b", 2)]
+
+
+@mock_aws
+def test_topic_requires_group_id():
+    topic = Topic("test--fifo_event.fifo")
+
+    with pytest.raises(ValueError):
+        topic.publish({"foo": 1})
+
+
+@mock_aws
+def test_offloaded_deduplication_id():
+    boto3.client("s3").create_bucket(Bucket="offload")
+    topic = Topic(
+        "test--fifo_event.fifo", offload_bucket="offload", offload_threshold=20
+    )
+
+    message = {"large": "x" * 100}
+    entries = [topic._get_entry(message, group_id="a") for _ in range(2)]
+
+    # republishing the same message is deduplicated, though it's offloaded
+    # under a new key each time
+    assert entries[0]["Message"] != entries[1]["Message"]
+    assert (
+        entries[0]["MessageDeduplicationId"]
+        == entries[1]["MessageDeduplicationId"]
+    )
+
+
+@mock_aws
+def test_poller_fifo():
+    poller = TopicQueuePoller(
+        "fifo",
+        prefix="test",
+        fifo=True,
+        concurrency=4,
+        receive_batch_size=10,
+        wait_time_seconds=1,
+    )
+    assert poller.queue_name == "test--fifo.fifo"
+
+    handled = []
+
+    @poller.handler("fifo_event.fifo")
+    def handle_fifo_event(item):
+        if item["group"] == "slow":
+            time.sleep(0.1)
+        handled.append((item["group"], item["i"]))
+
+    with pytest.raises(ValueError):
+        poller.batch_handler("fifo_event.fifo")
+
+    # received at once, as moto doesn't end long polls once messages of
+    # a group in flight are deleted
+    poller.ensure_queue()
+    topic = Topic("test--fifo_event.fifo")
+    topic.publish_many(
+        [{"group": group, "i": i} for i in range(4) for group in "ab"]
+        + [{"group": "slow", "i": i} for i in range(2)],
+        group_id=lambda item: item["group"],
+    )
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    wait_for(lambda: len(handled) == 10)
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    for group in ("a", "b", "slow"):
+        assert [i for g, i in handled if g == group] == list(
+            range(2 if group == "slow" else 4)
+        )
@@ -0,0 +1,143 @@
+import flask
+import logging
+import pytest
+from moto import mock_aws
+from threading import Thread
+from unittest.mock import Mock
+
+from tqp.flask import FlaskTopicQueuePoller, get_ctx_payload
+from tqp.memory import MemoryTransport
+from tqp.topic import Topic
+
+from .helpers import wait_for
+
+# -----------------------------------------------------------------------------
+
+
+def test_get_ctx_payload_outside_handler():
+    with pytest.raises(RuntimeError):
+        get_ctx_payload()
+
+
+@mock_aws
+def test_app_context_reuse():
+    app = flask.Flask(__name__)
+    teardowns = []
+
+    @app.teardown_appcontext
+    def teardown(exc):
+        teardowns.append(exc)
+
+    poller = FlaskTopicQueuePoller(
+        "flask",
+        prefix="test",
+        app=app,
+        app_context_messages=3,
+        wait_time_seconds=1,
+    )
+
+    handled = []
+
+    @poller.handler("flask_event")
+    def handle_flask_event(item):
+        assert get_ctx_payload()["message"] == item
+        handled.append((item["i"], flask.g._get_current_object()))
+
+        if item["i"] == 4:
+            raise ValueError()
+
+    poller.ensure_queue()
+    Topic("test--flask_event").publish_many([{"i": i} for i in range(6)])
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    wait_for(lambda: len(handled) == 6)
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    # 3 messages were handled in the first app context, and the next one
+    # was torn down once its second message failed
+    assert [i for i, _ in handled] == list(range(6))
+    contexts = [g for _, g in handled]
+    assert contexts[0] is contexts[1] is contexts[2]
+    assert contexts[3] is contexts[4] is not contexts[0]
+    assert contexts[5] is not contexts[3]
+    assert teardowns[0] is None
+    assert isinstance(teardowns[1], ValueError)
+    assert teardowns[2] is None
+    assert len(teardowns) == 3
+
+    with pytest.raises(RuntimeError):
+        get_ctx_payload()
+
+
+@pytest.mark.parametrize("app_context_messages", (1, 10))
+def test_app_context_batch_handler(app_context_messages):
+    transport = MemoryTransport(max_wait_time=0.1)
+    app = flask.Flask(__name__)
+    teardowns = []
+
+    @app.teardown_appcontext
+    def teardown(exc):
+        teardowns.append(exc)
+
+    poller = FlaskTopicQueuePoller(
+        "flask",
+        prefix="test",
+        transport=transport,
+        app=app,
+        app_context_messages=app_context_messages,
+    )
+
+    handled = []
+
+    @poller.batch_handler("flask_event", max_size=3, max_wait=0.05)
+    def handle_flask_events(items):
+        assert flask.has_app_context()
+        handled.extend(items)
+
+    poller.ensure_queue()
+    Topic("test--flask_event", transport=transport).publish_many(range(3))
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    wait_for(lambda: len(handled) == 3)
+
+    # app contexts aren't kept open while the queue is idle
+    wait_for(lambda: teardowns)
+    assert teardowns[0] is None
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    assert sorted(handled) == [0, 1, 2]
+    assert teardowns == [None]
+
+
+def test_log_formatter():
+    app = flask.Flask(__name__)
+    poller = FlaskTopicQueuePoller("flask", prefix="test", app=app)
+    poller.set_log_formatter(lambda payload: payload["message"]["id"])
+
+    formatter = flask.logging.default_handler.formatter
+    record = logging.makeLogRecord({"msg": "handling"})
+    formatted = []
+
+    def handle_flask_event(item):
+        formatted.append(formatter.format(record))
+
+    poller.handle_message(
+        Mock(),
+        {
+            "topic": "test--flask_event",
+            "handler": handle_flask_event,
+            "meta": None,
+            "message": {"id": 1},
+        },
+    )
+
+    assert formatted[0].endswith("test--flask_event(1): handling")
+    assert formatter.format(record).endswith("None(None): handling")
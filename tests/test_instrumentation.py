@@ -0,0 +1,148 @@
+import boto3
+import time
+from moto import mock_aws
+from threading import Thread
+from unittest.mock import Mock
+
+from tqp.datadog import DatadogListener
+from tqp.exceptions import BatchHandlerError
+from tqp.instrumentation import Histogram, Listener
+from tqp.memory import MemoryTransport
+from tqp.raven import RavenListener
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+
+def test_histogram():
+    histogram = Histogram()
+    for i in range(1, 101):
+        histogram.record(i / 1000)
+    histogram.record(0)
+
+    assert histogram.count == 101
+    assert histogram.max == 0.1
+    assert histogram.percentile(0) == 0.0
+    # accurate within a bucket
+    assert 0.05 <= histogram.percentile(50) <= 0.05 * 1.25
+    assert 0.09 <= histogram.percentile(90) <= 0.1
+    assert histogram.percentile(100) == 0.1
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 101
+    assert abs(snapshot["mean"] - 5.05 / 101) < 1e-9
+
+
+@mock_aws
+def test_listener():
+    poller = TopicQueuePoller(
+        "instrumentation",
+        prefix="test",
+        delete_max_wait=0,
+        wait_time_seconds=1,
+    )
+
+    events = []
+
+    class RecordingListener(Listener):
+        def message_received(self, poller, msg, lag):
+            events.append(("received", lag is not None))
+
+        def handler_started(self, poller, msg, payload):
+            events.append(("started", payload["topic"]))
+
+        def handler_finished(self, poller, msg, payload, error, duration):
+            events.append(("finished", repr(error)))
+
+    poller.add_listener(RecordingListener())
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        if item["fail"]:
+            raise ValueError("failed")
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    time.sleep(0.5)
+
+    sns = boto3.client("sns")
+    for fail in (False, True):
+        sns.publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+            Message=f'{{"fail": {"true" if fail else "false"}}}',
+        )
+        time.sleep(0.5)
+
+    assert events == [
+        ("received", True),
+        ("started", "test--my_event"),
+        ("finished", "None"),
+        ("received", True),
+        ("started", "test--my_event"),
+        ("finished", "ValueError('failed')"),
+    ]
+
+    metrics = poller.metrics.snapshot()
+    assert metrics["handler"]["count"] == 2
+    assert metrics["decode"]["count"] == 2
+    assert metrics["buffer"]["count"] == 2
+    assert metrics["lag"]["count"] == 2
+    assert metrics["ack"]["count"] == 1
+    assert metrics["receive"]["count"] >= 2
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_batch_error_reporting():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller("foo", prefix="test", transport=transport)
+
+    client = Mock()
+    tracer = Mock()
+    poller.add_listener(RavenListener(client))
+    poller.add_listener(DatadogListener(tracer))
+
+    @poller.batch_handler("my_event", max_size=2, max_wait=0.1)
+    def handle_my_events(items):
+        raise BatchHandlerError(
+            {
+                j: ValueError(item["i"])
+                for j, item in enumerate(items)
+                if item["i"]
+            }
+        )
+
+    poller.ensure_queue()
+    Topic("test--my_event", transport=transport).publish_many(
+        [{"i": 0}, {"i": 1}, {"i": 2}]
+    )
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 5
+    while client.captureException.call_count < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    # each failed message is reported once
+    reported = sorted(
+        call.kwargs["extra"]["payload"]["message"]["i"]
+        for call in client.captureException.call_args_list
+    )
+    assert reported == [1, 2]
+
+    span = tracer.trace.return_value
+    errors = sum(
+        call.args[1]
+        for call in span.set_metric.call_args_list
+        if call.args[0] == "tqp.batch.errors"
+    )
+    assert errors == 2
@@ -0,0 +1,128 @@
+import pytest
+import time
+from threading import Thread
+
+from tqp.memory import MemoryTransport, QueueDoesNotExist
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller, create_queue
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def transport():
+    return MemoryTransport(max_wait_time=0.1)
+
+
+def test_visibility_timeout(transport):
+    queue = create_queue("foo", tags={}, transport=transport)
+    queue.send_message(MessageBody="a")
+
+    (msg,) = queue.receive_messages(VisibilityTimeout=0.1)
+    assert msg.body == "a"
+    assert msg.attributes["ApproximateReceiveCount"] == "1"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "1"
+    assert queue.receive_messages() == []
+
+    # redelivered once its visibility timeout runs out
+    (msg,) = queue.receive_messages(WaitTimeSeconds=1)
+    assert msg.attributes["ApproximateReceiveCount"] == "2"
+
+    msg.change_visibility(VisibilityTimeout=0)
+    (msg,) = queue.receive_messages()
+    response = queue.delete_messages(
+        Entries=[
+            {"Id": "0", "ReceiptHandle": msg.receipt_handle},
+            {"Id": "1", "ReceiptHandle": "invalid"},
+        ]
+    )
+    assert response["Successful"] == [{"Id": "0"}]
+    assert response["Failed"][0]["Id"] == "1"
+
+    assert queue.attributes["ApproximateNumberOfMessages"] == "0"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_redrive(transport):
+    queue = create_queue(
+        "foo",
+        tags={},
+        transport=transport,
+        RedrivePolicy={"maxReceiveCount": 2},
+    )
+    queue.send_message(MessageBody="a")
+
+    for _ in range(2):
+        (msg,) = queue.receive_messages()
+        msg.change_visibility(VisibilityTimeout=0)
+
+    assert queue.receive_messages() == []
+
+    dead_letter_queue = transport.get_queue("foo-dead-letter")
+    (msg,) = dead_letter_queue.receive_messages()
+    assert msg.body == "a"
+
+    with pytest.raises(QueueDoesNotExist):
+        transport.get_queue("bar")
+
+
+def test_fifo_groups(transport):
+    queue = create_queue("foo.fifo", tags={}, transport=transport)
+    for body, group in [("a1", "a"), ("b1", "b"), ("a2", "a")]:
+        queue.send_message(
+            MessageBody=body, MessageGroupId=group, MessageDeduplicationId=body
+        )
+
+    # duplicates are dropped
+    queue.send_message(
+        MessageBody="a1", MessageGroupId="a", MessageDeduplicationId="a1"
+    )
+
+    a1, b1 = queue.receive_messages(MaxNumberOfMessages=2)
+    assert (a1.body, b1.body) == ("a1", "b1")
+
+    # a2 waits for a1 to be deleted
+    assert queue.receive_messages() == []
+    a1.delete()
+    (a2,) = queue.receive_messages(MaxNumberOfMessages=10)
+    assert a2.body == "a2"
+
+
+def test_poller(transport):
+    poller = TopicQueuePoller("foo", prefix="test", transport=transport)
+    raw_poller = TopicQueuePoller(
+        "bar", prefix="test", transport=transport, raw_message_delivery=True
+    )
+
+    handled = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        handled.append(("foo", item))
+
+    @raw_poller.handler("my_event")
+    def handle_raw_my_event(item):
+        handled.append(("bar", item))
+
+    threads = []
+    for each in (poller, raw_poller):
+        each.ensure_queue()
+        threads.append(Thread(target=each.start, daemon=True))
+        threads[-1].start()
+
+    started_at = time.monotonic()
+    Topic("test--my_event", transport=transport).publish({"foo": 1})
+    while len(handled) < 2 and time.monotonic() - started_at < 5:
+        time.sleep(0.01)
+
+    assert sorted(handled) == [("bar", {"foo": 1}), ("foo", {"foo": 1})]
+
+    poller.stop()
+    raw_poller.stop()
+    for thread in threads:
+        thread.join(1)
+        assert not thread.is_alive()
+
+    queue = transport.get_queue("test--foo")
+    assert queue.attributes["ApproximateNumberOfMessages"] == "0"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
@@ -0,0 +1,201 @@
+import pytest
+import signal
+import time
+from contextlib import ExitStack
+from threading import Thread
+
+from tqp.asyncio import AsyncTopicQueuePoller
+from tqp.diagnostics import SamplingProfiler
+from tqp.memory import MemoryTransport
+from tqp.multi import MultiQueuePoller, WeightedScheduler
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+
+def get_order(scheduler, count):
+    order = []
+    for _ in range(count):
+        state, task = scheduler._next()
+        order.append(task)
+    return order
+
+
+def test_scheduler_priority():
+    scheduler = WeightedScheduler()
+    low = scheduler.add_queue("low", max_concurrency=10)
+    high = scheduler.add_queue("high", priority=1, max_concurrency=10)
+
+    for i in range(2):
+        scheduler.submit(low, f"low{i}")
+        scheduler.submit(high, f"high{i}")
+
+    assert get_order(scheduler, 4) == ["high0", "high1", "low0", "low1"]
+    assert scheduler._next() == (None, None)
+
+
+def test_scheduler_weights():
+    scheduler = WeightedScheduler()
+    a = scheduler.add_queue("a", max_concurrency=100)
+    b = scheduler.add_queue("b", weight=3, max_concurrency=100)
+
+    for i in range(40):
+        scheduler.submit(a, "a")
+        scheduler.submit(b, "b")
+
+    assert get_order(scheduler, 8) == ["a", "b", "b", "b"] * 2
+
+    # a new or idle queue gets its share from then on, rather than catching
+    # up on the time the others ran
+    c = scheduler.add_queue("c", max_concurrency=100)
+    for i in range(40):
+        scheduler.submit(c, "c")
+
+    order = get_order(scheduler, 20)
+    assert (order.count("a"), order.count("b"), order.count("c")) == (4, 12, 4)
+
+
+def test_scheduler_max_concurrency():
+    scheduler = WeightedScheduler()
+    high = scheduler.add_queue("high", priority=1, max_concurrency=1)
+    low = scheduler.add_queue("low", max_concurrency=10)
+
+    for i in range(2):
+        scheduler.submit(high, f"high{i}")
+        scheduler.submit(low, f"low{i}")
+
+    assert get_order(scheduler, 3) == ["high0", "low0", "low1"]
+    assert scheduler._next() == (None, None)
+
+    scheduler._finish(high)
+    assert scheduler._next() == (high, "high1")
+
+
+def test_scheduler_invalid_weight():
+    with pytest.raises(ValueError):
+        WeightedScheduler().add_queue("a", weight=0, max_concurrency=1)
+
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def transport():
+    return MemoryTransport(max_wait_time=0.1)
+
+
+def test_multi_queue_poller(transport):
+    multi = MultiQueuePoller(concurrency=2)
+    foo = multi.add(
+        TopicQueuePoller("foo", prefix="test", transport=transport),
+        priority=1,
+    )
+    bar = multi.add(
+        TopicQueuePoller(
+            "bar", prefix="test", transport=transport, concurrency=1
+        ),
+        weight=2,
+    )
+
+    handled = []
+    running = []
+
+    @foo.handler("foo_event")
+    def handle_foo(item):
+        handled.append(("foo", item))
+
+    @bar.handler("bar_event")
+    def handle_bar(item):
+        running.append(item)
+        # bar handles one message at a time, whatever the shared pool size
+        assert len(running) == 1
+        time.sleep(0.01)
+        handled.append(("bar", item))
+        running.remove(item)
+
+    for poller in (foo, bar):
+        poller.ensure_queue()
+
+    thread = Thread(target=multi.start, kwargs={"ensure_queue": False})
+    thread.daemon = True
+    thread.start()
+
+    for i in range(3):
+        Topic("test--foo_event", transport=transport).publish(i)
+        Topic("test--bar_event", transport=transport).publish(i)
+
+    started_at = time.monotonic()
+    while len(handled) < 6 and time.monotonic() - started_at < 5:
+        time.sleep(0.01)
+
+    assert sorted(handled) == [
+        ("bar", 0),
+        ("bar", 1),
+        ("bar", 2),
+        ("foo", 0),
+        ("foo", 1),
+        ("foo", 2),
+    ]
+
+    multi.stop()
+    thread.join(2)
+    assert not thread.is_alive()
+
+    for name in ("test--foo", "test--bar"):
+        queue = transport.get_queue(name)
+        assert queue.attributes["ApproximateNumberOfMessages"] == "0"
+        assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_multi_queue_poller_unsupported():
+    multi = MultiQueuePoller(concurrency=2)
+
+    with pytest.raises(ValueError):
+        multi.add(
+            TopicQueuePoller(
+                "foo", prefix="test", concurrency=1, max_concurrency=4
+            )
+        )
+    with pytest.raises(TypeError):
+        multi.add(AsyncTopicQueuePoller("foo", prefix="test"))
+
+
+def test_multi_queue_poller_profiler_signal(tmp_path):
+    shared_profiler = SamplingProfiler(str(tmp_path))
+    profiler = SamplingProfiler(str(tmp_path))
+
+    multi = MultiQueuePoller(concurrency=2)
+    for name, each in (
+        ("foo", shared_profiler),
+        ("bar", shared_profiler),
+        ("baz", profiler),
+    ):
+        multi.add(TopicQueuePoller(name, prefix="test", profiler=each))
+
+    handler = signal.getsignal(signal.SIGUSR2)
+    with ExitStack() as stack:
+        multi._install_signal_handlers(stack)
+        signal.raise_signal(signal.SIGUSR2)
+
+        # each profiler is toggled once
+        assert shared_profiler.enabled
+        assert profiler.enabled
+
+    assert signal.getsignal(signal.SIGUSR2) is handler
+
+
+def test_multi_queue_poller_stop_before_start():
+    transport = MemoryTransport(max_wait_time=0.1)
+    multi = MultiQueuePoller(concurrency=2)
+    poller = multi.add(
+        TopicQueuePoller("foo", prefix="test", transport=transport)
+    )
+    poller.ensure_queue()
+
+    multi.stop()
+    thread = Thread(target=multi.start, kwargs={"ensure_queue": False})
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not poller._stopping.is_set()
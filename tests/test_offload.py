@@ -0,0 +1,68 @@
+import boto3
+from moto import mock_aws
+
+from tqp.topic import Topic
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+
+@mock_aws
+def test_offload():
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="offload")
+
+    poller = TopicQueuePoller("foo")
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        handled_items.append(item)
+
+    queue = poller.ensure_queue()
+
+    topic = Topic("my_event", offload_bucket="offload", offload_threshold=20)
+    topic.publish({"small": True})
+    topic.publish({"large": "x" * 100})
+
+    # only the large message is stored on S3
+    objects = s3.list_objects_v2(Bucket="offload")["Contents"]
+    assert len(objects) == 1
+    assert objects[0]["Key"].startswith("tqp-offload/my_event/")
+
+    for msg in queue.receive_messages(MaxNumberOfMessages=10):
+        poller._handle_message(msg)
+
+    assert sorted(handled_items, key=len) == [
+        {"small": True},
+        {"large": "x" * 100},
+    ]
+
+
+@mock_aws
+def test_offload_lifecycle():
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="offload")
+    s3.put_bucket_lifecycle_configuration(
+        Bucket="offload",
+        LifecycleConfiguration={
+            "Rules": [
+                {
+                    "ID": "other",
+                    "Filter": {"Prefix": "other/"},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 30},
+                }
+            ]
+        },
+    )
+
+    topic = Topic("my_event", offload_bucket="offload")
+    topic.configure_offload_lifecycle(1)
+    topic.configure_offload_lifecycle(2)
+
+    rules = s3.get_bucket_lifecycle_configuration(Bucket="offload")["Rules"]
+    assert {rule["ID"]: rule["Expiration"]["Days"] for rule in rules} == {
+        "other": 30,
+        "tqp-offload-tqp-offload/my_event/": 2,
+    }
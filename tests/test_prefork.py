@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import pytest
+import time
+from threading import Thread
+
+from tqp.cli import get_parser, load_poller, main
+from tqp.memory import MemoryTransport
+from tqp.multi import MultiQueuePoller
+from tqp.prefork import Supervisor
+from tqp.topic_queue_poller import TopicQueuePoller
+
+# -----------------------------------------------------------------------------
+
+poller = TopicQueuePoller("foo", prefix="test")
+
+transport = MemoryTransport(max_wait_time=0.1)
+multi = MultiQueuePoller(concurrency=2)
+multi.add(TopicQueuePoller("foo", prefix="test", transport=transport))
+multi.add(TopicQueuePoller("bar", prefix="test", transport=transport))
+
+
+class CrashingPoller:
+    queue_name = "crashing"
+
+    def __init__(self):
+        self.ensured = 0
+        self.started = multiprocessing.get_context("fork").Value("i", 0)
+
+    def ensure_queue(self):
+        self.ensured += 1
+
+    def start(self, ensure_queue=True):
+        assert not ensure_queue
+
+        with self.started.get_lock():
+            self.started.value += 1
+        os._exit(1)
+
+
+# -----------------------------------------------------------------------------
+
+
+def test_load_poller():
+    assert load_poller("tests.test_prefork:poller") is poller
+
+    with pytest.raises(ValueError):
+        load_poller("tests.test_prefork")
+
+
+def test_parser():
+    args = get_parser().parse_args(
+        ["run", "tests.test_prefork:poller", "--processes", "4"]
+    )
+
+    assert args.poller == "tests.test_prefork:poller"
+    assert args.processes == 4
+    assert args.threads is None
+
+
+def test_supervisor_restarts_workers():
+    crashing_poller = CrashingPoller()
+    supervisor = Supervisor(crashing_poller, 2, restart_delay=0.05)
+
+    t = Thread(target=supervisor.run, daemon=True)
+    t.start()
+
+    time.sleep(0.5)
+    supervisor.stop()
+    t.join(5)
+
+    assert not t.is_alive()
+    assert crashing_poller.ensured == 1
+    assert crashing_poller.started.value > 2
+
+
+def test_multi_queue_poller_cli():
+    main(["provision", "tests.test_prefork:multi"])
+    assert {"test--foo", "test--bar"} <= set(transport.queues)
+
+    t = Thread(
+        target=main,
+        args=(["run", "tests.test_prefork:multi", "--threads", "4"],),
+        daemon=True,
+    )
+    t.start()
+
+    time.sleep(0.2)
+    assert multi.concurrency == 4
+    multi.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+
+def test_supervisor_multi_queue_poller():
+    supervisor = Supervisor(multi, 2)
+
+    t = Thread(target=supervisor.run, daemon=True)
+    t.start()
+
+    time.sleep(0.5)
+    workers = list(supervisor.workers.values())
+    alive = [process.is_alive() for process in workers]
+
+    supervisor.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+    assert alive == [True, True]
+    assert workers[0].name == "tqp-test--foo+test--bar-worker-0"
+    assert [process.exitcode for process in workers] == [0, 0]
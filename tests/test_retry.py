@@ -0,0 +1,96 @@
+import boto3
+import json
+import time
+from moto import mock_aws
+from threading import Thread
+
+from tqp.retry import DEAD_LETTER, RetryPolicy
+from tqp.topic_queue_poller import TopicQueuePoller
+
+from .helpers import wait_for
+
+# -----------------------------------------------------------------------------
+
+
+class TransientError(Exception):
+    pass
+
+
+class PoisonError(Exception):
+    pass
+
+
+def test_retry_policy():
+    policy = RetryPolicy(
+        base_delay=2,
+        max_delay=30,
+        jitter=0,
+        transient=(TransientError,),
+        dead_letter=(PoisonError,),
+    )
+
+    assert [policy.get_delay(ValueError(), i) for i in range(1, 6)] == [
+        2,
+        4,
+        8,
+        16,
+        30,
+    ]
+    assert policy.get_delay(TransientError(), 3) == 0
+    assert policy.get_delay(PoisonError(), 1) is DEAD_LETTER
+
+    assert 2 <= RetryPolicy(base_delay=2).get_delay(ValueError(), 1) <= 2.2
+
+
+@mock_aws
+def test_poller_retry():
+    poller = TopicQueuePoller(
+        "retry",
+        prefix="test",
+        retry_policy=RetryPolicy(
+            transient=(TransientError,), dead_letter=(PoisonError,)
+        ),
+        wait_time_seconds=1,
+    )
+
+    attempts = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        attempts.append(item)
+        if item["error"] == "transient" and len(attempts) == 1:
+            raise TransientError()
+        if item["error"] == "poison":
+            raise PoisonError()
+
+    thread = Thread(target=poller.start, daemon=True)
+    thread.start()
+    time.sleep(0.5)
+
+    sns = boto3.client("sns")
+    sns.publish(
+        TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+        Message=json.dumps({"error": "transient"}),
+    )
+    wait_for(lambda: len(attempts) == 2)
+
+    # retried right away, rather than after the visibility timeout
+    assert attempts == [{"error": "transient"}, {"error": "transient"}]
+
+    sns.publish(
+        TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+        Message=json.dumps({"error": "poison"}),
+    )
+    time.sleep(0.5)
+
+    assert len(attempts) == 3
+
+    dead_letter_queue = boto3.resource("sqs").get_queue_by_name(
+        QueueName="test--retry-dead-letter"
+    )
+    (msg,) = dead_letter_queue.receive_messages(MessageAttributeNames=["All"])
+    assert json.loads(json.loads(msg.body)["Message"]) == {"error": "poison"}
+
+    poller.stop()
+    thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,72 @@
+import time
+from threading import BoundedSemaphore
+
+from tqp.threading_utils import Batcher, ResizableSemaphore, acquire_up_to
+
+# -----------------------------------------------------------------------------
+
+
+def test_acquire_up_to():
+    semaphore = BoundedSemaphore(3)
+
+    assert acquire_up_to(semaphore, 2) == 2
+    assert acquire_up_to(semaphore, 2) == 1
+    assert not semaphore.acquire(blocking=False)
+
+
+def test_batcher_max_size():
+    batches = []
+
+    with Batcher(batches.append, max_size=2, max_wait=10) as batcher:
+        for i in range(5):
+            batcher.add(i)
+
+        time.sleep(0.1)
+        assert batches == [[0, 1], [2, 3]]
+
+    # the remaining item is flushed on close
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+def test_batcher_max_wait():
+    batches = []
+
+    with Batcher(batches.append, max_size=10, max_wait=0.1) as batcher:
+        batcher.add(1)
+        batcher.add(2)
+        assert batches == []
+
+        time.sleep(0.3)
+        assert batches == [[1, 2]]
+
+
+def test_batcher_flush():
+    batches = []
+
+    with Batcher(batches.append, max_size=10, max_wait=10) as batcher:
+        batcher.add(1)
+        batcher.add(2)
+
+        assert batcher.flush(timeout=1)
+        assert batches == [[1, 2]]
+
+        # nothing to flush
+        assert batcher.flush(timeout=1)
+
+
+def test_resizable_semaphore():
+    semaphore = ResizableSemaphore(2)
+
+    assert acquire_up_to(semaphore, 3) == 2
+    assert not semaphore.acquire(blocking=False)
+
+    semaphore.resize(3)
+    assert semaphore.acquire(blocking=False)
+
+    # slots acquired beyond the new size must be released first
+    semaphore.resize(1)
+    semaphore.release()
+    semaphore.release()
+    assert not semaphore.acquire(timeout=0.01)
+    semaphore.release()
+    assert semaphore.acquire(blocking=False)
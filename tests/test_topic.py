@@ -0,0 +1,84 @@
+import boto3
+import json
+import pytest
+from moto import mock_aws
+from unittest.mock import Mock
+
+from tqp import aws
+from tqp.exceptions import PublishBatchError
+from tqp.topic import Topic
+
+# -----------------------------------------------------------------------------
+
+
+def receive_all(queue):
+    bodies = []
+    while True:
+        messages = queue.receive_messages(MaxNumberOfMessages=10)
+        if not messages:
+            return bodies
+
+        bodies.extend(json.loads(msg.body)["Message"] for msg in messages)
+
+
+@pytest.fixture
+def queue():
+    with mock_aws():
+        sns = boto3.resource("sns")
+        sqs = boto3.resource("sqs")
+
+        queue = sqs.create_queue(QueueName="foo")
+        sns.create_topic(Name="my_event").subscribe(
+            Protocol="sqs", Endpoint=queue.attributes["QueueArn"]
+        )
+        yield queue
+
+
+def test_publish(queue):
+    Topic("my_event").publish({"bar": "baz"})
+
+    assert receive_all(queue) == ['{"bar": "baz"}']
+
+
+def test_publish_many(queue):
+    message_ids = Topic("my_event").publish_many({"i": i} for i in range(25))
+
+    assert len(set(message_ids)) == 25
+    assert sorted(json.loads(body)["i"] for body in receive_all(queue)) == (
+        list(range(25))
+    )
+
+
+def test_publish_many_errors(queue):
+    topic = Topic("my_event")
+    aws.get_client("sns").publish_batch = Mock(
+        return_value={
+            "Successful": [{"Id": "0", "MessageId": "message-id"}],
+            "Failed": [
+                {"Id": "1", "Code": "InternalError", "SenderFault": False}
+            ],
+        }
+    )
+
+    with pytest.raises(PublishBatchError) as excinfo:
+        topic.publish_many(["foo", "bar"])
+
+    assert list(excinfo.value.errors) == [1]
+    assert excinfo.value.errors[1].code == "InternalError"
+    assert excinfo.value.results[0] == "message-id"
+
+
+def test_publisher(queue):
+    with Topic("my_event").publisher(linger_ms=10000) as publisher:
+        futures = [publisher.publish({"i": i}) for i in range(15)]
+
+        # the first batch is full, the rest waits for more messages
+        futures[9].result(timeout=1)
+        assert not futures[10].done()
+
+        publisher.flush()
+        assert all(future.done() for future in futures)
+
+    assert sorted(json.loads(body)["i"] for body in receive_all(queue)) == (
+        list(range(15))
+    )
@@ -1,11 +1,16 @@
 import boto3
 import json
 import moto
+import pytest
+import re
 import time
 from moto import mock_aws
-from threading import Thread
-from unittest.mock import Mock
+from threading import Barrier, Thread
+from unittest.mock import Mock, patch
 
+from tqp.exceptions import BatchHandlerError, InvalidMessageError
+from tqp.memory import MemoryTransport
+from tqp.topic import Topic
 from tqp.topic_queue_poller import TopicQueuePoller, create_queue
 
 # -----------------------------------------------------------------------------
@@ -40,7 +45,7 @@ def test_create_queue():
 
 @mock_aws
 def test_tqp():
-    poller = TopicQueuePoller("foo", prefix="test")
+    poller = TopicQueuePoller("foo", prefix="test", wait_time_seconds=1)
 
     handled_item = None
 
@@ -65,13 +70,17 @@ def test_tqp():
 
     assert handled_item == {"bar": "baz"}
 
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
+
 
 @mock_aws
 def test_s3():
     s3 = boto3.client("s3")
     s3.create_bucket(Bucket="bucket_foo")
 
-    poller = TopicQueuePoller("foo", prefix="test")
+    poller = TopicQueuePoller("foo", prefix="test", wait_time_seconds=1)
 
     handled_item = None
 
@@ -120,3 +129,401 @@ def test_s3():
             "QueueArn": "arn:aws:sqs:us-east-1:123456789012:test--foo",
         }
     ]
+
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+
+@mock_aws
+def test_concurrency():
+    poller = TopicQueuePoller(
+        "foo", prefix="test", concurrency=2, wait_time_seconds=1
+    )
+
+    barrier = Barrier(2, timeout=5)
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        # both messages have to be handled at the same time to get past this
+        barrier.wait()
+        handled_items.append(item)
+
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+
+    # making sure poller is polling
+    time.sleep(0.5)
+
+    for i in range(2):
+        boto3.client("sns").publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+            Message=json.dumps({"i": i}),
+        )
+
+    # making sure messages are processed
+    time.sleep(1)
+
+    assert sorted(item["i"] for item in handled_items) == [0, 1]
+
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+
+@mock_aws
+def test_delete_messages():
+    poller = TopicQueuePoller("foo", prefix="test", delete_max_wait=0.2)
+    queue = poller.ensure_queue()
+
+    for i in range(3):
+        queue.send_message(MessageBody=json.dumps({"i": i}))
+
+    messages = queue.receive_messages(MaxNumberOfMessages=3)
+    assert len(messages) == 3
+
+    poller.delete_messages(queue, messages)
+
+    queue.reload()
+    assert queue.attributes["ApproximateNumberOfMessages"] == "0"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_delete_messages_partial_failure(caplog):
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller("foo", prefix="test", transport=transport)
+    queue = poller.ensure_queue()
+
+    for i in range(2):
+        queue.send_message(MessageBody=json.dumps({"i": i}))
+
+    messages = queue.receive_messages(MaxNumberOfMessages=2)
+    invalid = Mock(message_id="invalid", receipt_handle="invalid")
+
+    poller.delete_messages(queue, [messages[0], invalid, messages[1]])
+
+    # invalid receipt handles are only logged
+    assert "could not delete message invalid" in caplog.text
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+    # other failures are retried one message at a time
+    queue.send_message(MessageBody=json.dumps({"i": 2}))
+    (msg,) = queue.receive_messages()
+    failure = {"Id": "0", "SenderFault": False, "Code": "InternalError"}
+
+    with patch.object(
+        queue, "delete_messages", return_value={"Failed": [failure]}
+    ):
+        poller.delete_messages(queue, [msg])
+
+    assert queue.attributes["ApproximateNumberOfMessages"] == "0"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+@mock_aws
+def test_prefetch():
+    poller = TopicQueuePoller(
+        "foo",
+        prefix="test",
+        concurrency=2,
+        receivers=2,
+        receive_batch_size=10,
+        wait_time_seconds=1,
+    )
+    assert poller.max_in_flight == 20
+
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        handled_items.append(item)
+
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+
+    # making sure poller is polling
+    time.sleep(0.5)
+
+    for i in range(15):
+        boto3.client("sns").publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+            Message=json.dumps({"i": i}),
+        )
+
+    # making sure messages are processed
+    time.sleep(1)
+
+    assert sorted(item["i"] for item in handled_items) == list(range(15))
+
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+
+def test_receive_batch_size():
+    with pytest.raises(ValueError):
+        TopicQueuePoller("foo", receive_batch_size=11)
+
+
+@mock_aws
+def test_batch_handler():
+    poller = TopicQueuePoller(
+        "foo", prefix="test", max_in_flight=10, wait_time_seconds=1
+    )
+    poller.handle_error = Mock()
+
+    handled_batches = []
+
+    @poller.batch_handler("my_event", max_size=5, max_wait=0.5)
+    def handle_my_events(items):
+        handled_batches.append(sorted(item["i"] for item in items))
+
+        failed = [j for j, item in enumerate(items) if item["i"] == 3]
+        raise BatchHandlerError({j: ValueError("failed") for j in failed})
+
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+
+    # making sure poller is polling
+    time.sleep(0.5)
+
+    for i in range(5):
+        boto3.client("sns").publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+            Message=json.dumps({"i": i}),
+        )
+
+    # making sure messages are processed
+    time.sleep(1.5)
+
+    assert sorted(i for batch in handled_batches for i in batch) == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+    assert len(handled_batches) < 5
+
+    # only the failed message is left in the queue
+    poller.handle_error.assert_called_once()
+    assert json.loads(
+        json.loads(poller.handle_error.call_args[0][1].body)["Message"]
+    ) == {"i": 3}
+
+    poller.queue.reload()
+    attributes = poller.queue.attributes
+    assert attributes["ApproximateNumberOfMessagesNotVisible"] == "1"
+
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
+
+
+@mock_aws
+def test_ensure_queue_fingerprint():
+    poller = TopicQueuePoller("foo", prefix="test")
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        pass
+
+    poller.ensure_queue()
+
+    provision_queue = patch.object(poller, "provision_queue")
+    tag_queue = patch.object(poller.transport, "tag_queue")
+
+    with provision_queue as provision_queue, tag_queue:
+        # nothing changed
+        poller.ensure_queue()
+        provision_queue.assert_not_called()
+
+        @poller.handler("my_other_event")
+        def handle_my_other_event(item):
+            pass
+
+        poller.ensure_queue()
+        provision_queue.assert_called_once()
+
+    poller.ensure_queue()
+
+    subscriptions = boto3.client("sns").list_subscriptions()["Subscriptions"]
+    assert sorted(sub["TopicArn"] for sub in subscriptions) == [
+        "arn:aws:sns:us-east-1:123456789012:test--my_event",
+        "arn:aws:sns:us-east-1:123456789012:test--my_other_event",
+    ]
+
+
+@mock_aws
+def test_raw_message_delivery():
+    poller = TopicQueuePoller("foo", prefix="test", raw_message_delivery=True)
+
+    handled_items = []
+
+    @poller.handler("my_event", with_meta=True)
+    def handle_my_event(item, meta):
+        handled_items.append((item, meta["topic"]))
+
+    queue = poller.ensure_queue()
+
+    subscription = boto3.client("sns").list_subscriptions()["Subscriptions"][0]
+    assert (
+        boto3.client("sns").get_subscription_attributes(
+            SubscriptionArn=subscription["SubscriptionArn"]
+        )["Attributes"]["RawMessageDelivery"]
+        == "true"
+    )
+
+    Topic("test--my_event").publish({"bar": "baz"})
+
+    (msg,) = queue.receive_messages(MessageAttributeNames=["All"])
+    assert json.loads(msg.body) == {"bar": "baz"}
+
+    poller._handle_message(msg)
+    assert handled_items == [({"bar": "baz"}, "my_event")]
+
+
+@mock_aws
+def test_pattern_handlers():
+    sns = boto3.client("sns")
+    sns.create_topic(Name="test--widgets--created")
+    sns.create_topic(Name="test--widgets--deleted")
+    sns.create_topic(Name="test--gadgets--created")
+
+    poller = TopicQueuePoller("foo", prefix="test")
+
+    @poller.handler("widgets--created")
+    def handle_widget_created(item):
+        pass
+
+    @poller.handler("widgets--*")
+    def handle_widget_event(item):
+        pass
+
+    @poller.handler(re.compile(r"gadgets--\w+"))
+    def handle_gadget_event(item):
+        pass
+
+    assert poller.get_route("test--widgets--created")[0] is (
+        handle_widget_created
+    )
+    assert poller.get_route("test--widgets--deleted")[0] is (
+        handle_widget_event
+    )
+    assert poller.get_route("test--gadgets--created")[0] is (
+        handle_gadget_event
+    )
+
+    with pytest.raises(InvalidMessageError):
+        poller.get_route("test--other")
+
+    @poller.default_handler()
+    def handle_other(item):
+        pass
+
+    assert poller.get_route("test--other")[0] is handle_other
+
+    with pytest.raises(ValueError):
+        poller.handler("widgets--*")(handle_other)
+
+    poller.ensure_queue()
+
+    subscriptions = sns.list_subscriptions()["Subscriptions"]
+    assert sorted(sub["TopicArn"].split(":")[-1] for sub in subscriptions) == [
+        "test--gadgets--created",
+        "test--widgets--created",
+        "test--widgets--deleted",
+    ]
+
+
+@mock_aws
+def test_stop():
+    poller = TopicQueuePoller("stop", prefix="test", max_in_flight=3)
+
+    handled_items = []
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        time.sleep(0.5)
+        handled_items.append(item)
+
+    queue = poller.ensure_queue()
+
+    sns = boto3.client("sns")
+    for i in range(3):
+        sns.publish(
+            TopicArn="arn:aws:sns:us-east-1:123456789012:test--my_event",
+            Message=json.dumps({"i": i}),
+        )
+
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+
+    # one message is being handled, while the others wait for a worker
+    time.sleep(0.2)
+    poller.stop()
+
+    t.join(5)
+    assert not t.is_alive()
+
+    # the running handler finished, and the others are available right away
+    assert len(handled_items) == 1
+    queue.reload()
+    assert queue.attributes["ApproximateNumberOfMessages"] == "2"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_stop_during_long_poll():
+    transport = MemoryTransport(max_wait_time=2)
+    poller = TopicQueuePoller(
+        "stop",
+        prefix="test",
+        transport=transport,
+        max_in_flight=5,
+        wait_time_seconds=2,
+    )
+
+    @poller.handler("my_event")
+    def handle_my_event(item):
+        time.sleep(0.5)
+
+    queue = poller.ensure_queue()
+    Topic("test--my_event", transport=transport).publish_many(range(3))
+
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+
+    # one message is being handled, and the receiver is long polling for more
+    time.sleep(0.2)
+    poller.stop()
+
+    # the others are returned without waiting for the long poll to end
+    time.sleep(0.1)
+    assert queue.attributes["ApproximateNumberOfMessages"] == "2"
+
+    t.join(5)
+    assert not t.is_alive()
+
+
+def test_stop_before_start():
+    transport = MemoryTransport(max_wait_time=0.1)
+    poller = TopicQueuePoller("stop", prefix="test", transport=transport)
+    poller.ensure_queue()
+
+    # a stop requested before the poller gets to start is not lost
+    poller.stop()
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+    t.join(5)
+    assert not t.is_alive()
+
+    # and the next run polls until stopped again
+    t = Thread(target=poller.start, daemon=True)
+    t.start()
+    time.sleep(0.2)
+    assert t.is_alive()
+
+    poller.stop()
+    t.join(5)
+    assert not t.is_alive()
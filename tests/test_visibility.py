@@ -0,0 +1,34 @@
+import boto3
+import time
+from moto import mock_aws
+
+from tqp.visibility import VisibilityManager
+
+# -----------------------------------------------------------------------------
+
+
+@mock_aws
+def test_visibility_manager():
+    sqs = boto3.resource("sqs")
+    queue = sqs.create_queue(
+        QueueName="foo", Attributes={"VisibilityTimeout": "2"}
+    )
+    queue.send_message(MessageBody="handled")
+    queue.send_message(MessageBody="in flight")
+
+    handled, in_flight = sorted(
+        queue.receive_messages(MaxNumberOfMessages=2),
+        key=lambda msg: msg.body,
+    )
+
+    with VisibilityManager(queue, 2) as visibility:
+        visibility.track(handled)
+        visibility.track(in_flight)
+        visibility.untrack(handled)
+        assert len(visibility) == 1
+
+        time.sleep(3)
+
+        # only the message that is still tracked is kept invisible
+        messages = queue.receive_messages(MaxNumberOfMessages=2)
+        assert [msg.body for msg in messages] == ["handled"]
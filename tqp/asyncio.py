@@ -0,0 +1,289 @@
+import asyncio
+import inspect
+import time
+from contextlib import ExitStack
+
+from .instrumentation import BUFFER, DECODE, HANDLER, VISIBILITY, emit
+from .threading_utils import Batcher
+from .topic_queue_poller import MAX_BATCH_SIZE, TopicQueuePoller
+from .visibility import VisibilityManager
+
+# -----------------------------------------------------------------------------
+
+
+async def _acquire_up_to(semaphore, count, timeout=None):
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        return 0
+
+    acquired = 1
+    while acquired < count and not semaphore.locked():
+        await semaphore.acquire()
+        acquired += 1
+
+    return acquired
+
+
+# -----------------------------------------------------------------------------
+
+
+class AsyncTopicQueuePoller(TopicQueuePoller):
+    """A poller that handles messages on an asyncio event loop.
+
+    Handlers can be coroutine functions, which run directly on the loop, or
+    regular functions, which run on the loop's default executor. The calls
+    to SQS, to S3 for offloaded messages and to the dedup store are done on
+    the default executor as well.
+    """
+
+    def __init__(
+        self,
+        *args,
+        concurrency=100,
+        receive_batch_size=MAX_BATCH_SIZE,
+        **kwargs,
+    ):
+        super().__init__(
+            *args,
+            concurrency=concurrency,
+            receive_batch_size=receive_batch_size,
+            **kwargs,
+        )
+
+        if self.autoscaling:
+            raise ValueError(
+                "autoscaling is not supported by the asyncio poller",
+            )
+        if self.fifo:
+            raise ValueError(
+                "FIFO queues are not supported by the asyncio poller",
+            )
+        if self.slow_handler_threshold or self.profiler is not None:
+            # handlers share the event loop's thread, so their stacks can't
+            # be told apart
+            raise ValueError(
+                "handler diagnostics are not supported by the asyncio poller",
+            )
+
+    def batch_handler(self, *topics, **kwargs):
+        raise TypeError(
+            "batch handlers are not supported by the asyncio poller",
+        )
+
+    async def _is_duplicate(self, msg, payload):
+        if self.dedup_store is None:
+            return False
+
+        return await asyncio.to_thread(super()._is_duplicate, msg, payload)
+
+    async def _mark_handled(self, msg, payload):
+        if self.dedup_store is not None:
+            await asyncio.to_thread(super()._mark_handled, msg, payload)
+
+    async def _handle_message(self, msg):
+        # offloaded messages are fetched from S3 while decoding
+        started_at = time.perf_counter()
+        payload = await asyncio.to_thread(self.get_message_payload, msg)
+        self.instrument(DECODE, time.perf_counter() - started_at)
+
+        if await self._is_duplicate(msg, payload):
+            return
+
+        emit(self, "handler_started", msg, payload)
+        started_at = time.perf_counter()
+        error = None
+        try:
+            await self.handle_message(msg, payload)
+
+            await self._mark_handled(msg, payload)
+            self.acknowledge(msg)
+        except Exception as e:
+            # whatever the error is, log and move on
+            error = e
+            self.handle_error(e, msg, payload)
+            await asyncio.to_thread(self.retry, e, msg, payload)
+
+        duration = time.perf_counter() - started_at
+        self.instrument(HANDLER, duration)
+        emit(self, "handler_finished", msg, payload, error, duration)
+
+    async def handle_message(self, msg, payload):
+        topic = payload["topic"]
+        handler = payload["handler"]
+        meta = payload["meta"]
+        message = payload["message"]
+
+        self.logger.info("%s: handling new message", topic)
+        self.logger.debug(msg.body)
+
+        extra_call_kwargs = {"meta": meta} if meta is not None else {}
+        if inspect.iscoroutinefunction(handler):
+            await handler(message, **extra_call_kwargs)
+        else:
+            await asyncio.to_thread(handler, message, **extra_call_kwargs)
+
+    async def _process_message(self, msg, running, received_at):
+        async with running:
+            with self._pending_lock:
+                # once stopping, messages not started yet are returned to
+                # the queue instead
+                if msg not in self._pending or self._stopping.is_set():
+                    return
+                self._pending.remove(msg)
+
+            try:
+                self.instrument(BUFFER, time.perf_counter() - received_at)
+                await self._handle_message(msg)
+            except Exception:
+                self.logger.exception("could not handle message %s", msg.body)
+            finally:
+                self._finish_message(msg)
+
+    async def _receive_messages(self, queue, running, in_flight, tasks):
+        while not self._stopping.is_set():
+            # time out now and then, to notice when the poller is stopped
+            num_slots = await _acquire_up_to(
+                in_flight, self.receive_batch_size, timeout=1
+            )
+            if not num_slots:
+                continue
+            if self._stopping.is_set():
+                for _ in range(num_slots):
+                    in_flight.release()
+                break
+
+            received = []
+            try:
+                received = await asyncio.to_thread(
+                    self.receive_messages, queue, num_slots
+                )
+            finally:
+                for _ in range(num_slots - len(received)):
+                    in_flight.release()
+
+            if self._stopping.is_set():
+                await self._return_messages(queue, received)
+                return
+
+            received_at = time.perf_counter()
+            for msg in received:
+                self._visibility.track(msg)
+
+                with self._pending_lock:
+                    self._pending.add(msg)
+                task = asyncio.create_task(
+                    self._process_message(msg, running, received_at)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def _run_receiver(self, queue, running, in_flight, tasks, errors):
+        try:
+            await self._receive_messages(queue, running, in_flight, tasks)
+        except Exception as e:
+            self.logger.exception("receiver failed, stopping")
+            errors.append(e)
+            self.stop()
+
+    async def _return_messages(self, queue, messages):
+        if not messages:
+            return
+
+        # the semaphores are released back on the loop, as they are not
+        # thread safe
+        await asyncio.to_thread(self._make_visible, queue, messages)
+        for msg in messages:
+            self._finish_message(msg)
+
+        self.logger.info("returned %s message(s) to the queue", len(messages))
+
+    async def _return_pending(self, queue):
+        with self._pending_lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        await self._return_messages(queue, pending)
+
+    async def _return_on_stop(self, queue):
+        # without waiting for the long polls in progress, which return what
+        # they receive themselves
+        while not self._stopping.is_set():
+            await asyncio.sleep(0.05)
+
+        await self._return_pending(queue)
+
+    async def _drain(self, queue, tasks):
+        # messages received just as the poller stopped may have been added
+        # since
+        await self._return_pending(queue)
+
+        if not tasks:
+            return
+
+        _, running = await asyncio.wait(
+            tasks, timeout=self._get_stop_timeout()
+        )
+        if running:
+            self.logger.warning(
+                "stopped with %s message(s) still being handled",
+                len(running),
+            )
+
+    async def start(self, *, ensure_queue=True):
+        try:
+            await self._poll(ensure_queue=ensure_queue)
+        finally:
+            # only once the run is over, so that stopping the poller before
+            # it gets to start still takes effect
+            self._stopping.clear()
+
+    async def _poll(self, *, ensure_queue):
+        self._ensure_max_pool_connections()
+        queue = await asyncio.to_thread(
+            self._get_or_ensure_queue, ensure_queue
+        )
+        self.logger.info("starting to poll")
+
+        # handlers running at the same time, and messages received and not
+        # yet handled
+        running = asyncio.Semaphore(self.concurrency)
+        in_flight = self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        self._deleter = Batcher(
+            lambda batch: self.delete_messages(queue, batch),
+            max_size=MAX_BATCH_SIZE,
+            max_wait=self.delete_max_wait,
+            name=f"tqp-{self.queue_name}-delete",
+        )
+
+        self._visibility = VisibilityManager(
+            queue,
+            int(queue.attributes["VisibilityTimeout"]),
+            instrument=lambda duration, count: self.instrument(
+                VISIBILITY, duration, count
+            ),
+            name=f"tqp-{self.queue_name}-visibility",
+        )
+
+        tasks = set()
+        errors = []
+        with ExitStack() as stack:
+            self._install_signal_handlers(stack)
+            stack.enter_context(self._deleter)
+            stack.enter_context(self._visibility)
+
+            await asyncio.gather(
+                self._return_on_stop(queue),
+                *(
+                    self._run_receiver(
+                        queue, running, in_flight, tasks, errors
+                    )
+                    for _ in range(self.receivers)
+                ),
+            )
+            await self._drain(queue, tasks)
+
+        if errors:
+            raise errors[0]
+
+        self.logger.info("stopped")
@@ -0,0 +1,121 @@
+import logging
+from threading import Condition, Event, Thread
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# -----------------------------------------------------------------------------
+
+
+class Autoscaler(Thread):
+    """Scale the receivers and handlers of a poller with the backlog.
+
+    Every `interval` seconds, the backlog is read from the queue's
+    `ApproximateNumberOfMessages`, or inferred from whether receives came back
+    full or empty when that fails. The number of messages in flight doubles
+    while there is a backlog, and halves while the queue is idle, within the
+    poller's bounds. Receivers are added or removed one at a time.
+    """
+
+    def __init__(self, poller, queue, *, interval, name=None):
+        super().__init__(name=name, daemon=True)
+        self.poller = poller
+        self.queue = queue
+        self.interval = interval
+
+        self.concurrency = poller.concurrency
+        self.receivers = poller.receivers
+
+        self.full_receives = 0
+        self.empty_receives = 0
+
+        self.condition = Condition()
+        self.finished = Event()
+
+    def record_receive(self, requested, received):
+        with self.condition:
+            if not received:
+                self.empty_receives += 1
+            elif received >= requested:
+                self.full_receives += 1
+
+    def wait_active(self, index):
+        """Block receiver `index` for as long as it is scaled down"""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: index < self.receivers or self.finished.is_set()
+            )
+
+    def get_backlog(self):
+        try:
+            attributes = self.poller.transport.get_queue_attributes(
+                self.queue, ["ApproximateNumberOfMessages"]
+            )
+        except Exception:
+            logger.exception("could not get the queue backlog")
+            return None
+
+        return int(attributes["ApproximateNumberOfMessages"])
+
+    def scale(self):
+        backlog = self.get_backlog()
+
+        with self.condition:
+            full_receives = self.full_receives
+            empty_receives = self.empty_receives
+            self.full_receives = self.empty_receives = 0
+
+            if backlog is not None:
+                scale_up = backlog >= self.poller._in_flight.value
+                scale_down = not backlog and not full_receives
+            else:
+                scale_up = full_receives and not empty_receives
+                scale_down = empty_receives and not full_receives
+
+            if scale_up:
+                concurrency = min(
+                    self.concurrency * 2, self.poller.max_concurrency
+                )
+                receivers = min(self.receivers + 1, self.poller.max_receivers)
+            elif scale_down:
+                concurrency = max(
+                    self.concurrency // 2, self.poller.concurrency
+                )
+                receivers = max(self.receivers - 1, self.poller.receivers)
+            else:
+                return
+
+            if (concurrency, receivers) == (self.concurrency, self.receivers):
+                return
+
+            logger.info(
+                "scaling to %s handler(s) and %s receiver(s), backlog: %s",
+                concurrency,
+                receivers,
+                backlog,
+            )
+            self.concurrency = concurrency
+            self.receivers = receivers
+            self.condition.notify_all()
+
+        self.poller._running.resize(concurrency)
+        self.poller._in_flight.resize(
+            self.poller.get_max_in_flight(concurrency, receivers)
+        )
+
+    def cancel(self):
+        self.finished.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            self.scale()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()
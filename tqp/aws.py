@@ -0,0 +1,113 @@
+import boto3
+import os
+from botocore.config import Config
+from threading import Lock, local
+
+from .fifo import is_fifo
+
+# -----------------------------------------------------------------------------
+
+DEFAULT_CONFIG = Config(
+    retries={"mode": "standard"},
+    tcp_keepalive=True,
+)
+
+# -----------------------------------------------------------------------------
+
+_lock = Lock()
+_config = DEFAULT_CONFIG
+_session = None
+_clients = {}
+_resources = local()
+_topic_arns = {}
+
+# -----------------------------------------------------------------------------
+
+
+def reset():
+    """Drop all cached clients, resources and topic ARNs"""
+    global _session, _resources
+
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources = local()
+        _topic_arns.clear()
+
+
+# connection pools must not be shared with forked processes
+os.register_at_fork(after_in_child=reset)
+
+
+def configure(config=None, **kwargs):
+    """Set the botocore config used by all clients.
+
+    `config` replaces the whole configuration, while keyword arguments are
+    merged into the current one, e.g. `configure(max_pool_connections=50)`.
+    """
+    global _config
+
+    with _lock:
+        _config = (config or _config).merge(Config(**kwargs))
+
+    reset()
+
+
+def ensure_max_pool_connections(max_pool_connections):
+    """Make sure clients can hold at least this many connections"""
+    current = _config.max_pool_connections or 10
+    if current < max_pool_connections:
+        configure(max_pool_connections=max_pool_connections)
+
+
+def _get_session():
+    global _session
+
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name):
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = _get_session().client(
+                service_name, config=_config
+            )
+
+        return _clients[service_name]
+
+
+def get_resource(service_name):
+    """Get a resource for the current thread, as they are not thread safe"""
+    resources = _resources
+    resource = getattr(resources, service_name, None)
+    if resource is not None:
+        return resource
+
+    with _lock:
+        resource = _get_session().resource(service_name, config=_config)
+
+    setattr(resources, service_name, resource)
+    return resource
+
+
+def get_topic_arn(topic_name):
+    """Get the ARN of a topic, creating it only the first time around"""
+    topic_arn = _topic_arns.get(topic_name)
+    if topic_arn is not None:
+        return topic_arn
+
+    kwargs = {}
+    if is_fifo(topic_name):
+        kwargs["Attributes"] = {"FifoTopic": "true"}
+
+    # create_topic is idempotent, and returns the ARN of existing topics
+    response = get_client("sns").create_topic(Name=topic_name, **kwargs)
+    topic_arn = response["TopicArn"]
+    _topic_arns[topic_name] = topic_arn
+    return topic_arn
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import importlib
+import inspect
+import logging
+import sys
+
+from .multi import MultiQueuePoller
+from .prefork import Supervisor
+
+# -----------------------------------------------------------------------------
+
+
+def load_poller(target):
+    """Import a poller from a `package.module:attribute` string"""
+    module_name, _, attribute = target.partition(":")
+    if not attribute:
+        raise ValueError(f"expected `module:attribute`, got {target!r}")
+
+    poller = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        poller = getattr(poller, name)
+
+    return poller
+
+
+def run(args):
+    poller = load_poller(args.poller)
+
+    if args.threads is not None:
+        if isinstance(poller, MultiQueuePoller):
+            # the pool shared by the pollers, which keep their own caps
+            poller.concurrency = args.threads
+        else:
+            poller.concurrency = args.threads
+            poller.max_concurrency = max(poller.max_concurrency, args.threads)
+            poller.max_in_flight = max(poller.max_in_flight, args.threads)
+
+    if args.processes > 1:
+        Supervisor(
+            poller,
+            args.processes,
+            shutdown_timeout=args.shutdown_timeout,
+            ensure_queue=args.provision,
+        ).run()
+        return
+
+    result = poller.start(ensure_queue=args.provision)
+    if inspect.iscoroutine(result):
+        asyncio.run(result)
+
+
+def provision(args):
+    poller = load_poller(args.poller)
+    poller.ensure_queue(force=args.force)
+
+
+# -----------------------------------------------------------------------------
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="tqp")
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        help="logging level (default: %(default)s)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="run a poller, or a multi-queue poller"
+    )
+    run_parser.add_argument(
+        "poller",
+        help="the poller to run, as `package.module:attribute`",
+    )
+    run_parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of worker processes (default: %(default)s)",
+    )
+    run_parser.add_argument(
+        "--threads",
+        type=int,
+        help="number of handler threads per process",
+    )
+    run_parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=30,
+        help=(
+            "seconds to wait for workers to exit before killing them "
+            "(default: %(default)s)"
+        ),
+    )
+    run_parser.add_argument(
+        "--no-provision",
+        dest="provision",
+        action="store_false",
+        help="assume the queue is provisioned, e.g. by `tqp provision`",
+    )
+    run_parser.set_defaults(func=run)
+
+    provision_parser = subparsers.add_parser(
+        "provision",
+        help="provision the queue and subscriptions of a poller",
+    )
+    provision_parser.add_argument(
+        "poller",
+        help="the poller to provision, as `package.module:attribute`",
+    )
+    provision_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="provision even if the configuration is unchanged",
+    )
+    provision_parser.set_defaults(func=provision)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+
+    # allow loading pollers from the current directory
+    sys.path.insert(0, "")
+
+    args.func(args)
@@ -0,0 +1,104 @@
+import base64
+import gzip
+import json
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# -----------------------------------------------------------------------------
+
+# message attribute holding the name of the topic a message was published on,
+# for routing messages delivered without the SNS envelope
+TOPIC_ATTRIBUTE = "tqp-topic"
+
+# message attribute naming the codec a message was encoded with. messages
+# without it are plain JSON
+CODEC_ATTRIBUTE = "tqp-codec"
+
+DEFAULT_CODEC = "json"
+
+# -----------------------------------------------------------------------------
+
+
+class JsonCodec:
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, data):
+        return json_loads(data)
+
+
+class MsgpackCodec:
+    def encode(self, message):
+        import msgpack
+
+        return base64.b64encode(msgpack.packb(message)).decode("ascii")
+
+    def decode(self, data):
+        import msgpack
+
+        return msgpack.unpackb(base64.b64decode(data))
+
+
+class CompressedCodec:
+    """Compress the output of another codec.
+
+    SNS messages must be text, so the compressed data is base64 encoded.
+    """
+
+    def __init__(self, codec, compress, decompress):
+        self.codec = codec
+        self.compress = compress
+        self.decompress = decompress
+
+    def encode(self, message):
+        data = self.compress(self.codec.encode(message).encode())
+        return base64.b64encode(data).decode("ascii")
+
+    def decode(self, data):
+        return self.codec.decode(
+            self.decompress(base64.b64decode(data)).decode()
+        )
+
+
+def _zstd_compress(data):
+    import zstandard
+
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# -----------------------------------------------------------------------------
+
+_codecs = {
+    "json": JsonCodec(),
+    "json+gzip": CompressedCodec(JsonCodec(), gzip.compress, gzip.decompress),
+    # requires zstandard
+    "json+zstd": CompressedCodec(
+        JsonCodec(), _zstd_compress, _zstd_decompress
+    ),
+    # requires msgpack
+    "msgpack": MsgpackCodec(),
+}
+
+
+def register_codec(name, codec):
+    """Register a codec, i.e. an object with `encode` and `decode` methods"""
+    if name in _codecs:
+        raise ValueError(f"Codec {name} already registered")
+
+    _codecs[name] = codec
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec {name}") from None
@@ -1,13 +1,47 @@
-from .topic_queue_poller import TopicQueuePoller
+from . import instrumentation
 
+# -----------------------------------------------------------------------------
 
-def install():
-    from ddtrace import tracer
 
-    base_handle_message = TopicQueuePoller.handle_message
+class DatadogListener(instrumentation.Listener):
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.spans = {}
+
+    def handler_started(self, poller, msg, payload):
+        self.spans[msg] = self.tracer.trace(
+            "tqp.message", poller.queue_name, payload["topic"]
+        )
+
+    def handler_finished(self, poller, msg, payload, error, duration):
+        span = self.spans.pop(msg, None)
+        if span is None:
+            return
+
+        if error is not None:
+            span.set_exc_info(type(error), error, error.__traceback__)
+        span.finish()
+
+    def batch_started(self, poller, messages, payloads):
+        self.spans[messages[0]] = self.tracer.trace(
+            "tqp.batch", poller.queue_name, payloads[0]["topic"]
+        )
 
-    def _hook_handle_message(self, msg, payload):
-        with tracer.trace("tqp.message", self.queue_name, payload["topic"]):
-            base_handle_message(self, msg, payload)
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        span = self.spans.pop(messages[0], None)
+        if span is None:
+            return
+
+        span.set_metric("tqp.batch.size", len(messages))
+        span.set_metric("tqp.batch.errors", len(errors))
+        if errors:
+            # a span holds a single error, the count covers the others
+            error = next(iter(errors.values()))
+            span.set_exc_info(type(error), error, error.__traceback__)
+        span.finish()
+
+
+def install():
+    from ddtrace import tracer
 
-    TopicQueuePoller.handle_message = _hook_handle_message
+    instrumentation.add_listener(DatadogListener(tracer))
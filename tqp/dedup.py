@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from .cache import TTLCache
+
+# -----------------------------------------------------------------------------
+
+
+class DedupStore:
+    """Record the ids of handled messages, so that redeliveries are skipped.
+
+    Subclasses implement `_contains` and `add`. The number of duplicates
+    found and of new messages checked are counted in `hits` and `misses`.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def _contains(self, message_id):
+        raise NotImplementedError()
+
+    def add(self, message_id):
+        raise NotImplementedError()
+
+    def seen(self, message_id):
+        seen = self._contains(message_id)
+
+        with self.lock:
+            if seen:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return seen
+
+
+class MemoryDedupStore(DedupStore):
+    """Keep the ids of the last `max_size` messages for `ttl` seconds"""
+
+    def __init__(self, max_size=10000, ttl=3600):
+        super().__init__()
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def _contains(self, message_id):
+        return message_id in self.cache
+
+    def add(self, message_id):
+        self.cache.set(message_id, True)
+
+
+class SQLiteDedupStore(DedupStore):
+    """Keep the ids of messages for `ttl` seconds in a SQLite database.
+
+    The database can be shared by the processes of a host, including the
+    workers forked by `tqp run --processes`, each of which opens its own
+    connection.
+    """
+
+    # expired ids are deleted once every this many additions
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, ttl=3600):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.additions = 0
+
+        self._connection = None
+        self._pid = None
+
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tqp_message_ids "
+                "(message_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+
+    @property
+    def connection(self):
+        # SQLite connections must not be used across fork(), so a forked
+        # process opens its own, leaving the parent's alone
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path,
+                timeout=30,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def _contains(self, message_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM tqp_message_ids "
+                "WHERE message_id = ? AND expires_at > ?",
+                (message_id, time.time()),
+            ).fetchone()
+
+        return row is not None
+
+    def add(self, message_id):
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tqp_message_ids VALUES (?, ?)",
+                (message_id, now + self.ttl),
+            )
+
+            self.additions += 1
+            if self.additions % self.PRUNE_EVERY == 0:
+                self.connection.execute(
+                    "DELETE FROM tqp_message_ids WHERE expires_at <= ?",
+                    (now,),
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,259 @@
+import logging
+import os
+import re
+import signal
+import sys
+import time
+import traceback
+from collections import Counter
+from threading import Condition, Event, Lock, Thread, get_ident
+
+from .instrumentation import Listener
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# -----------------------------------------------------------------------------
+
+
+def _get_topic(payloads):
+    return payloads[0].get("topic") or "unknown"
+
+
+def _get_folded_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+        frame = frame.f_back
+
+    return ";".join(reversed(stack))
+
+
+class _Handling:
+    __slots__ = ("thread_id", "started_at", "poller", "payloads", "warned")
+
+    def __init__(self, poller, payloads):
+        self.thread_id = get_ident()
+        self.started_at = time.monotonic()
+        self.poller = poller
+        self.payloads = payloads
+        self.warned = False
+
+
+class _HandlerTracker(Listener):
+    """Keep track of the handlers running, and the threads they run on"""
+
+    def __init__(self):
+        self.handling = {}
+        self.handling_lock = Lock()
+
+    def _start(self, key, poller, payloads):
+        with self.handling_lock:
+            self.handling[key] = _Handling(poller, payloads)
+
+    def _finish(self, key):
+        with self.handling_lock:
+            return self.handling.pop(key, None)
+
+    def _get_handling(self):
+        with self.handling_lock:
+            return list(self.handling.values())
+
+    def handler_started(self, poller, msg, payload):
+        self._start(msg, poller, [payload])
+
+    def handler_finished(self, poller, msg, payload, error, duration):
+        self._finish(msg)
+
+    def batch_started(self, poller, messages, payloads):
+        self._start(messages[0], poller, payloads)
+
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        self._finish(messages[0])
+
+
+# -----------------------------------------------------------------------------
+
+
+class SlowHandlerWatchdog(_HandlerTracker):
+    """Warn about handlers running for longer than `threshold` seconds.
+
+    The warning includes the stack of the handler's thread at the time, so
+    that it shows what the handler is stuck on. Handlers are checked every
+    `interval` seconds, and warned about once per message.
+    """
+
+    def __init__(self, threshold, *, interval=None, name=None):
+        super().__init__()
+        self.threshold = threshold
+        self.interval = interval or min(threshold / 4, 1)
+        self.name = name
+
+        self.thread = None
+        self.finished = Event()
+
+    def handler_finished(self, poller, msg, payload, error, duration):
+        handling = self._finish(msg)
+        if handling is not None and handling.warned:
+            poller.logger.info(
+                "%s: slow handler finished after %.1fs",
+                _get_topic([payload]),
+                duration,
+            )
+
+    def check(self):
+        now = time.monotonic()
+        frames = None
+
+        for handling in self._get_handling():
+            elapsed = now - handling.started_at
+            if handling.warned or elapsed < self.threshold:
+                continue
+
+            if frames is None:
+                frames = sys._current_frames()
+
+            frame = frames.get(handling.thread_id)
+            handling.warned = True
+            handling.poller.logger.warning(
+                "%s: handler has been running for %.1fs, past %.1fs of the "
+                "visibility timeout, in:\n%s",
+                _get_topic(handling.payloads),
+                elapsed,
+                self.threshold,
+                "".join(traceback.format_stack(frame)) if frame else "",
+            )
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            self.check()
+
+    def __enter__(self):
+        self.finished.clear()
+        self.thread = Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.finished.set()
+
+
+# -----------------------------------------------------------------------------
+
+
+class SamplingProfiler(_HandlerTracker):
+    """Sample the stacks of running handlers, while enabled.
+
+    Every `interval` seconds, the stack of each running handler is recorded
+    for its topic. When disabled, and when the poller stops, the samples are
+    written in `directory` as `<topic>.folded`, with one line per distinct
+    stack and its number of samples, the format flame graph tools such as
+    `flamegraph.pl` and speedscope take.
+
+    The profiler is toggled with `toggle`, or by sending `signum` to the
+    process of a poller it's passed to.
+    """
+
+    def __init__(self, directory, *, interval=0.05, signum=None):
+        super().__init__()
+        self.directory = directory
+        self.interval = interval
+        self.signum = signum or getattr(signal, "SIGUSR2", None)
+
+        # topic -> folded stack -> number of samples
+        self.samples = {}
+        self.enabled = False
+        self.finished = False
+        self.condition = Condition()
+        self.thread = None
+
+        # a profiler shared by pollers runs for as long as any of them does
+        self.entered = 0
+
+    def toggle(self):
+        with self.condition:
+            self.enabled = not self.enabled
+            self.condition.notify_all()
+
+        logger.info("profiler %s", "enabled" if self.enabled else "disabled")
+
+    def sample(self):
+        frames = sys._current_frames()
+
+        for handling in self._get_handling():
+            frame = frames.get(handling.thread_id)
+            if frame is None:
+                continue
+
+            topic = _get_topic(handling.payloads)
+            stacks = self.samples.setdefault(topic, Counter())
+            stacks[_get_folded_stack(frame)] += 1
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        for topic, stacks in self.samples.items():
+            filename = re.sub(r"[^\w.-]", "_", topic)
+            path = os.path.join(self.directory, f"{filename}.folded")
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        logger.info(
+            "wrote profiles of %s topic(s) to %s",
+            len(self.samples),
+            self.directory,
+        )
+        self.samples = {}
+
+    def run(self):
+        with self.condition:
+            while not self.finished:
+                if self.enabled:
+                    self.sample()
+                    self.condition.wait(self.interval)
+                    continue
+
+                if self.samples:
+                    self.write()
+                self.condition.wait()
+
+            if self.samples:
+                self.write()
+
+    def _handle_signal(self, signum, frame):
+        self.toggle()
+
+    def install_signal_handler(self, stack):
+        """Toggle the profiler on `signum`, until `stack` is closed"""
+        if self.signum is None:
+            return
+
+        handler = signal.signal(self.signum, self._handle_signal)
+        stack.callback(signal.signal, self.signum, handler)
+
+    def __enter__(self):
+        with self.condition:
+            self.entered += 1
+            if self.entered > 1:
+                return self
+
+            self.finished = False
+
+        self.thread = Thread(target=self.run, name="tqp-profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        with self.condition:
+            self.entered -= 1
+            if self.entered:
+                return
+
+            self.finished = True
+            self.condition.notify_all()
+
+        self.thread.join()
@@ -1,2 +1,34 @@
 class InvalidMessageError(Exception):
     pass
+
+
+class BatchHandlerError(Exception):
+    """Fail only some of the messages passed to a batch handler.
+
+    `errors` maps the index of each failed message in the batch to the
+    exception it failed with. The other messages are considered handled.
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class PublishError(Exception):
+    def __init__(self, message, *, code=None, sender_fault=None):
+        super().__init__(message)
+        self.code = code
+        self.sender_fault = sender_fault
+
+
+class PublishBatchError(Exception):
+    """Some of the messages in a batch could not be published.
+
+    `errors` maps the index of each failed message to its `PublishError`,
+    and `results` holds the message id or error of every message.
+    """
+
+    def __init__(self, errors, results):
+        super().__init__(errors)
+        self.errors = errors
+        self.results = results
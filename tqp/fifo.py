@@ -0,0 +1,87 @@
+import logging
+from collections import deque
+from threading import Lock
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+FIFO_SUFFIX = ".fifo"
+
+# -----------------------------------------------------------------------------
+
+
+def is_fifo(name):
+    return name.endswith(FIFO_SUFFIX)
+
+
+def get_dead_letter_queue_name(queue_name):
+    # the dead letter queue of a FIFO queue must be a FIFO queue too
+    if is_fifo(queue_name):
+        return f"{queue_name[:-len(FIFO_SUFFIX)]}-dead-letter{FIFO_SUFFIX}"
+
+    return f"{queue_name}-dead-letter"
+
+
+# -----------------------------------------------------------------------------
+
+
+class GroupScheduler:
+    """Run items of the same group in order, and different groups in parallel.
+
+    `process` is called on the executor with each item, and returns whether
+    it succeeded. Once an item fails, the items of its group still waiting
+    are passed to `skip` instead, so that none of them is processed ahead of
+    the failed one.
+    """
+
+    def __init__(self, executor, process, skip):
+        self.executor = executor
+        self.process = process
+        self.skip = skip
+
+        # group -> items waiting for the running one to finish
+        self.groups = {}
+        self.lock = Lock()
+
+    def submit(self, group, item):
+        with self.lock:
+            waiting = self.groups.get(group)
+            if waiting is not None:
+                waiting.append(item)
+                return
+
+            self.groups[group] = deque()
+
+        self.executor.submit(self._run, group, item)
+
+    def _run(self, group, item):
+        while True:
+            try:
+                succeeded = self.process(item)
+            except Exception:
+                logger.exception("could not process item of group %s", group)
+                succeeded = False
+
+            with self.lock:
+                waiting = self.groups[group]
+                if not succeeded:
+                    skipped = list(waiting)
+                    waiting.clear()
+                else:
+                    skipped = ()
+
+                if not waiting:
+                    del self.groups[group]
+                    break
+
+                item = waiting.popleft()
+
+        if skipped:
+            try:
+                self.skip(skipped)
+            except Exception:
+                logger.exception("could not skip items of group %s", group)
+
+    def __len__(self):
+        return len(self.groups)
@@ -1,50 +1,151 @@
+import contextvars
+
 import flask
 import logging
-from flask import g
+from threading import Lock
 
 from .topic_queue_poller import TopicQueuePoller
 
 # -----------------------------------------------------------------------------
 
 UNDEFINED = object()
-CTX_PAYLOAD_KEY = "payload"
+
+# the payload of the message being handled. unlike `flask.g`, it's never
+# shared by messages handled concurrently, or one after the other in the
+# same app context
+_payload = contextvars.ContextVar("tqp_payload")
 
 # -----------------------------------------------------------------------------
 
 
-def _get_tqp_context():
-    context = g
-    if not context:
-        raise RuntimeError("working outside of app context")
+def get_ctx_payload():
+    try:
+        return _payload.get()
+    except LookupError:
+        raise RuntimeError("working outside of poller handler") from None
 
-    if not hasattr(context, "tqp"):
-        context.tqp = {}
 
-    return context.tqp
+# -----------------------------------------------------------------------------
 
 
-def get_ctx_payload():
-    tqp_context = _get_tqp_context()
+class _ReusedAppContext:
+    """An app context pushed in its own `contextvars.Context`.
 
-    if CTX_PAYLOAD_KEY not in tqp_context:
-        raise RuntimeError("working outside of poller handler")
+    This makes it usable from any thread, one at a time, and lets it be
+    popped from a thread other than the one that pushed it.
+    """
 
-    return tqp_context[CTX_PAYLOAD_KEY]
+    def __init__(self, app, messages):
+        self.remaining = messages
 
+        self.context = contextvars.Context()
+        self.app_context = app.app_context()
+        self.context.run(self.app_context.push)
 
-# -----------------------------------------------------------------------------
+    def run(self, func, *args):
+        return self.context.run(func, *args)
+
+    def close(self, exc=None):
+        self.context.run(self.app_context.pop, exc)
 
 
 class FlaskTopicQueuePoller(TopicQueuePoller):
-    def __init__(self, *args, app, **kwargs):
+    """A poller that handles messages in a Flask app context.
+
+    By default, each message gets its own app context. To spare the setup
+    and teardown of app contexts when handling many messages, pass
+    `app_context_messages` to handle up to that many messages in each, one
+    at a time. Anything stored on `flask.g` is then shared by these
+    messages. An app context is torn down right away when its handler
+    fails, and idle ones are torn down once a receive comes back empty.
+
+    Batch handlers run in an app context as well, a batch counting as a
+    single message. As there is no single payload for them,
+    `get_ctx_payload` can't be used there.
+    """
+
+    def __init__(self, *args, app, app_context_messages=1, **kwargs):
         super().__init__(*args, **kwargs)
         self.app = app
         self.logger = app.logger
 
-    def handle_message(self, msg, payload):
-        with self.app.app_context():
-            _get_tqp_context()[CTX_PAYLOAD_KEY] = payload
+        self.app_context_messages = app_context_messages
+        self._app_contexts = []
+        self._app_contexts_lock = Lock()
+
+    def _handle_in_context(self, msg, payload):
+        token = _payload.set(payload)
+        try:
             super().handle_message(msg, payload)
+        finally:
+            _payload.reset(token)
+
+    def _acquire_app_context(self):
+        with self._app_contexts_lock:
+            if self._app_contexts:
+                return self._app_contexts.pop()
+
+        return _ReusedAppContext(self.app, self.app_context_messages)
+
+    def _release_app_context(self, app_context, exc):
+        app_context.remaining -= 1
+
+        if exc is None and app_context.remaining > 0:
+            with self._app_contexts_lock:
+                if not self._stopping.is_set():
+                    self._app_contexts.append(app_context)
+                    return
+
+        app_context.close(exc)
+
+    def _close_app_contexts(self):
+        with self._app_contexts_lock:
+            app_contexts = self._app_contexts
+            self._app_contexts = []
+
+        for app_context in app_contexts:
+            try:
+                app_context.close()
+            except Exception:
+                self.logger.exception("could not tear down app context")
+
+    def _run_in_app_context(self, func, *args):
+        if self.app_context_messages <= 1:
+            with self.app.app_context():
+                return func(*args)
+
+        app_context = self._acquire_app_context()
+        exc = None
+        try:
+            return app_context.run(func, *args)
+        except Exception as e:
+            exc = e
+            raise
+        finally:
+            self._release_app_context(app_context, exc)
+
+    def handle_message(self, msg, payload):
+        self._run_in_app_context(self._handle_in_context, msg, payload)
+
+    def handle_message_batch(self, messages, payloads):
+        self._run_in_app_context(
+            super().handle_message_batch, messages, payloads
+        )
+
+    def receive_messages(self, queue, max_number_of_messages):
+        messages = super().receive_messages(queue, max_number_of_messages)
+
+        # so that idle queues don't keep e.g. database sessions open
+        if not messages:
+            self._close_app_contexts()
+
+        return messages
+
+    def _enter_run_context(self, stack):
+        super()._enter_run_context(stack)
+
+        # app contexts still in use are torn down once their handler is done
+        stack.callback(self._close_app_contexts)
 
     def set_log_formatter(self, get_message_id: None):
         class PollerFormatter(logging.Formatter):
@@ -52,8 +153,8 @@ class FlaskTopicQueuePoller(TopicQueuePoller):
                 record.topic_name = None
                 record.message_id = None
 
-                if flask.has_app_context():
-                    payload = get_ctx_payload()
+                payload = _payload.get(None)
+                if payload is not None:
                     record.topic_name = payload["topic"]
                     if get_message_id:
                         record.message_id = get_message_id(payload)
@@ -0,0 +1,206 @@
+import logging
+import math
+from threading import Lock
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# stages of the poll/handle cycle that are timed
+RECEIVE = "receive"
+BUFFER = "buffer"
+DECODE = "decode"
+HANDLER = "handler"
+ACK = "ack"
+VISIBILITY = "visibility"
+
+# -----------------------------------------------------------------------------
+
+
+class Listener:
+    """Receive instrumentation events from pollers.
+
+    Override the methods for the events of interest. Events are emitted on
+    the thread doing the work, so listeners must be quick and thread safe.
+    """
+
+    def message_received(self, poller, msg, lag):
+        """A message was received, `lag` seconds after it was sent"""
+
+    def handler_started(self, poller, msg, payload):
+        pass
+
+    def handler_finished(self, poller, msg, payload, error, duration):
+        """A handler is done with a message, `error` is None on success"""
+
+    def batch_started(self, poller, messages, payloads):
+        pass
+
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        """A batch handler is done, `errors` maps indexes to exceptions"""
+
+    def stage_timed(self, poller, stage, duration, count):
+        """A stage took `duration` seconds, covering `count` messages"""
+
+
+_listeners = []
+
+
+def add_listener(listener):
+    """Add a listener for the events of all pollers"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def emit(poller, event, *args):
+    for listener in (*_listeners, *poller.listeners):
+        try:
+            getattr(listener, event)(poller, *args)
+        except Exception:
+            logger.exception("listener failed to handle %s", event)
+
+
+# -----------------------------------------------------------------------------
+
+
+class Histogram:
+    """A histogram of durations, with buckets growing exponentially.
+
+    Each power of 2 is split in 4 buckets, so percentiles are accurate to
+    within 25%, at a fixed memory cost regardless of the number of values.
+    """
+
+    SUB_BUCKETS = 4
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def _get_bucket(self, value):
+        mantissa, exponent = math.frexp(value)
+        return exponent * self.SUB_BUCKETS + int(
+            (mantissa - 0.5) * 2 * self.SUB_BUCKETS
+        )
+
+    def _get_upper_bound(self, bucket):
+        exponent, sub_bucket = divmod(bucket, self.SUB_BUCKETS)
+        mantissa = 0.5 + (sub_bucket + 1) / (2 * self.SUB_BUCKETS)
+        return math.ldexp(mantissa, exponent)
+
+    def record(self, value, count=1):
+        bucket = self._get_bucket(value) if value > 0 else None
+
+        with self.lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+            self.count += count
+            self.sum += value * count
+            self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        with self.lock:
+            buckets = sorted(
+                self.buckets.items(),
+                key=lambda item: -math.inf if item[0] is None else item[0],
+            )
+            threshold = self.count * percent / 100
+
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen >= threshold:
+                if bucket is None:
+                    return 0.0
+                return min(self._get_upper_bound(bucket), self.max)
+
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Metrics(Listener):
+    """Aggregate stage timings and queue lag in histograms.
+
+    The durations of each handler are aggregated as well, along with the
+    number of messages they failed.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.handlers = {}
+        self.handler_errors = {}
+        self.lock = Lock()
+
+    def _get_histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = histograms.setdefault(name, Histogram())
+
+        return histogram
+
+    def get_histogram(self, name):
+        return self._get_histogram(self.histograms, name)
+
+    def get_handler_histogram(self, name):
+        return self._get_histogram(self.handlers, name)
+
+    def _record_handler(self, name, duration, count, errors):
+        self.get_handler_histogram(name).record(duration, count)
+
+        if errors:
+            with self.lock:
+                self.handler_errors[name] = (
+                    self.handler_errors.get(name, 0) + errors
+                )
+
+    def message_received(self, poller, msg, lag):
+        if lag is not None:
+            self.get_histogram("lag").record(lag)
+
+    def handler_finished(self, poller, msg, payload, error, duration):
+        self._record_handler(
+            poller.get_handler_name(payload),
+            duration,
+            1,
+            int(error is not None),
+        )
+
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        self._record_handler(
+            poller.get_handler_name(payloads[0]),
+            duration,
+            len(messages),
+            len(errors),
+        )
+
+    def stage_timed(self, poller, stage, duration, count):
+        self.get_histogram(stage).record(duration)
+
+    def snapshot(self):
+        return {
+            name: histogram.snapshot()
+            for name, histogram in list(self.histograms.items())
+        }
+
+    def handler_snapshot(self):
+        return {
+            name: {
+                **histogram.snapshot(),
+                "errors": self.handler_errors.get(name, 0),
+            }
+            for name, histogram in list(self.handlers.items())
+        }
@@ -0,0 +1,489 @@
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Condition, Lock
+
+from .fifo import is_fifo
+from .transport import Transport
+
+# -----------------------------------------------------------------------------
+
+ARN_PREFIX = "arn:aws:{service}:memory:000000000000:"
+
+# default attributes of SQS queues
+DEFAULT_QUEUE_ATTRIBUTES = {
+    "VisibilityTimeout": "30",
+    "DelaySeconds": "0",
+    "MessageRetentionPeriod": "345600",
+    "ReceiveMessageWaitTimeSeconds": "0",
+}
+
+# how long FIFO queues remember deduplication ids
+DEDUPLICATION_INTERVAL = 5 * 60
+
+# -----------------------------------------------------------------------------
+
+
+class QueueDoesNotExist(Exception):
+    pass
+
+
+def _get_arn(service, name):
+    return f"{ARN_PREFIX.format(service=service)}{name}"
+
+
+def _get_batch_response(entries, succeeded, code):
+    response = {"Successful": [], "Failed": []}
+    for entry, success in zip(entries, succeeded):
+        if success:
+            response["Successful"].append({"Id": entry["Id"]})
+        else:
+            response["Failed"].append(
+                {
+                    "Id": entry["Id"],
+                    "SenderFault": True,
+                    "Code": code,
+                    "Message": "The receipt handle is no longer valid",
+                }
+            )
+
+    return response
+
+
+# -----------------------------------------------------------------------------
+
+
+class _Record:
+    __slots__ = (
+        "message_id",
+        "body",
+        "message_attributes",
+        "group_id",
+        "sent_at",
+        "visible_at",
+        "receive_count",
+        "receipt_handle",
+    )
+
+    def __init__(self, body, message_attributes, group_id, visible_at):
+        self.message_id = str(uuid.uuid4())
+        self.body = body
+        self.message_attributes = message_attributes
+        self.group_id = group_id
+        self.sent_at = time.time()
+        self.visible_at = visible_at
+        self.receive_count = 0
+        self.receipt_handle = None
+
+
+class MemoryMessage:
+    """A received message, like the boto3 SQS `Message` resource"""
+
+    def __init__(self, queue, record):
+        self.queue = queue
+        self.message_id = record.message_id
+        self.receipt_handle = record.receipt_handle
+        self.body = record.body
+        self.message_attributes = record.message_attributes or None
+
+        self.attributes = {
+            "SentTimestamp": str(int(record.sent_at * 1000)),
+            "ApproximateReceiveCount": str(record.receive_count),
+        }
+        if record.group_id is not None:
+            self.attributes["MessageGroupId"] = record.group_id
+
+    def delete(self):
+        self.queue._delete(self.receipt_handle)
+
+    def change_visibility(self, VisibilityTimeout):
+        if not self.queue._change_visibility(
+            self.receipt_handle, VisibilityTimeout
+        ):
+            raise ValueError(f"message {self.message_id} is not in flight")
+
+    def __repr__(self):
+        return f"MemoryMessage({self.message_id!r})"
+
+
+class MemoryQueue:
+    """An SQS queue held in memory.
+
+    Messages become visible again once their visibility timeout runs out,
+    and are moved to the dead letter queue of the redrive policy once they
+    were received `maxReceiveCount` times. On FIFO queues, the messages of
+    a group aren't received while an earlier one is in flight.
+    """
+
+    def __init__(self, transport, name):
+        self.transport = transport
+        self.name = name
+        self.url = f"memory://{name}"
+        self.fifo = is_fifo(name)
+        self.tags = {}
+
+        self._attributes = {
+            **DEFAULT_QUEUE_ATTRIBUTES,
+            "QueueArn": _get_arn("sqs", name),
+            "CreatedTimestamp": str(int(time.time())),
+        }
+
+        # message id -> record, in the order messages were sent
+        self.records = OrderedDict()
+        self.receipts = {}
+        self.deduplication_ids = {}
+        self.condition = Condition()
+
+    @property
+    def attributes(self):
+        now = time.monotonic()
+        with self.condition:
+            visible = sum(
+                1
+                for record in self.records.values()
+                if record.visible_at <= now
+            )
+            return {
+                **self._attributes,
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(
+                    len(self.records) - visible
+                ),
+            }
+
+    def load(self):
+        pass
+
+    reload = load
+
+    def set_attributes(self, Attributes):
+        with self.condition:
+            self._attributes.update(Attributes)
+            self.condition.notify_all()
+
+    def _get_max_receive_count(self):
+        redrive_policy = self._attributes.get("RedrivePolicy")
+        if not redrive_policy:
+            return None, None
+
+        redrive_policy = json.loads(redrive_policy)
+        return (
+            int(redrive_policy["maxReceiveCount"]),
+            redrive_policy["deadLetterTargetArn"],
+        )
+
+    def _enqueue(
+        self,
+        body,
+        message_attributes=None,
+        *,
+        group_id=None,
+        deduplication_id=None,
+        delay=None,
+    ):
+        if self.fifo and group_id is None:
+            raise ValueError(f"messages sent to {self.name} need a group")
+
+        now = time.monotonic()
+        if delay is None:
+            delay = int(self._attributes["DelaySeconds"])
+
+        with self.condition:
+            if self.fifo and deduplication_id is not None:
+                self.deduplication_ids = {
+                    key: expires_at
+                    for key, expires_at in self.deduplication_ids.items()
+                    if expires_at > now
+                }
+                if deduplication_id in self.deduplication_ids:
+                    return None
+
+                self.deduplication_ids[deduplication_id] = (
+                    now + DEDUPLICATION_INTERVAL
+                )
+
+            record = _Record(body, message_attributes, group_id, now + delay)
+            self.records[record.message_id] = record
+            self.condition.notify_all()
+
+        return record.message_id
+
+    def send_message(
+        self,
+        MessageBody,
+        MessageAttributes=None,
+        MessageGroupId=None,
+        MessageDeduplicationId=None,
+        DelaySeconds=None,
+    ):
+        message_id = self._enqueue(
+            MessageBody,
+            MessageAttributes,
+            group_id=MessageGroupId,
+            deduplication_id=MessageDeduplicationId,
+            delay=DelaySeconds,
+        )
+        return {"MessageId": message_id}
+
+    def _receive(self, max_number_of_messages, visibility_timeout):
+        now = time.monotonic()
+        max_receive_count, dead_letter_arn = self._get_max_receive_count()
+
+        # on FIFO queues, groups are blocked behind their first message
+        # that isn't visible, until it's deleted
+        blocked_groups = set()
+
+        received = []
+        for record in list(self.records.values()):
+            if len(received) >= max_number_of_messages:
+                break
+            if record.group_id in blocked_groups:
+                continue
+            if record.visible_at > now:
+                if self.fifo:
+                    blocked_groups.add(record.group_id)
+                continue
+
+            if (
+                max_receive_count is not None
+                and record.receive_count >= max_receive_count
+            ):
+                self._remove(record)
+                self.transport._get_queue_by_arn(dead_letter_arn)._enqueue(
+                    record.body,
+                    record.message_attributes,
+                    group_id=record.group_id,
+                    deduplication_id=record.message_id,
+                )
+                continue
+
+            self.receipts.pop(record.receipt_handle, None)
+            record.receipt_handle = str(uuid.uuid4())
+            self.receipts[record.receipt_handle] = record
+            record.receive_count += 1
+            record.visible_at = now + visibility_timeout
+
+            received.append(MemoryMessage(self, record))
+
+        return received
+
+    def receive_messages(
+        self,
+        MaxNumberOfMessages=1,
+        WaitTimeSeconds=None,
+        VisibilityTimeout=None,
+        **kwargs,
+    ):
+        if WaitTimeSeconds is None:
+            WaitTimeSeconds = int(
+                self._attributes["ReceiveMessageWaitTimeSeconds"]
+            )
+        if VisibilityTimeout is None:
+            VisibilityTimeout = int(self._attributes["VisibilityTimeout"])
+
+        deadline = time.monotonic() + min(
+            WaitTimeSeconds, self.transport.max_wait_time
+        )
+
+        with self.condition:
+            while True:
+                received = self._receive(
+                    MaxNumberOfMessages, VisibilityTimeout
+                )
+                now = time.monotonic()
+                if received or now >= deadline:
+                    return received
+
+                # wake up for messages becoming visible again as well
+                next_visible_at = min(
+                    (
+                        record.visible_at
+                        for record in self.records.values()
+                        if record.visible_at > now
+                    ),
+                    default=deadline,
+                )
+                self.condition.wait(min(deadline, next_visible_at) - now)
+
+    def _remove(self, record):
+        del self.records[record.message_id]
+        self.receipts.pop(record.receipt_handle, None)
+
+    def _delete(self, receipt_handle):
+        with self.condition:
+            record = self.receipts.get(receipt_handle)
+            if record is None:
+                return False
+
+            self._remove(record)
+            self.condition.notify_all()
+            return True
+
+    def _change_visibility(self, receipt_handle, visibility_timeout):
+        now = time.monotonic()
+        with self.condition:
+            record = self.receipts.get(receipt_handle)
+            if record is None or record.visible_at <= now:
+                return False
+
+            record.visible_at = now + visibility_timeout
+            self.condition.notify_all()
+            return True
+
+    def delete_messages(self, Entries):
+        return _get_batch_response(
+            Entries,
+            [self._delete(entry["ReceiptHandle"]) for entry in Entries],
+            "ReceiptHandleIsInvalid",
+        )
+
+    def change_message_visibility_batch(self, Entries):
+        return _get_batch_response(
+            Entries,
+            [
+                self._change_visibility(
+                    entry["ReceiptHandle"], entry["VisibilityTimeout"]
+                )
+                for entry in Entries
+            ],
+            "MessageNotInflight",
+        )
+
+    def __repr__(self):
+        return f"MemoryQueue({self.name!r})"
+
+
+# -----------------------------------------------------------------------------
+
+
+class MemoryTransport(Transport):
+    """Queues and topics held in memory, for tests and local runs.
+
+    Messages published on a topic are delivered to the queues subscribed to
+    it right away, wrapped in an SNS envelope unless raw message delivery is
+    enabled. Long polls last at most `max_wait_time` seconds, so that
+    pollers stop quickly. S3 notifications and offloading are not supported.
+    """
+
+    def __init__(self, *, max_wait_time=1):
+        self.max_wait_time = max_wait_time
+
+        self.queues = {}
+
+        # topic name -> queue name -> queue, raw message delivery
+        self.topics = {}
+        self.lock = Lock()
+
+    def create_queue(self, name, attributes, *, tags):
+        with self.lock:
+            queue = self.queues.get(name)
+            if queue is None:
+                queue = self.queues[name] = MemoryQueue(self, name)
+
+        queue.set_attributes(Attributes=attributes)
+        queue.tags = dict(tags)
+        return queue
+
+    def find_queue(self, name):
+        return self.queues.get(name)
+
+    def get_queue(self, name):
+        queue = self.queues.get(name)
+        if queue is None:
+            raise QueueDoesNotExist(name)
+
+        return queue
+
+    def _get_queue_by_arn(self, queue_arn):
+        return self.get_queue(queue_arn.split(":")[-1])
+
+    def get_queue_tags(self, queue):
+        return dict(queue.tags)
+
+    def tag_queue(self, queue, tags):
+        queue.tags.update(tags)
+
+    def get_queue_attributes(self, queue, attribute_names):
+        attributes = queue.attributes
+        return {
+            name: attributes[name]
+            for name in attribute_names
+            if name in attributes
+        }
+
+    def get_topic_arn(self, topic_name):
+        with self.lock:
+            self.topics.setdefault(topic_name, {})
+
+        return _get_arn("sns", topic_name)
+
+    def list_topics(self):
+        return list(self.topics)
+
+    def subscribe(self, topic_name, queue, *, raw_message_delivery):
+        with self.lock:
+            subscriptions = self.topics.setdefault(topic_name, {})
+            subscriptions[queue.name] = queue, raw_message_delivery
+
+        return _get_arn("sns", topic_name)
+
+    def subscribe_bucket(self, bucket, queue):
+        raise NotImplementedError(
+            "S3 notifications are not supported by the memory transport",
+        )
+
+    def _get_envelope(self, topic_name, message_id, entry):
+        return json.dumps(
+            {
+                "Type": "Notification",
+                "MessageId": message_id,
+                "TopicArn": _get_arn("sns", topic_name),
+                "Message": entry["Message"],
+                "Timestamp": datetime.now(timezone.utc).isoformat(),
+                "MessageAttributes": {
+                    name: {
+                        "Type": attribute["DataType"],
+                        "Value": attribute.get("StringValue"),
+                    }
+                    for name, attribute in entry.get(
+                        "MessageAttributes", {}
+                    ).items()
+                },
+            }
+        )
+
+    def publish(self, topic_name, entry):
+        message_id = str(uuid.uuid4())
+
+        with self.lock:
+            subscriptions = list(self.topics.get(topic_name, {}).values())
+
+        for queue, raw_message_delivery in subscriptions:
+            if raw_message_delivery:
+                body = entry["Message"]
+                message_attributes = entry.get("MessageAttributes")
+            else:
+                body = self._get_envelope(topic_name, message_id, entry)
+                message_attributes = None
+
+            queue._enqueue(
+                body,
+                message_attributes,
+                group_id=entry.get("MessageGroupId"),
+                deduplication_id=entry.get("MessageDeduplicationId"),
+            )
+
+        return message_id
+
+    def publish_batch(self, topic_name, entries):
+        successful = []
+        for entry in entries:
+            entry = dict(entry)
+            entry_id = entry.pop("Id")
+            successful.append(
+                {"Id": entry_id, "MessageId": self.publish(topic_name, entry)}
+            )
+
+        return {"Successful": successful, "Failed": []}
@@ -0,0 +1,300 @@
+import functools
+import inspect
+import logging
+import signal
+from contextlib import ExitStack
+from threading import Condition, Thread, current_thread, main_thread
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# -----------------------------------------------------------------------------
+
+
+class _QueueState:
+    def __init__(self, name, *, weight, priority, max_concurrency):
+        self.name = name
+        self.weight = weight
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+
+        self.ready = []
+        self.running = 0
+
+        # virtual time of the next task, advancing by 1 / weight per task
+        self.virtual_time = 0.0
+
+
+class WeightedScheduler:
+    """Share workers between queues, by priority and weight.
+
+    Tasks of the queues with the highest priority run first. Among queues of
+    the same priority, workers are shared in proportion to their weights:
+    each queue has a virtual time advancing by 1 / weight per task run, and
+    the one furthest behind runs next. A queue never has more than its
+    `max_concurrency` tasks running at once.
+    """
+
+    def __init__(self):
+        self.queues = []
+        self.virtual_time = 0.0
+        self.closed = False
+        self.condition = Condition()
+
+    def add_queue(self, name, *, weight=1, priority=0, max_concurrency):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+
+        state = _QueueState(
+            name,
+            weight=weight,
+            priority=priority,
+            max_concurrency=max_concurrency,
+        )
+        with self.condition:
+            self.queues.append(state)
+
+        return state
+
+    def submit(self, state, task):
+        with self.condition:
+            state.ready.append(task)
+            self.condition.notify()
+
+    def _next(self):
+        best = None
+        best_key = None
+
+        for state in self.queues:
+            if not state.ready:
+                continue
+            # once closed, tasks left over are only there to be skipped
+            if state.running >= state.max_concurrency and not self.closed:
+                continue
+
+            # queues coming back from idle don't get to catch up on the
+            # time they spent idle
+            virtual_time = max(state.virtual_time, self.virtual_time)
+            key = (-state.priority, virtual_time)
+            if best_key is None or key < best_key:
+                best, best_key = state, key
+
+        if best is None:
+            return None, None
+
+        self.virtual_time = best_key[1]
+        best.virtual_time = self.virtual_time + 1 / best.weight
+        best.running += 1
+        return best, best.ready.pop(0)
+
+    def _finish(self, state):
+        with self.condition:
+            state.running -= 1
+            self.condition.notify_all()
+
+    def work(self):
+        """Run tasks until the scheduler is closed and no task is left"""
+        while True:
+            with self.condition:
+                state, task = self._next()
+                while task is None:
+                    if self.closed:
+                        return
+
+                    self.condition.wait()
+                    state, task = self._next()
+
+            try:
+                task()
+            except Exception:
+                logger.exception("task of queue %s failed", state.name)
+            finally:
+                self._finish(state)
+
+    def open(self):
+        with self.condition:
+            self.closed = False
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class _QueueExecutor:
+    """Submit the tasks of a poller to a shared scheduler"""
+
+    def __init__(self, scheduler, state):
+        self.scheduler = scheduler
+        self.state = state
+
+    def submit(self, fn, *args, **kwargs):
+        self.scheduler.submit(
+            self.state, functools.partial(fn, *args, **kwargs)
+        )
+
+
+def _toggle_profilers(profilers, signum, frame):
+    for profiler in profilers:
+        profiler.toggle()
+
+
+# -----------------------------------------------------------------------------
+
+
+class MultiQueuePoller:
+    """Poll several queues, handling their messages on a shared pool.
+
+    Each poller keeps receiving messages from its queue on its own receiver
+    threads, and keeps its own settings. Their handlers then run on the
+    `concurrency` threads of the pool, at most the poller's `concurrency` at
+    once, scheduled by priority and weight (see `WeightedScheduler`):
+
+        multi = MultiQueuePoller(concurrency=16)
+        multi.add(urgent_poller, priority=1)
+        multi.add(reports_poller, weight=3)
+        multi.add(bulk_poller)
+        multi.start()
+    """
+
+    logger = logger
+
+    def __init__(self, *, concurrency):
+        self.concurrency = concurrency
+        self.pollers = []
+        self.scheduler = WeightedScheduler()
+
+    @property
+    def queue_name(self):
+        """The names of the queues polled, e.g. to name worker processes"""
+        return "+".join(poller.queue_name for poller, _ in self.pollers)
+
+    def ensure_queue(self, *, force=False):
+        """Provision the queues of all the pollers"""
+        return [poller.ensure_queue(force=force) for poller, _ in self.pollers]
+
+    def add(self, poller, *, weight=1, priority=0):
+        if poller.autoscaling:
+            raise ValueError(
+                "autoscaling is not supported by the multi-queue poller",
+            )
+        if inspect.iscoroutinefunction(poller.start):
+            raise TypeError(
+                "asyncio pollers are not supported by the multi-queue poller",
+            )
+
+        state = self.scheduler.add_queue(
+            poller.queue_name,
+            weight=weight,
+            priority=priority,
+            max_concurrency=poller.concurrency,
+        )
+        self.pollers.append((poller, _QueueExecutor(self.scheduler, state)))
+        return poller
+
+    def stop(self):
+        """Stop all the pollers; `start` returns once they are drained"""
+        for poller, _ in self.pollers:
+            poller.stop()
+
+    def _handle_signal(self, signum, frame):
+        # a second signal terminates the process right away
+        signal.signal(signum, signal.SIG_DFL)
+        self.stop()
+
+    def _get_profilers(self):
+        profilers = {}
+        for poller, _ in self.pollers:
+            profiler = poller.profiler
+            if profiler is None or profiler.signum is None:
+                continue
+
+            signum_profilers = profilers.setdefault(profiler.signum, [])
+            if profiler not in signum_profilers:
+                signum_profilers.append(profiler)
+
+        return profilers
+
+    def _install_signal_handlers(self, stack):
+        # the pollers run on their own threads, so their signal handlers are
+        # installed here instead
+        profilers = self._get_profilers()
+
+        if current_thread() is not main_thread():
+            if profilers:
+                self.logger.warning(
+                    "not polling on the main thread, the profilers can only "
+                    "be toggled with toggle()"
+                )
+            return
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            if signal.getsignal(signum) is signal.SIG_IGN:
+                continue
+
+            handler = signal.signal(signum, self._handle_signal)
+            stack.callback(signal.signal, signum, handler)
+
+        # pollers may share a signal to toggle their profilers
+        for signum, signum_profilers in profilers.items():
+            handler = signal.signal(
+                signum, functools.partial(_toggle_profilers, signum_profilers)
+            )
+            stack.callback(signal.signal, signum, handler)
+
+    def _poll(self, poller, executor, ensure_queue, errors):
+        try:
+            poller._poll(ensure_queue=ensure_queue, executor=executor)
+        except Exception as e:
+            poller.logger.exception("poller failed, stopping")
+            errors.append(e)
+            self.stop()
+
+    def start(self, *, ensure_queue=True):
+        try:
+            self._run(ensure_queue=ensure_queue)
+        finally:
+            # only once the run is over, so that stopping the pollers before
+            # they get to start still takes effect
+            for poller, _ in self.pollers:
+                poller._stopping.clear()
+
+    def _run(self, *, ensure_queue):
+        self.scheduler.open()
+
+        errors = []
+        with ExitStack() as stack:
+            self._install_signal_handlers(stack)
+
+            # like the pollers' own pools, handlers still running past the
+            # stop timeout are left behind
+            for i in range(self.concurrency):
+                Thread(
+                    target=self.scheduler.work,
+                    name=f"tqp-multi-{i}",
+                    daemon=True,
+                ).start()
+
+            pollers = []
+            for poller, executor in self.pollers:
+                thread = Thread(
+                    target=self._poll,
+                    args=(poller, executor, ensure_queue, errors),
+                    name=f"tqp-{poller.queue_name}-poll",
+                    daemon=True,
+                )
+                thread.start()
+                pollers.append(thread)
+
+            # each poller returns once its handlers are done, or past its
+            # stop timeout
+            for thread in pollers:
+                thread.join()
+
+            self.scheduler.close()
+
+        if errors:
+            raise errors[0]
+
+        self.logger.info("stopped")
@@ -1,40 +1,59 @@
 import newrelic.agent
 
-from .topic_queue_poller import QueuePollerBase, TopicQueuePoller
+from . import instrumentation
 
 # -----------------------------------------------------------------------------
 
 
-def install():
-    QueuePollerBase._handle_message = newrelic.agent.background_task()(
-        QueuePollerBase._handle_message,
-    )
-
-    base_handle_message = TopicQueuePoller.handle_message
-    base_handle_error = QueuePollerBase.handle_error
-
-    def _hook_handle_message(self, msg, payload):
-        newrelic.agent.set_transaction_name(payload["handler"].__name__)
-
-        base_handle_message(self, msg, payload)
+class NewRelicListener(instrumentation.Listener):
+    def __init__(self):
+        self.tasks = {}
 
-        self.send_newrelic_event(payload, success=True)
+    def _start_task(self, msg, payload):
+        task = newrelic.agent.BackgroundTask(
+            newrelic.agent.application(), payload["handler"].__name__
+        )
+        task.__enter__()
+        self.tasks[msg] = task
 
-    def _hook_send_newrelic_event(self, payload, success):
+    def _record_event(self, poller, payload, error):
         newrelic.agent.record_custom_event(
             "TqpEvents",
             {
                 "topic": payload["topic"],
-                "queue_name": self.queue_name,
-                "success": str(success),
+                "queue_name": poller.queue_name,
+                "success": str(error is None),
                 "attributes": payload["attributes"],
             },
         )
 
-    def _hook_handle_error(self, exception, msg, payload):
-        base_handle_error(self, exception, msg, payload)
-        self.send_newrelic_event(payload, success=False)
+    def _finish_task(self, msg, error):
+        task = self.tasks.pop(msg, None)
+        if task is None:
+            return
+
+        if error is not None:
+            task.__exit__(type(error), error, error.__traceback__)
+        else:
+            task.__exit__(None, None, None)
+
+    def handler_started(self, poller, msg, payload):
+        self._start_task(msg, payload)
 
-    TopicQueuePoller.handle_message = _hook_handle_message
-    TopicQueuePoller.send_newrelic_event = _hook_send_newrelic_event
-    QueuePollerBase.handle_error = _hook_handle_error
+    def handler_finished(self, poller, msg, payload, error, duration):
+        self._record_event(poller, payload, error)
+        self._finish_task(msg, error)
+
+    def batch_started(self, poller, messages, payloads):
+        self._start_task(messages[0], payloads[0])
+
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        # one event per message, so that failures are counted as usual
+        for i, payload in enumerate(payloads):
+            self._record_event(poller, payload, errors.get(i))
+
+        self._finish_task(messages[0], next(iter(errors.values()), None))
+
+
+def install():
+    instrumentation.add_listener(NewRelicListener())
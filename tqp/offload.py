@@ -0,0 +1,79 @@
+import io
+import json
+import uuid
+
+from . import aws
+from .cache import TTLCache
+
+# -----------------------------------------------------------------------------
+
+# message attribute marking messages whose payload is stored on S3
+OFFLOAD_ATTRIBUTE = "tqp-offloaded"
+
+# SNS messages are capped at 256 KiB, including attributes
+DEFAULT_OFFLOAD_THRESHOLD = 200 * 1024
+
+# payloads are cached briefly, e.g. for redeliveries
+_cache = TTLCache(max_size=16, ttl=60)
+
+# -----------------------------------------------------------------------------
+
+
+def offload_message(message, *, bucket, prefix):
+    """Store a message on S3, returning the pointer to publish instead"""
+    key = f"{prefix}{uuid.uuid4()}"
+    aws.get_client("s3").put_object(
+        Bucket=bucket, Key=key, Body=message.encode()
+    )
+
+    return json.dumps({"bucket": bucket, "key": key})
+
+
+def fetch_message(pointer):
+    """Get a message stored on S3 from the pointer that was published"""
+    pointer = json.loads(pointer)
+    cache_key = pointer["bucket"], pointer["key"]
+
+    message = _cache.get(cache_key)
+    if message is not None:
+        return message
+
+    response = aws.get_client("s3").get_object(
+        Bucket=pointer["bucket"], Key=pointer["key"]
+    )
+
+    # decode while reading, rather than holding the raw bytes as well
+    with io.TextIOWrapper(response["Body"], encoding="utf-8") as body:
+        message = body.read()
+
+    _cache.set(cache_key, message)
+    return message
+
+
+def configure_lifecycle(*, bucket, prefix, expiration_days):
+    """Expire offloaded messages, keeping the other rules of the bucket"""
+    s3_client = aws.get_client("s3")
+    rule_id = f"tqp-offload-{prefix}"
+
+    try:
+        rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket)[
+            "Rules"
+        ]
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+            raise
+        rules = []
+
+    rules = [rule for rule in rules if rule.get("ID") != rule_id]
+    rules.append(
+        {
+            "ID": rule_id,
+            "Filter": {"Prefix": prefix},
+            "Status": "Enabled",
+            "Expiration": {"Days": expiration_days},
+        }
+    )
+
+    s3_client.put_bucket_lifecycle_configuration(
+        Bucket=bucket, LifecycleConfiguration={"Rules": rules}
+    )
@@ -0,0 +1,125 @@
+import asyncio
+import boto3
+import inspect
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from threading import Event, current_thread, main_thread
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# -----------------------------------------------------------------------------
+
+
+def _run_worker(poller):
+    # the supervisor coordinates the shutdown of the workers, terminating
+    # them so that the poller stops gracefully
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # connection pools must not be shared with the parent process
+    boto3.DEFAULT_SESSION = None
+
+    result = poller.start(ensure_queue=False)
+    if inspect.iscoroutine(result):
+        asyncio.run(result)
+
+
+# -----------------------------------------------------------------------------
+
+
+class Supervisor:
+    """Run a poller on several forked worker processes.
+
+    The queue is provisioned once by the supervisor (unless `ensure_queue`
+    is False), then each worker polls it independently. Workers that die
+    are restarted, and on shutdown they are asked to stop, returning the
+    messages they haven't started to the queue, and killed if they don't
+    within `shutdown_timeout` seconds. This should be longer than the
+    poller's `stop_timeout`.
+    """
+
+    def __init__(
+        self,
+        poller,
+        processes,
+        *,
+        shutdown_timeout=30,
+        restart_delay=1,
+        ensure_queue=True,
+    ):
+        self.poller = poller
+        self.processes = processes
+        self.ensure_queue = ensure_queue
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+
+        self.context = multiprocessing.get_context("fork")
+        self.workers = {}
+        self.stopping = Event()
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=_run_worker,
+            args=(self.poller,),
+            name=f"tqp-{self.poller.queue_name}-worker-{index}",
+        )
+        process.start()
+
+        logger.info("started worker %s (pid %s)", index, process.pid)
+        self.workers[index] = process
+
+    def _handle_signal(self, signum, frame):
+        logger.info("received signal %s, shutting down", signum)
+        self.stop()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _shutdown(self):
+        for process in self.workers.values():
+            process.terminate()
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for index, process in self.workers.items():
+            process.join(max(deadline - time.monotonic(), 0))
+
+            if process.is_alive():
+                logger.warning("killing unresponsive worker %s", index)
+                process.kill()
+                process.join()
+
+    def run(self):
+        if current_thread() is main_thread():
+            signal.signal(signal.SIGTERM, self._handle_signal)
+            signal.signal(signal.SIGINT, self._handle_signal)
+
+        if self.ensure_queue:
+            self.poller.ensure_queue()
+
+        for index in range(self.processes):
+            self._spawn(index)
+
+        try:
+            while not self.stopping.is_set():
+                sentinels = {
+                    process.sentinel: index
+                    for index, process in self.workers.items()
+                }
+                for sentinel in wait(sentinels, timeout=1):
+                    index = sentinels[sentinel]
+                    logger.error(
+                        "worker %s exited with code %s",
+                        index,
+                        self.workers[index].exitcode,
+                    )
+
+                    if self.stopping.wait(self.restart_delay):
+                        break
+                    self._spawn(index)
+        finally:
+            self._shutdown()
@@ -1,14 +1,26 @@
-from .topic_queue_poller import QueuePollerBase
+from . import instrumentation
 
 # -----------------------------------------------------------------------------
 
 
-def install(client):
-    base_handle_error = QueuePollerBase.handle_error
+class RavenListener(instrumentation.Listener):
+    def __init__(self, client):
+        self.client = client
+
+    def _capture(self, error, payload):
+        self.client.captureException(
+            exc_info=(type(error), error, error.__traceback__),
+            extra={"payload": payload},
+        )
 
-    def _hook_handle_error(self, exception, msg, payload):
-        base_handle_error(self, exception, msg, payload)
+    def handler_finished(self, poller, msg, payload, error, duration):
+        if error is not None:
+            self._capture(error, payload)
 
-        client.captureException(extra={"payload": payload})
+    def batch_finished(self, poller, messages, payloads, errors, duration):
+        for i, error in errors.items():
+            self._capture(error, payloads[i])
 
-    QueuePollerBase.handle_error = _hook_handle_error
+
+def install(client):
+    instrumentation.add_listener(RavenListener(client))
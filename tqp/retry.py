@@ -0,0 +1,53 @@
+import random
+
+# -----------------------------------------------------------------------------
+
+# maximum visibility timeout allowed by SQS
+MAX_DELAY = 12 * 60 * 60
+
+# returned by `RetryPolicy.get_delay` for messages to dead letter
+DEAD_LETTER = object()
+
+# -----------------------------------------------------------------------------
+
+
+class RetryPolicy:
+    """Decide when failed messages are retried.
+
+    By default, a message is retried after `base_delay` seconds, multiplied
+    by `multiplier` for each time it was received before, up to `max_delay`
+    seconds, with up to `jitter` of the delay added at random. Messages that
+    failed with one of the `transient` exceptions are retried right away, and
+    the ones that failed with one of the `dead_letter` exceptions are sent to
+    the dead letter queue without retrying.
+    """
+
+    def __init__(
+        self,
+        *,
+        base_delay=1,
+        multiplier=2,
+        max_delay=15 * 60,
+        jitter=0.1,
+        transient=(),
+        dead_letter=(),
+    ):
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = min(max_delay, MAX_DELAY)
+        self.jitter = jitter
+        self.transient = tuple(transient)
+        self.dead_letter = tuple(dead_letter)
+
+    def get_delay(self, exception, receive_count):
+        """Get the number of seconds to retry in, or `DEAD_LETTER`"""
+        if isinstance(exception, self.dead_letter):
+            return DEAD_LETTER
+        if isinstance(exception, self.transient):
+            return 0
+
+        # capped, so that the delay doesn't overflow
+        retries = min(receive_count - 1, 64)
+        delay = min(self.base_delay * self.multiplier**retries, self.max_delay)
+        delay += delay * self.jitter * random.random()
+        return min(int(delay), MAX_DELAY)
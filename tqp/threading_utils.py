@@ -1,4 +1,10 @@
-from threading import Event, Thread
+import logging
+import time
+from threading import Condition, Event, Thread
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
 
 # -----------------------------------------------------------------------------
 
@@ -32,3 +38,173 @@ class Interval(Thread):
 
     def __exit__(self, *args):
         self.cancel()
+
+
+# -----------------------------------------------------------------------------
+
+
+class ResizableSemaphore:
+    """A semaphore whose number of slots can be changed while in use.
+
+    When shrunk below the number of slots currently acquired, acquiring
+    blocks until enough of them are released.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.acquired = 0
+        self.condition = Condition()
+
+    def acquire(self, blocking=True, timeout=None):
+        with self.condition:
+            if not blocking:
+                if self.acquired >= self.value:
+                    return False
+            elif not self.condition.wait_for(
+                lambda: self.acquired < self.value, timeout
+            ):
+                return False
+
+            self.acquired += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            if self.acquired <= 0:
+                raise ValueError("semaphore released too many times")
+
+            self.acquired -= 1
+            self.condition.notify_all()
+
+    def resize(self, value):
+        with self.condition:
+            self.value = value
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def wait_released(self, timeout=None):
+        """Block until all slots are released, returning False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.acquired, timeout)
+
+
+def acquire_up_to(semaphore, count, timeout=None):
+    """Acquire between one and `count` slots from a semaphore.
+
+    Blocks until at least one slot is available, then grabs as many of the
+    remaining ones as it can without blocking. Returns the number acquired,
+    which is 0 if none became available within `timeout` seconds.
+    """
+    if not semaphore.acquire(timeout=timeout):
+        return 0
+
+    acquired = 1
+    while acquired < count and semaphore.acquire(blocking=False):
+        acquired += 1
+
+    return acquired
+
+
+# -----------------------------------------------------------------------------
+
+
+class Batcher(Thread):
+    """Group items and pass them to a function in batches.
+
+    A batch is flushed as soon as it holds `max_size` items, or when the
+    oldest item in it has been waiting for `max_wait` seconds. Items are
+    flushed on the batcher thread.
+    """
+
+    def __init__(self, function, *, max_size, max_wait, name=None):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.max_size = max_size
+        self.max_wait = max_wait
+
+        self.items = []
+        self.closed = False
+        self.flushing = 0
+        self.busy = False
+        self.condition = Condition()
+
+    def add(self, item):
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("batcher is closed")
+
+            self.items.append((time.monotonic() + self.max_wait, item))
+            if len(self.items) == 1 or len(self.items) >= self.max_size:
+                self.condition.notify_all()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.closed:
+                if self.items:
+                    deadline, _ = self.items[0]
+                    timeout = deadline - time.monotonic()
+                    if (
+                        len(self.items) >= self.max_size
+                        or timeout <= 0
+                        or self.flushing
+                    ):
+                        break
+                else:
+                    timeout = None
+
+                self.condition.wait(timeout)
+
+            batch = [item for _, item in self.items[: self.max_size]]
+            del self.items[: self.max_size]
+
+            self.busy = bool(batch)
+            return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            try:
+                self.function(batch)
+            except Exception:
+                logger.exception("failed to flush a batch of %s", len(batch))
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until everything added so far has been flushed"""
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                return self.condition.wait_for(
+                    lambda: not self.items and not self.busy, timeout
+                )
+            finally:
+                self.flushing -= 1
+
+    def close(self, timeout=None):
+        """Flush everything still pending and stop the thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        if self.is_alive():
+            self.join(timeout)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,25 +1,254 @@
-import boto3
-import json
+import hashlib
+from concurrent.futures import Future
+from threading import BoundedSemaphore
+
+from . import aws
+from .codecs import CODEC_ATTRIBUTE, DEFAULT_CODEC, TOPIC_ATTRIBUTE, get_codec
+from .exceptions import PublishBatchError, PublishError
+from .fifo import is_fifo
+from .offload import (
+    DEFAULT_OFFLOAD_THRESHOLD,
+    OFFLOAD_ATTRIBUTE,
+    configure_lifecycle,
+    offload_message,
+)
+from .threading_utils import Batcher
+from .transport import DEFAULT_TRANSPORT
+
+# -----------------------------------------------------------------------------
+
+# maximum allowed by the SNS PublishBatch API
+MAX_BATCH_SIZE = 10
 
 # -----------------------------------------------------------------------------
 
 
 class Topic:
-    def __init__(self, topic_name):
+    def __init__(
+        self,
+        topic_name,
+        *,
+        offload_bucket=None,
+        offload_threshold=DEFAULT_OFFLOAD_THRESHOLD,
+        offload_prefix="tqp-offload/",
+        codec=DEFAULT_CODEC,
+        transport=None,
+    ):
         self.topic_name = topic_name
-        self._topic = None
+        self.transport = transport or DEFAULT_TRANSPORT
+        self.fifo = is_fifo(topic_name)
+
+        # how messages are serialized, see `tqp.codecs`
+        self.codec_name = codec
+        self.codec = get_codec(codec)
+
+        # messages larger than the threshold (in bytes) are stored on S3,
+        # and only a pointer to them is published
+        self.offload_bucket = offload_bucket
+        self.offload_threshold = offload_threshold
+        self.offload_prefix = f"{offload_prefix}{topic_name}/"
+
+    @property
+    def topic_arn(self):
+        return self.transport.get_topic_arn(self.topic_name)
 
     @property
     def topic(self):
-        if self._topic is not None:
-            return self._topic
+        return aws.get_resource("sns").Topic(self.topic_arn)
 
-        sns = boto3.resource("sns")
-        self._topic = sns.create_topic(Name=self.topic_name)
-        return self._topic
+    def configure_offload_lifecycle(self, expiration_days):
+        """Delete offloaded messages after they are `expiration_days` old"""
+        configure_lifecycle(
+            bucket=self.offload_bucket,
+            prefix=self.offload_prefix,
+            expiration_days=expiration_days,
+        )
+
+    def _get_entry(
+        self,
+        message,
+        dump_json=True,
+        *,
+        group_id=None,
+        deduplication_id=None,
+        **kwargs,
+    ):
+        if callable(group_id):
+            group_id = group_id(message)
+
+        # lets pollers route messages delivered without the SNS envelope.
+        # subscriptions aren't known here, so it's added to every message
+        kwargs["MessageAttributes"] = {
+            **kwargs.get("MessageAttributes", {}),
+            TOPIC_ATTRIBUTE: {
+                "DataType": "String",
+                "StringValue": self.topic_name,
+            },
+        }
 
-    def publish(self, message, dump_json=True, **kwargs):
         if dump_json:
-            message = json.dumps(message)
+            message = self.codec.encode(message)
+
+            if self.codec_name != DEFAULT_CODEC:
+                kwargs["MessageAttributes"] = {
+                    **kwargs.get("MessageAttributes", {}),
+                    CODEC_ATTRIBUTE: {
+                        "DataType": "String",
+                        "StringValue": self.codec_name,
+                    },
+                }
+
+        if self.fifo:
+            if group_id is None:
+                raise ValueError("messages on FIFO topics need a group_id")
+
+            # like content-based deduplication, identical messages published
+            # within 5 minutes are only delivered once. the hash is of the
+            # message itself, as S3 pointers to it are unique
+            kwargs["MessageGroupId"] = str(group_id)
+            kwargs["MessageDeduplicationId"] = (
+                deduplication_id
+                or hashlib.sha256(message.encode()).hexdigest()
+            )
+
+        if (
+            self.offload_bucket
+            and len(message.encode()) > self.offload_threshold
+        ):
+            message = offload_message(
+                message,
+                bucket=self.offload_bucket,
+                prefix=self.offload_prefix,
+            )
+            kwargs["MessageAttributes"] = {
+                **kwargs.get("MessageAttributes", {}),
+                OFFLOAD_ATTRIBUTE: {"DataType": "String", "StringValue": "s3"},
+            }
+
+        return {"Message": message, **kwargs}
+
+    def publish(self, message, dump_json=True, **kwargs):
+        return self.transport.publish(
+            self.topic_name, self._get_entry(message, dump_json, **kwargs)
+        )
+
+    def _publish_batch(self, entries):
+        """Publish up to 10 entries, returning a message id or error each"""
+        response = self.transport.publish_batch(
+            self.topic_name,
+            [{"Id": str(i), **entry} for i, entry in enumerate(entries)],
+        )
+
+        results = [None] * len(entries)
+        for success in response.get("Successful", ()):
+            results[int(success["Id"])] = success["MessageId"]
+        for failure in response.get("Failed", ()):
+            results[int(failure["Id"])] = PublishError(
+                failure.get("Message", failure["Code"]),
+                code=failure["Code"],
+                sender_fault=failure["SenderFault"],
+            )
+
+        return results
+
+    def publish_many(self, messages, dump_json=True, **kwargs):
+        """Publish messages in batches, returning their message ids.
+
+        If any of them can't be published, `PublishBatchError` is raised
+        once all of them have been attempted. On FIFO topics, `group_id` can
+        be a function, called with each message to get its group.
+        """
+        entries = [
+            self._get_entry(message, dump_json, **kwargs)
+            for message in messages
+        ]
+
+        results = []
+        for i in range(0, len(entries), MAX_BATCH_SIZE):
+            results.extend(
+                self._publish_batch(entries[i : i + MAX_BATCH_SIZE])
+            )
+
+        errors = {
+            i: result
+            for i, result in enumerate(results)
+            if isinstance(result, PublishError)
+        }
+        if errors:
+            raise PublishBatchError(errors, results)
+
+        return results
+
+    def publisher(self, max_batch=MAX_BATCH_SIZE, linger_ms=50, **kwargs):
+        return TopicPublisher(
+            self, max_batch=max_batch, linger_ms=linger_ms, **kwargs
+        )
+
+
+# -----------------------------------------------------------------------------
+
+
+class TopicPublisher:
+    """Publish messages on a topic in the background, in batches.
+
+    Messages are held for at most `linger_ms` milliseconds, waiting for a
+    batch of `max_batch` to fill up. When `max_buffer` messages are waiting
+    to be published, `publish` blocks until there is room for more.
+    """
+
+    def __init__(self, topic, *, max_batch, linger_ms, max_buffer=1000):
+        if not 1 <= max_batch <= MAX_BATCH_SIZE:
+            raise ValueError(
+                f"max_batch must be between 1 and {MAX_BATCH_SIZE}",
+            )
+
+        self.topic = topic
+        self.buffer = BoundedSemaphore(max_buffer)
+        self.batcher = Batcher(
+            self._publish_batch,
+            max_size=max_batch,
+            max_wait=linger_ms / 1000,
+            name=f"tqp-{topic.topic_name}-publish",
+        )
+        self.batcher.start()
+
+    def _publish_batch(self, batch):
+        try:
+            results = self.topic._publish_batch([entry for entry, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+            self.buffer.release()
+
+    def publish(self, message, dump_json=True, **kwargs):
+        """Queue a message, returning a future for its message id"""
+        entry = self.topic._get_entry(message, dump_json, **kwargs)
+        future = Future()
+
+        self.buffer.acquire()
+        try:
+            self.batcher.add((entry, future))
+        except Exception:
+            self.buffer.release()
+            raise
+
+        return future
+
+    def flush(self, timeout=None):
+        """Block until all queued messages are published"""
+        return self.batcher.flush(timeout)
+
+    def close(self, timeout=None):
+        self.batcher.close(timeout)
+
+    def __enter__(self):
+        return self
 
-        self.topic.publish(Message=message, **kwargs)
+    def __exit__(self, *args):
+        self.close()
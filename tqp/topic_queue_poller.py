@@ -1,9 +1,40 @@
-import boto3
+import fnmatch
+import hashlib
 import json
 import logging
-
-from .exceptions import InvalidMessageError
-from .threading_utils import Interval
+import re
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from threading import Event, Lock, Thread, current_thread, main_thread
+
+from .autoscale import Autoscaler
+from .codecs import (
+    CODEC_ATTRIBUTE,
+    DEFAULT_CODEC,
+    TOPIC_ATTRIBUTE,
+    get_codec,
+    json_loads,
+)
+from .diagnostics import SlowHandlerWatchdog
+from .exceptions import BatchHandlerError, InvalidMessageError
+from .fifo import GroupScheduler, get_dead_letter_queue_name, is_fifo
+from .instrumentation import (
+    ACK,
+    BUFFER,
+    DECODE,
+    HANDLER,
+    RECEIVE,
+    VISIBILITY,
+    Metrics,
+    emit,
+)
+from .offload import OFFLOAD_ATTRIBUTE, fetch_message
+from .retry import DEAD_LETTER
+from .threading_utils import Batcher, ResizableSemaphore, acquire_up_to
+from .transport import DEFAULT_TRANSPORT
+from .visibility import MAX_BATCH_SIZE, VisibilityManager
 
 # -----------------------------------------------------------------------------
 
@@ -14,50 +45,40 @@ def _jsonify_dictionary(dictionary):
 
 logger = logging.getLogger(name=__name__)
 
-
-def noop(*args, **kwargs):
-    pass
+# tag holding a hash of the configuration the queue was provisioned with
+FINGERPRINT_TAG = "tqp-fingerprint"
 
 
-# -----------------------------------------------------------------------------
+# outcomes of `_handle_message`
+_HANDLED = "handled"
+_FAILED = "failed"
+_DEFERRED = "deferred"
 
 
-def _create_queue_raw(name, attributes, *, tags):
-    sqs_client = boto3.client("sqs")
-    sqs_resource = boto3.resource("sqs")
+def noop(*args, **kwargs):
+    pass
 
-    attributes = _jsonify_dictionary(attributes)
-    tags = {"tqp": "true", **tags}
 
-    def _create_queue():
-        return sqs_resource.create_queue(
-            QueueName=name,
-            Attributes=attributes,
-            tags=tags,
-        )
+# -----------------------------------------------------------------------------
 
-    try:
-        return _create_queue()
-    except sqs_client.exceptions.QueueNameExists:
-        queue_url = sqs_client.get_queue_url(QueueName=name)["QueueUrl"]
-        existing_tags = sqs_client.list_queue_tags(QueueUrl=queue_url).get(
-            "Tags", {}
-        )
-        tags_to_remove = list(set(existing_tags.keys()) - set(tags.keys()))
 
-        sqs_client.tag_queue(QueueUrl=queue_url, Tags=tags)
-        if tags_to_remove:
-            sqs_client.untag_queue(QueueUrl=queue_url, TagKeys=tags_to_remove)
+def _create_queue_raw(name, attributes, *, tags, transport):
+    if is_fifo(name):
+        attributes = {"FifoQueue": True, **attributes}
 
-        # Run create again to make sure everything matches.
-        return _create_queue()
+    return transport.create_queue(
+        name,
+        _jsonify_dictionary(attributes),
+        tags={"tqp": "true", **tags},
+    )
 
 
-def create_queue(queue_name, *, tags, **kwargs):
+def create_queue(queue_name, *, tags, transport=DEFAULT_TRANSPORT, **kwargs):
     dead_letter_queue = _create_queue_raw(
-        f"{queue_name}-dead-letter",
+        get_dead_letter_queue_name(queue_name),
         {"MessageRetentionPeriod": 1209600},  # maximum (14 days)
         tags={"dlq": "true", **tags},
+        transport=transport,
     )
     dead_letter_queue_arn = dead_letter_queue.attributes["QueueArn"]
 
@@ -73,6 +94,7 @@ def create_queue(queue_name, *, tags, **kwargs):
             **kwargs,
         },
         tags={"dlq": "false", **tags},
+        transport=transport,
     )
 
 
@@ -82,49 +104,315 @@ def create_queue(queue_name, *, tags, **kwargs):
 class QueuePollerBase:
     logger = logger
 
-    def __init__(self, queue_name, prefix=None, tags=None, **kwargs):
+    def __init__(
+        self,
+        queue_name,
+        prefix=None,
+        tags=None,
+        *,
+        fifo=False,
+        concurrency=1,
+        max_in_flight=None,
+        receive_batch_size=5,
+        receivers=1,
+        wait_time_seconds=20,
+        max_concurrency=None,
+        max_receivers=None,
+        autoscale_interval=30,
+        max_idle_backoff=0,
+        stop_timeout=25,
+        delete_max_wait=0.1,
+        provisioning_concurrency=10,
+        dedup_store=None,
+        retry_policy=None,
+        slow_handler_threshold=None,
+        profiler=None,
+        transport=None,
+        **kwargs,
+    ):
+        # where the queue lives, see `tqp.transport`
+        self.transport = transport or DEFAULT_TRANSPORT
+
         self.prefix = f"{prefix}--" if prefix else ""
         self.queue_name = f"{self.prefix}{queue_name}"
+
+        # messages of a FIFO queue are handled one at a time within each
+        # message group, and concurrently across groups
+        self.fifo = fifo or is_fifo(self.queue_name)
+        if self.fifo and not is_fifo(self.queue_name):
+            self.queue_name = f"{self.queue_name}.fifo"
+        self._groups = None
         self.queue_attributes = kwargs
         self.tags = tags or {}
         self.queue = None
         if prefix:
             self.tags["prefix"] = prefix
 
-    def extend_message_visibility_timeout(self, queue, messages, timeout):
-        # this is safe to run on already deleted messages, because
-        # it would simply fail the operation only for the already deleted ones
-        self.logger.debug("increasing message visibility")
-        queue.change_message_visibility_batch(
+        if not 1 <= receive_batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(
+                f"receive_batch_size must be between 1 and {MAX_BATCH_SIZE}",
+            )
+
+        # number of handlers running in parallel, and number of received
+        # messages (running or waiting for a worker) held at any given time.
+        # the difference between the two is the depth of the prefetch buffer
+        self.concurrency = concurrency
+        self.max_in_flight = max_in_flight or max(
+            concurrency, receivers * receive_batch_size
+        )
+
+        # number of threads long polling the queue, and maximum number of
+        # messages each of them asks for at a time
+        self.receivers = receivers
+        self.receive_batch_size = receive_batch_size
+
+        # how long each receive long polls the queue for. the maximum is the
+        # most efficient, but receivers only notice `stop` once it returns
+        self.wait_time_seconds = wait_time_seconds
+
+        # upper bounds to scale `concurrency` and `receivers` up to when
+        # there is a backlog, checking it every `autoscale_interval` seconds.
+        # `max_in_flight` scales along, keeping the same prefetch depth
+        self.max_concurrency = max(max_concurrency or 0, concurrency)
+        self.max_receivers = max(max_receivers or 0, receivers)
+        self.autoscale_interval = autoscale_interval
+        self._autoscaler = None
+
+        # receivers getting nothing from the queue wait before polling again,
+        # doubling the wait from 1 second up to this many seconds
+        self.max_idle_backoff = max_idle_backoff
+
+        # successfully handled messages are deleted in batches, waiting at
+        # most this many seconds for a batch to fill up
+        self.delete_max_wait = delete_max_wait
+        self._deleter = None
+        self._visibility = None
+        self._in_flight = None
+        self._running = None
+
+        # messages received and not started yet, returned to the queue when
+        # stopping. handlers already running get until `stop_timeout`
+        # seconds after `stop` is called to finish
+        self.stop_timeout = stop_timeout
+        self._pending = set()
+        self._pending_lock = Lock()
+        self._stopping = Event()
+        self._stop_deadline = None
+
+        # number of provisioning calls (e.g. subscriptions) made in parallel
+        self.provisioning_concurrency = provisioning_concurrency
+
+        # records handled messages, to delete redeliveries without handling
+        # them again. see `tqp.dedup`
+        self.dedup_store = dedup_store
+
+        # when to retry failed messages, see `tqp.retry`. without one, they
+        # are retried once their visibility timeout runs out
+        self.retry_policy = retry_policy
+        self._dead_letter_queue = None
+
+        # see `tqp.instrumentation`
+        self.metrics = Metrics()
+        self.listeners = [self.metrics]
+
+        # handlers running past this fraction of the visibility timeout are
+        # logged, with their stack. see `tqp.diagnostics` for the profiler
+        self.slow_handler_threshold = slow_handler_threshold
+        self.profiler = profiler
+
+    @property
+    def autoscaling(self):
+        return (
+            self.max_concurrency > self.concurrency
+            or self.max_receivers > self.receivers
+        )
+
+    def get_max_in_flight(self, concurrency, receivers):
+        prefetch = self.max_in_flight - self.concurrency
+        return max(concurrency + prefetch, receivers * self.receive_batch_size)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def instrument(self, stage, duration, count=1):
+        emit(self, "stage_timed", stage, duration, count)
+
+    def delete_messages(self, queue, messages):
+        started_at = time.perf_counter()
+        response = queue.delete_messages(
             Entries=[
-                {
-                    "Id": msg.message_id,
-                    "ReceiptHandle": msg.receipt_handle,
-                    "VisibilityTimeout": timeout,
-                }
-                for msg in messages
+                {"Id": str(i), "ReceiptHandle": msg.receipt_handle}
+                for i, msg in enumerate(messages)
             ]
         )
+        self.instrument(ACK, time.perf_counter() - started_at, len(messages))
+        self.logger.debug(
+            "deleted %s message(s)", len(response.get("Successful", ()))
+        )
+
+        for failure in response.get("Failed", ()):
+            msg = messages[int(failure["Id"])]
+
+            if failure["SenderFault"]:
+                self.logger.warning(
+                    "could not delete message %s: %s",
+                    msg.message_id,
+                    failure.get("Message"),
+                )
+                continue
+
+            # errors on the SQS side are transient, so give it another try
+            try:
+                msg.delete()
+            except Exception:
+                self.logger.exception(
+                    "could not delete message %s", msg.message_id
+                )
+
+    def acknowledge(self, msg):
+        # handlers may still be running past the stop timeout
+        if self._deleter is None or self._deleter.closed:
+            msg.delete()
+            self.logger.debug("message successfully deleted")
+        else:
+            self._deleter.add(msg)
 
-    def ensure_queue(self):
-        self.queue = create_queue(
-            self.queue_name, tags=self.tags, **self.queue_attributes
+    def get_provisioning_state(self):
+        """Describe everything `provision_queue` sets up"""
+        return {
+            "queue_name": self.queue_name,
+            "queue_attributes": self.queue_attributes,
+            "tags": self.tags,
+        }
+
+    def get_fingerprint(self):
+        state = json.dumps(
+            self.get_provisioning_state(), sort_keys=True, default=str
         )
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    def _get_provisioned_queue(self, fingerprint):
+        queue = self.transport.find_queue(self.queue_name)
+        if queue is None:
+            return None
+
+        tags = self.transport.get_queue_tags(queue)
+        if tags.get(FINGERPRINT_TAG) != fingerprint:
+            return None
+
+        return queue
+
+    def provision_queue(self):
+        return create_queue(
+            self.queue_name,
+            tags=self.tags,
+            transport=self.transport,
+            **self.queue_attributes,
+        )
+
+    def ensure_queue(self, *, force=False):
+        """Provision the queue, unless its configuration is unchanged.
+
+        The queue is tagged with a fingerprint of its configuration once it
+        is fully provisioned, so that the next time around all the calls
+        can be skipped. Pass `force=True` to provision it regardless.
+        """
+        fingerprint = self.get_fingerprint()
+
+        queue = None if force else self._get_provisioned_queue(fingerprint)
+        if queue is not None:
+            self.logger.debug("queue is already provisioned")
+        else:
+            queue = self.provision_queue()
+            self.transport.tag_queue(queue, {FINGERPRINT_TAG: fingerprint})
+
+        self.queue = queue
         return self.queue
 
+    def get_queue(self):
+        """Get the queue, assuming it has already been provisioned"""
+        self.queue = self.transport.get_queue(self.queue_name)
+        return self.queue
+
+    def _get_or_ensure_queue(self, ensure_queue):
+        if not ensure_queue:
+            return self.get_queue()
+
+        self.logger.debug("creating queue")
+        return self.ensure_queue()
+
     def get_message_payload(msg):
         return None
 
+    def get_message_id(self, msg, payload):
+        return msg.message_id
+
+    def get_handler_name(self, payload):
+        """Get the name handler statistics are aggregated under"""
+        return "handle_message"
+
+    def _get_dedup_key(self, msg, payload):
+        return f"{self.queue_name}:{self.get_message_id(msg, payload)}"
+
+    def _is_duplicate(self, msg, payload):
+        if self.dedup_store is None:
+            return False
+
+        if not self.dedup_store.seen(self._get_dedup_key(msg, payload)):
+            return False
+
+        self.logger.info("skipping duplicate message %s", msg.message_id)
+        self.acknowledge(msg)
+        return True
+
+    def _mark_handled(self, msg, payload):
+        if self.dedup_store is None:
+            return
+
+        try:
+            self.dedup_store.add(self._get_dedup_key(msg, payload))
+        except Exception:
+            self.logger.exception(
+                "could not record message %s as handled", msg.message_id
+            )
+
+    def defer_message(self, msg, payload):
+        """Take over the handling of a message.
+
+        Return True for messages that are handled later on, in which case
+        `_finish_message` must be called once they are done.
+        """
+        return False
+
     def _handle_message(self, msg):
+        started_at = time.perf_counter()
         payload = self.get_message_payload(msg)
+        self.instrument(DECODE, time.perf_counter() - started_at)
+
+        if self._is_duplicate(msg, payload):
+            return _HANDLED
+        if self.defer_message(msg, payload):
+            return _DEFERRED
+
+        emit(self, "handler_started", msg, payload)
+        started_at = time.perf_counter()
+        error = None
         try:
             self.handle_message(msg, payload)
 
-            msg.delete()
-            self.logger.debug("message successfully deleted")
+            self._mark_handled(msg, payload)
+            self.acknowledge(msg)
         except Exception as e:
             # whatever the error is, log and move on
+            error = e
             self.handle_error(e, msg, payload)
+            self.retry(e, msg, payload)
+
+        duration = time.perf_counter() - started_at
+        self.instrument(HANDLER, duration)
+        emit(self, "handler_finished", msg, payload, error, duration)
+
+        return _HANDLED if error is None else _FAILED
 
     def handle_error(self, exception, msg, payload):
         self.logger.exception(
@@ -136,49 +424,473 @@ class QueuePollerBase:
     def handle_message(self, msg, payload):
         raise NotImplementedError()
 
-    def start(self):
-        self.logger.debug("creating queue")
-        queue = self.ensure_queue()
+    def get_retry_policy(self, payload):
+        return self.retry_policy
+
+    def get_dead_letter_queue(self):
+        if self._dead_letter_queue is None:
+            self._dead_letter_queue = self.transport.get_queue(
+                get_dead_letter_queue_name(self.queue_name)
+            )
+
+        return self._dead_letter_queue
+
+    def dead_letter(self, msg):
+        """Move a message to the dead letter queue"""
+        kwargs = {}
+        if self.fifo:
+            kwargs = {
+                "MessageGroupId": msg.attributes["MessageGroupId"],
+                "MessageDeduplicationId": msg.message_id,
+            }
+
+        self.get_dead_letter_queue().send_message(
+            **kwargs,
+            MessageBody=msg.body,
+            MessageAttributes={
+                name: {
+                    key: value
+                    for key, value in attribute.items()
+                    if key in ("DataType", "StringValue", "BinaryValue")
+                }
+                for name, attribute in (msg.message_attributes or {}).items()
+            },
+        )
+        msg.delete()
+
+    def retry(self, exception, msg, payload):
+        """Schedule the retry of a failed message, following its policy"""
+        policy = self.get_retry_policy(payload)
+        if policy is None:
+            return
+
+        # the visibility must not be extended over the retry delay
+        if self._visibility is not None:
+            self._visibility.untrack(msg)
+
+        receive_count = int(
+            (msg.attributes or {}).get("ApproximateReceiveCount", 1)
+        )
+        delay = policy.get_delay(exception, receive_count)
+
+        try:
+            if delay is DEAD_LETTER:
+                self.logger.info("dead lettering message %s", msg.message_id)
+                self.dead_letter(msg)
+            else:
+                self.logger.info(
+                    "retrying message %s in %s second(s)",
+                    msg.message_id,
+                    delay,
+                )
+                msg.change_visibility(VisibilityTimeout=delay)
+        except Exception:
+            self.logger.exception("could not retry message %s", msg.message_id)
+
+    def _finish_message(self, msg):
+        self._visibility.untrack(msg)
+        self._in_flight.release()
+
+    def _process_message(self, msg, received_at=None):
+        """Handle a received message, returning whether it succeeded"""
+        with self._running:
+            with self._pending_lock:
+                # once stopping, messages not started yet are returned to
+                # the queue instead
+                if msg not in self._pending or self._stopping.is_set():
+                    return False
+                self._pending.remove(msg)
+
+            if received_at is not None:
+                self.instrument(BUFFER, time.perf_counter() - received_at)
+
+            outcome = _FAILED
+            try:
+                outcome = self._handle_message(msg)
+            except Exception:
+                self.logger.exception("could not handle message %s", msg.body)
+            finally:
+                if outcome != _DEFERRED:
+                    self._finish_message(msg)
+
+            return outcome != _FAILED
+
+    def _return_unstarted(self, queue, messages):
+        with self._pending_lock:
+            messages = [msg for msg in messages if msg in self._pending]
+            self._pending.difference_update(messages)
+
+        self._return_messages(queue, messages)
+
+    def _make_visible(self, queue, messages):
+        for i in range(0, len(messages), MAX_BATCH_SIZE):
+            batch = messages[i : i + MAX_BATCH_SIZE]
+            try:
+                queue.change_message_visibility_batch(
+                    Entries=[
+                        {
+                            "Id": str(j),
+                            "ReceiptHandle": msg.receipt_handle,
+                            "VisibilityTimeout": 0,
+                        }
+                        for j, msg in enumerate(batch)
+                    ]
+                )
+            except Exception:
+                self.logger.exception(
+                    "could not return %s message(s) to the queue", len(batch)
+                )
+
+    def _return_messages(self, queue, messages):
+        """Make messages visible again right away, for other consumers"""
+        if not messages:
+            return
+
+        self._make_visible(queue, messages)
+        for msg in messages:
+            self._finish_message(msg)
+
+        self.logger.info("returned %s message(s) to the queue", len(messages))
+
+    def _receive_messages(self, queue, executor, in_flight, index=0):
+        idle_backoff = 0
+
+        while not self._stopping.is_set():
+            if self._autoscaler is not None:
+                self._autoscaler.wait_active(index)
+
+            # time out now and then, to notice when the poller is stopped
+            num_slots = acquire_up_to(
+                in_flight, self.receive_batch_size, timeout=1
+            )
+            if not num_slots:
+                continue
+            if self._stopping.is_set():
+                for _ in range(num_slots):
+                    in_flight.release()
+                break
+
+            messages = []
+            try:
+                messages = self.receive_messages(queue, num_slots)
+            finally:
+                for _ in range(num_slots - len(messages)):
+                    in_flight.release()
+
+            if self._stopping.is_set():
+                self._return_messages(queue, messages)
+                return
+
+            if self._autoscaler is not None:
+                self._autoscaler.record_receive(num_slots, len(messages))
+
+            if messages:
+                idle_backoff = 0
+            elif self.max_idle_backoff:
+                self._stopping.wait(idle_backoff)
+                idle_backoff = min(
+                    max(idle_backoff * 2, 1), self.max_idle_backoff
+                )
+
+            received_at = time.perf_counter()
+            for msg in messages:
+                self._visibility.track(msg)
+
+                with self._pending_lock:
+                    self._pending.add(msg)
+
+                if self._groups is not None:
+                    self._groups.submit(
+                        msg.attributes["MessageGroupId"], (msg, received_at)
+                    )
+                else:
+                    executor.submit(self._process_message, msg, received_at)
+
+    def _run_receiver(self, queue, executor, in_flight, index, errors):
+        try:
+            self._receive_messages(queue, executor, in_flight, index)
+        except Exception as e:
+            self.logger.exception("receiver failed, stopping")
+            errors.append(e)
+            self.stop()
+
+    def receive_messages(self, queue, max_number_of_messages):
+        started_at = time.perf_counter()
+        messages = queue.receive_messages(
+            AttributeNames=["All"],
+            MessageAttributeNames=["All"],
+            WaitTimeSeconds=self.wait_time_seconds,
+            MaxNumberOfMessages=max_number_of_messages,
+        )
+        self.instrument(
+            RECEIVE, time.perf_counter() - started_at, len(messages)
+        )
+        self.logger.debug("received %s message(s)", len(messages))
+
+        now = time.time()
+        for msg in messages:
+            sent_timestamp = (msg.attributes or {}).get("SentTimestamp")
+            lag = (
+                now - int(sent_timestamp) / 1000
+                if sent_timestamp is not None
+                else None
+            )
+            emit(self, "message_received", msg, lag)
+
+        return messages
+
+    def _enter_run_context(self, stack):
+        """Set up anything that must run alongside the poller.
+
+        Contexts entered on `stack` are exited before the workers are shut
+        down, and before pending deletes are flushed.
+        """
+        pass
+
+    def _ensure_max_pool_connections(self):
+        # receivers, handlers, and the delete, visibility and autoscaling
+        # threads
+        self.transport.ensure_max_pool_connections(
+            self.max_receivers + self.max_concurrency + 3
+        )
+
+    def stop(self):
+        """Stop polling; `start` returns once the messages are drained.
+
+        Messages that were received but not started yet are returned to the
+        queue right away, while the handlers already running are given until
+        `stop_timeout` seconds after the call to finish.
+        """
+        if self._stopping.is_set():
+            return
+
+        self.logger.info("stopping")
+        self._stop_deadline = time.monotonic() + self.stop_timeout
+        self._stopping.set()
+
+        if self._autoscaler is not None:
+            self._autoscaler.cancel()
+
+    def _handle_signal(self, signum, frame):
+        # a second signal terminates the process right away
+        signal.signal(signum, signal.SIG_DFL)
+        self.stop()
+
+    def _install_signal_handlers(self, stack):
+        if current_thread() is not main_thread():
+            if self.profiler is not None and self.profiler.signum is not None:
+                self.logger.warning(
+                    "not polling on the main thread, the profiler can only "
+                    "be toggled with toggle()"
+                )
+            return
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            # e.g. left for the prefork supervisor to handle
+            if signal.getsignal(signum) is signal.SIG_IGN:
+                continue
+
+            handler = signal.signal(signum, self._handle_signal)
+            stack.callback(signal.signal, signum, handler)
+
+        if self.profiler is not None:
+            self.profiler.install_signal_handler(stack)
+
+    def _enter_diagnostics(self, stack, visibility_timeout):
+        listeners = []
+        if self.slow_handler_threshold:
+            listeners.append(
+                SlowHandlerWatchdog(
+                    self.slow_handler_threshold * visibility_timeout,
+                    name=f"tqp-{self.queue_name}-watchdog",
+                )
+            )
+
+        if self.profiler is not None:
+            listeners.append(self.profiler)
+
+        for listener in listeners:
+            stack.enter_context(listener)
+            self.add_listener(listener)
+            stack.callback(self.listeners.remove, listener)
+
+    def _get_stop_timeout(self):
+        return max(self._stop_deadline - time.monotonic(), 0)
+
+    def _return_pending(self, queue):
+        with self._pending_lock:
+            pending = list(self._pending)
+        self._return_unstarted(queue, pending)
+
+    def _drain(self, queue, receivers):
+        # without waiting for the long polls in progress, which return what
+        # they receive themselves
+        self._return_pending(queue)
+
+        for thread in receivers:
+            thread.join(self._get_stop_timeout())
+
+        # messages received just as the poller stopped may have been added
+        # since
+        self._return_pending(queue)
+
+        if not self._in_flight.wait_released(self._get_stop_timeout()):
+            self.logger.warning(
+                "stopped with %s message(s) still being handled",
+                self._in_flight.acquired,
+            )
+
+    def _shutdown_executor(self, executor):
+        # handlers still running past the stop timeout are left behind
+        executor.shutdown(
+            wait=not self._stopping.is_set() or self._get_stop_timeout() > 0,
+            cancel_futures=True,
+        )
+
+    def start(self, *, ensure_queue=True):
+        try:
+            self._poll(ensure_queue=ensure_queue)
+        finally:
+            # only once the run is over, so that stopping the poller before
+            # it gets to start still takes effect
+            self._stopping.clear()
+
+    def _poll(self, *, ensure_queue, executor=None):
+        """Poll until stopped, handling messages on `executor`.
+
+        Without an executor, the poller runs its handlers on a thread pool
+        of its own. Otherwise, only its `submit` method is used, and it's up
+        to the caller to shut it down and to install the signal handlers.
+        """
+        self._ensure_max_pool_connections()
+        queue = self._get_or_ensure_queue(ensure_queue)
         self.logger.info("starting to poll")
 
-        visibility_timeout = int(queue.attributes["VisibilityTimeout"])
+        # never receive more messages than the workers are able to pick up,
+        # so that they don't sit in memory while their visibility runs out
+        in_flight = self._in_flight = ResizableSemaphore(self.max_in_flight)
+
+        # when autoscaling, worker threads are only started as needed, and
+        # this caps the handlers running to the current concurrency
+        self._running = ResizableSemaphore(self.concurrency)
+        shared_executor = executor is not None
+        if not shared_executor:
+            executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix=f"tqp-{self.queue_name}",
+            )
 
-        while True:
-            messages = queue.receive_messages(
-                MessageAttributeNames=["All"],
-                # maximum amount. helps for most efficient long polling
-                WaitTimeSeconds=20,
-                MaxNumberOfMessages=5,
+        if self.fifo:
+            # when a message fails, the ones after it in its group are
+            # returned to the queue, to be received again after it
+            self._groups = GroupScheduler(
+                executor,
+                lambda item: self._process_message(*item),
+                lambda items: self._return_unstarted(
+                    queue, [msg for msg, _ in items]
+                ),
             )
-            self.logger.debug("received %s message(s)", len(messages))
 
-            with Interval(
-                visibility_timeout - 5,
-                self.extend_message_visibility_timeout,
-                (queue, messages, visibility_timeout),
-            ):
-                for msg in messages:
-                    self._handle_message(msg)
+        self._deleter = Batcher(
+            lambda messages: self.delete_messages(queue, messages),
+            max_size=MAX_BATCH_SIZE,
+            max_wait=self.delete_max_wait,
+            name=f"tqp-{self.queue_name}-delete",
+        )
+
+        visibility_timeout = int(queue.attributes["VisibilityTimeout"])
+        self._visibility = VisibilityManager(
+            queue,
+            visibility_timeout,
+            instrument=lambda duration, count: self.instrument(
+                VISIBILITY, duration, count
+            ),
+            name=f"tqp-{self.queue_name}-visibility",
+        )
+
+        with ExitStack() as stack:
+            if not shared_executor:
+                self._install_signal_handlers(stack)
+                stack.callback(self._shutdown_executor, executor)
+            stack.enter_context(self._deleter)
+            stack.enter_context(self._visibility)
+            self._enter_run_context(stack)
+            self._enter_diagnostics(stack, visibility_timeout)
+
+            if self.autoscaling:
+                self._autoscaler = stack.enter_context(
+                    Autoscaler(
+                        self,
+                        queue,
+                        interval=self.autoscale_interval,
+                        name=f"tqp-{self.queue_name}-autoscale",
+                    )
+                )
+
+            # receivers fill the buffer while handlers are running, so that
+            # the long polling round trip is not spent waiting
+            errors = []
+            receivers = []
+            for i in range(self.max_receivers):
+                thread = Thread(
+                    target=self._run_receiver,
+                    args=(queue, executor, in_flight, i, errors),
+                    name=f"tqp-{self.queue_name}-receive-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                receivers.append(thread)
+
+            self._stopping.wait()
+            self._drain(queue, receivers)
+
+        if errors:
+            raise errors[0]
+
+        self.logger.info("stopped")
 
 
 # -----------------------------------------------------------------------------
 
 
+class _BatchHandler:
+    def __init__(self, func, *, max_size, max_wait):
+        self.func = func
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.batcher = None
+
+    @property
+    def __name__(self):
+        return self.func.__name__
+
+
 class TopicQueuePoller(QueuePollerBase):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, raw_message_delivery=False, **kwargs):
         super().__init__(*args, **kwargs)
         self.handlers = {}
+        self.pattern_handlers = []
+        self.default_route = None
         self.s3_handlers = {}
 
-    def get_sns_payload(self, body):
-        if "TopicArn" not in body:
-            return None
+        # handler -> retry policy, for handlers that override the poller's
+        self.retry_policies = {}
 
-        topic = body["TopicArn"].split(":")[-1]
-        message = body.pop("Message")
-        handler, parse_json, with_meta = self.handlers[topic]
+        # topics resolved against the patterns, so that it happens only once
+        self._routes = {}
+
+        # subscribe without the SNS envelope, routing messages on the topic
+        # attribute added by `Topic.publish` instead
+        self.raw_message_delivery = raw_message_delivery
+
+    def _get_topic_payload(self, topic, message, attributes, body):
+        handler, parse_json, with_meta = self.get_route(topic)
+
+        if OFFLOAD_ATTRIBUTE in attributes:
+            message = fetch_message(message)
         if parse_json:
-            message = json.loads(message)
+            codec_name = attributes.get(CODEC_ATTRIBUTE, DEFAULT_CODEC)
+            message = get_codec(codec_name).decode(message)
 
         return {
             "topic": topic,
@@ -194,6 +906,38 @@ class TopicQueuePoller(QueuePollerBase):
             ),
         }
 
+    def get_sns_payload(self, body):
+        if "TopicArn" not in body:
+            return None
+
+        topic = body["TopicArn"].split(":")[-1]
+        message = body.pop("Message")
+        attributes = {
+            name: attribute["Value"]
+            for name, attribute in body.get("MessageAttributes", {}).items()
+        }
+
+        return {
+            **self._get_topic_payload(topic, message, attributes, body),
+            "message_id": body.get("MessageId"),
+        }
+
+    def get_raw_payload(self, msg):
+        attributes = msg.message_attributes
+        if not attributes or TOPIC_ATTRIBUTE not in attributes:
+            return None
+
+        attributes = {
+            name: attribute.get("StringValue")
+            for name, attribute in attributes.items()
+        }
+        return self._get_topic_payload(
+            attributes[TOPIC_ATTRIBUTE],
+            msg.body,
+            attributes,
+            {"MessageAttributes": msg.message_attributes},
+        )
+
     def get_s3_payload(self, body):
         if body.get("Event") == "s3:TestEvent":
             return {
@@ -230,7 +974,13 @@ class TopicQueuePoller(QueuePollerBase):
         }
 
     def get_message_payload(self, msg):
-        body = json.loads(msg.body)
+        # raw messages are routed without parsing the body
+        if self.raw_message_delivery:
+            payload = self.get_raw_payload(msg)
+            if payload is not None:
+                return {"attributes": msg.attributes, **payload}
+
+        body = json_loads(msg.body)
 
         for matcher in (self.get_sns_payload, self.get_s3_payload):
             payload = matcher(body)
@@ -239,6 +989,17 @@ class TopicQueuePoller(QueuePollerBase):
 
         raise InvalidMessageError(f"message could not be parsed: {body}")
 
+    def get_message_id(self, msg, payload):
+        # SNS may deliver a message more than once as well, and each delivery
+        # gets its own SQS message id
+        return payload.get("message_id") or msg.message_id
+
+    def get_handler_name(self, payload):
+        return getattr(payload["handler"], "__name__", payload["topic"])
+
+    def get_retry_policy(self, payload):
+        return self.retry_policies.get(payload["handler"], self.retry_policy)
+
     def handle_message(self, msg, payload):
         topic = payload["topic"]
         handler = payload["handler"]
@@ -251,27 +1012,224 @@ class TopicQueuePoller(QueuePollerBase):
         extra_call_kwargs = {"meta": meta} if meta is not None else {}
         handler(message, **extra_call_kwargs)
 
+    def defer_message(self, msg, payload):
+        batch_handler = payload["handler"]
+        if not isinstance(batch_handler, _BatchHandler):
+            return False
+
+        batch_handler.batcher.add((msg, payload))
+        return True
+
+    def handle_message_batch(self, messages, payloads):
+        topic = payloads[0]["topic"]
+        batch_handler = payloads[0]["handler"]
+
+        self.logger.info(
+            "%s: handling batch of %s message(s)", topic, len(messages)
+        )
+
+        extra_call_kwargs = (
+            {"meta": [payload["meta"] for payload in payloads]}
+            if payloads[0]["meta"] is not None
+            else {}
+        )
+        batch_handler.func(
+            [payload["message"] for payload in payloads],
+            **extra_call_kwargs,
+        )
+
+    def _handle_batch(self, batch):
+        messages = [msg for msg, _ in batch]
+        payloads = [payload for _, payload in batch]
+
+        # a batch takes up a single handler slot
+        with self._running:
+            emit(self, "batch_started", messages, payloads)
+            started_at = time.perf_counter()
+            try:
+                self.handle_message_batch(messages, payloads)
+                errors = {}
+            except BatchHandlerError as e:
+                errors = e.errors
+            except Exception as e:
+                errors = dict.fromkeys(range(len(batch)), e)
+
+        duration = time.perf_counter() - started_at
+        self.instrument(HANDLER, duration, len(batch))
+        emit(self, "batch_finished", messages, payloads, errors, duration)
+
+        for i, (msg, payload) in enumerate(batch):
+            try:
+                if i in errors:
+                    self.handle_error(errors[i], msg, payload)
+                    self.retry(errors[i], msg, payload)
+                else:
+                    self._mark_handled(msg, payload)
+                    self.acknowledge(msg)
+            except Exception:
+                self.logger.exception("could not finish message %s", msg.body)
+            finally:
+                self._finish_message(msg)
+
+    def _enter_run_context(self, stack):
+        super()._enter_run_context(stack)
+
+        for handler, _, _ in self._iter_routes():
+            if isinstance(handler, _BatchHandler) and not (
+                handler.batcher and handler.batcher.is_alive()
+            ):
+                handler.batcher = stack.enter_context(
+                    Batcher(
+                        self._handle_batch,
+                        max_size=handler.max_size,
+                        max_wait=handler.max_wait,
+                        name=f"tqp-{self.queue_name}-{handler.__name__}",
+                    )
+                )
+
+    def _iter_routes(self):
+        yield from self.handlers.values()
+        for _, route in self.pattern_handlers:
+            yield route
+        if self.default_route is not None:
+            yield self.default_route
+
+    def get_route(self, topic):
+        """Get the handler, parse_json and with_meta to use for a topic"""
+        route = self.handlers.get(topic)
+        if route is not None:
+            return route
+
+        try:
+            route = self._routes[topic]
+        except KeyError:
+            route = next(
+                (
+                    route
+                    for pattern, route in self.pattern_handlers
+                    if pattern.fullmatch(topic)
+                ),
+                self.default_route,
+            )
+            self._routes[topic] = route
+
+        if route is None:
+            raise InvalidMessageError(f"no handler for topic {topic}")
+
+        return route
+
+    def _compile_pattern(self, topic, use_prefix):
+        prefix = self.prefix if use_prefix else ""
+
+        if isinstance(topic, re.Pattern):
+            return re.compile(
+                f"{re.escape(prefix)}(?:{topic.pattern})", topic.flags
+            )
+
+        if any(char in topic for char in "*?["):
+            return re.compile(fnmatch.translate(f"{prefix}{topic}"))
+
+        return None
+
+    def _register_handler(
+        self, topics, handler, parse_json, with_meta, use_prefix
+    ):
+        route = handler, parse_json, with_meta
+
+        for topic in topics:
+            pattern = self._compile_pattern(topic, use_prefix)
+            if pattern is not None:
+                if any(p == pattern for p, _ in self.pattern_handlers):
+                    raise ValueError(
+                        f"Pattern {pattern.pattern} already registered",
+                    )
+
+                self.pattern_handlers.append((pattern, route))
+                continue
+
+            if use_prefix:
+                topic_name = f"{self.prefix}{topic}"
+            else:
+                topic_name = topic
+
+            if topic_name in self.handlers:
+                raise ValueError(
+                    f"Topic {topic_name} already registered",
+                )
+
+            self.handlers[topic_name] = route
+
+        self._routes.clear()
+
+    def _set_retry_policy(self, handler, retry_policy):
+        if retry_policy is not None:
+            self.retry_policies[handler] = retry_policy
+
     def handler(
         self,
         *topics,
         parse_json=True,
         with_meta=False,
         use_prefix=True,
+        retry_policy=None,
     ):
         def decorator(func):
-            for topic in topics:
-                if use_prefix:
-                    topic_name = f"{self.prefix}{topic}"
-                else:
-                    topic_name = topic
+            self._register_handler(
+                topics, func, parse_json, with_meta, use_prefix
+            )
+            self._set_retry_policy(func, retry_policy)
+            return func
 
-                if topic_name in self.handlers:
-                    raise ValueError(
-                        f"Topic {topic_name} already registered",
-                    )
+        return decorator
+
+    def batch_handler(
+        self,
+        *topics,
+        max_size=MAX_BATCH_SIZE,
+        max_wait=1,
+        parse_json=True,
+        with_meta=False,
+        use_prefix=True,
+        retry_policy=None,
+    ):
+        """Handle messages in batches of up to `max_size`.
+
+        Messages are collected across receives, until the batch is full or
+        the oldest message has waited `max_wait` seconds. The handler is
+        then called with the list of messages (and of metas, if
+        `with_meta`). To fail only some of them, raise `BatchHandlerError`.
+        Make sure `max_in_flight` is at least `max_size`, otherwise batches
+        can only be flushed on `max_wait`.
+        """
 
-                self.handlers[topic_name] = func, parse_json, with_meta
+        if self.fifo:
+            # batches would mix messages of several groups, out of order
+            raise ValueError("batch handlers can't be used on FIFO queues")
 
+        def decorator(func):
+            batch_handler = _BatchHandler(
+                func, max_size=max_size, max_wait=max_wait
+            )
+            self._register_handler(
+                topics, batch_handler, parse_json, with_meta, use_prefix
+            )
+            self._set_retry_policy(batch_handler, retry_policy)
+            return func
+
+        return decorator
+
+    def default_handler(
+        self, *, parse_json=True, with_meta=False, retry_policy=None
+    ):
+        """Handle messages from topics that no other handler matches"""
+
+        def decorator(func):
+            if self.default_route is not None:
+                raise ValueError("Default handler already registered")
+
+            self.default_route = func, parse_json, with_meta
+            self._routes.clear()
+            self._set_retry_policy(func, retry_policy)
             return func
 
         return decorator
@@ -285,69 +1243,98 @@ class TopicQueuePoller(QueuePollerBase):
 
         return decorator
 
-    def ensure_queue(self):
-        queue = super().ensure_queue()
-        queue_arn = queue.attributes["QueueArn"]
+    def get_topic_names(self):
+        """Get the topics to subscribe to.
+
+        These are the topics handlers are registered for, along with the
+        existing topics that match a pattern.
+        """
+        topic_names = set(self.handlers.keys())
 
-        sns = boto3.resource("sns")
-        s3_client = boto3.client("s3")
-        topic_arns = []
+        if self.pattern_handlers:
+            for topic_name in self.transport.list_topics():
+                if any(
+                    pattern.fullmatch(topic_name)
+                    for pattern, _ in self.pattern_handlers
+                ):
+                    topic_names.add(topic_name)
 
-        for topic_name in self.handlers.keys():
-            topic = sns.create_topic(Name=topic_name)
-            topic.subscribe(Protocol="sqs", Endpoint=queue_arn)
+        return sorted(topic_names)
 
-            topic_arns.append(topic.arn)
+    def get_provisioning_state(self):
+        return {
+            **super().get_provisioning_state(),
+            "topics": self.get_topic_names(),
+            "raw_message_delivery": self.raw_message_delivery,
+            "buckets": sorted(self.s3_handlers.keys()),
+        }
 
-        bucket_names = self.s3_handlers.keys()
-        bucket_arns = [f"arn:aws:s3:::{bucket}" for bucket in bucket_names]
+    def provision_queue(self):
+        queue = super().provision_queue()
+        queue_arn = queue.attributes["QueueArn"]
 
-        statement = [
-            {
-                "Sid": "sns",
-                "Effect": "Allow",
-                "Principal": {"AWS": "*"},
-                "Action": "SQS:SendMessage",
-                "Resource": queue_arn,
-                "Condition": {"ArnEquals": {"aws:SourceArn": topic_arns}},
-            }
-        ]
+        with ThreadPoolExecutor(
+            max_workers=self.provisioning_concurrency,
+            thread_name_prefix=f"tqp-{self.queue_name}-provision",
+        ) as executor:
+            topic_arns = list(
+                executor.map(
+                    lambda topic_name: self.transport.subscribe(
+                        topic_name,
+                        queue,
+                        raw_message_delivery=self.raw_message_delivery,
+                    ),
+                    self.get_topic_names(),
+                )
+            )
+
+            bucket_names = self.s3_handlers.keys()
+            bucket_arns = [f"arn:aws:s3:::{bucket}" for bucket in bucket_names]
 
-        if bucket_arns:
-            statement.append(
+            statement = [
                 {
-                    "Sid": "s3",
+                    "Sid": "sns",
                     "Effect": "Allow",
                     "Principal": {"AWS": "*"},
                     "Action": "SQS:SendMessage",
                     "Resource": queue_arn,
-                    "Condition": {"ArnEquals": {"aws:SourceArn": bucket_arns}},
+                    "Condition": {"ArnEquals": {"aws:SourceArn": topic_arns}},
                 }
-            )
+            ]
 
-        queue.set_attributes(
-            Attributes=_jsonify_dictionary(
-                {
-                    "Policy": {
-                        "Version": "2012-10-17",
-                        "Statement": statement,
-                    },
-                }
+            if bucket_arns:
+                statement.append(
+                    {
+                        "Sid": "s3",
+                        "Effect": "Allow",
+                        "Principal": {"AWS": "*"},
+                        "Action": "SQS:SendMessage",
+                        "Resource": queue_arn,
+                        "Condition": {
+                            "ArnEquals": {"aws:SourceArn": bucket_arns}
+                        },
+                    }
+                )
+
+            queue.set_attributes(
+                Attributes=_jsonify_dictionary(
+                    {
+                        "Policy": {
+                            "Version": "2012-10-17",
+                            "Statement": statement,
+                        },
+                    }
+                )
             )
-        )
 
-        for bucket in bucket_names:
-            s3_client.put_bucket_notification_configuration(
-                Bucket=bucket,
-                NotificationConfiguration={
-                    "QueueConfigurations": [
-                        {
-                            "Id": "tqp-subscription",
-                            "QueueArn": queue_arn,
-                            "Events": ["s3:ObjectCreated:*"],
-                        },
-                    ],
-                },
+            # the policy must allow the buckets to send to the queue first
+            list(
+                executor.map(
+                    lambda bucket: self.transport.subscribe_bucket(
+                        bucket, queue
+                    ),
+                    bucket_names,
+                )
             )
 
         return queue
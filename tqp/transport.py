@@ -0,0 +1,189 @@
+from . import aws
+
+# -----------------------------------------------------------------------------
+
+
+class Transport:
+    """The broker queues and topics live on.
+
+    Pollers and topics go through a transport to provision queues, subscribe
+    them to topics and publish messages. Queues returned by a transport are
+    used directly, and must implement the subset of the boto3 SQS `Queue`
+    resource used by pollers: `url`, `attributes`, `receive_messages`,
+    `delete_messages`, `change_message_visibility_batch`, `send_message`
+    and `set_attributes`. The messages they receive must likewise implement
+    the `Message` resource's `body`, `message_id`, `receipt_handle`,
+    `attributes`, `message_attributes`, `delete` and `change_visibility`.
+    """
+
+    def ensure_max_pool_connections(self, max_pool_connections):
+        pass
+
+    def create_queue(self, name, attributes, *, tags):
+        """Create a queue, or update the attributes and tags of an existing
+        one, with attributes serialized as strings
+        """
+        raise NotImplementedError()
+
+    def find_queue(self, name):
+        """Get a queue, or None if it doesn't exist"""
+        raise NotImplementedError()
+
+    def get_queue(self, name):
+        raise NotImplementedError()
+
+    def get_queue_tags(self, queue):
+        raise NotImplementedError()
+
+    def tag_queue(self, queue, tags):
+        raise NotImplementedError()
+
+    def get_queue_attributes(self, queue, attribute_names):
+        """Get up-to-date attributes of a queue, as strings"""
+        raise NotImplementedError()
+
+    def get_topic_arn(self, topic_name):
+        """Get the ARN of a topic, creating it if needed"""
+        raise NotImplementedError()
+
+    def list_topics(self):
+        """Get the names of all topics"""
+        raise NotImplementedError()
+
+    def subscribe(self, topic_name, queue, *, raw_message_delivery):
+        """Deliver messages published on a topic to a queue"""
+        raise NotImplementedError()
+
+    def subscribe_bucket(self, bucket, queue):
+        """Deliver notifications of objects created in a bucket to a queue"""
+        raise NotImplementedError()
+
+    def publish(self, topic_name, entry):
+        """Publish an SNS `Publish` entry, returning its message id"""
+        raise NotImplementedError()
+
+    def publish_batch(self, topic_name, entries):
+        """Publish SNS `PublishBatch` entries, returning the response"""
+        raise NotImplementedError()
+
+
+# -----------------------------------------------------------------------------
+
+
+class AWSTransport(Transport):
+    """SQS, SNS and S3, through the clients of `tqp.aws`"""
+
+    def ensure_max_pool_connections(self, max_pool_connections):
+        aws.ensure_max_pool_connections(max_pool_connections)
+
+    def create_queue(self, name, attributes, *, tags):
+        sqs_client = aws.get_client("sqs")
+        sqs_resource = aws.get_resource("sqs")
+
+        def _create_queue():
+            return sqs_resource.create_queue(
+                QueueName=name,
+                Attributes=attributes,
+                tags=tags,
+            )
+
+        try:
+            return _create_queue()
+        except sqs_client.exceptions.QueueNameExists:
+            queue_url = sqs_client.get_queue_url(QueueName=name)["QueueUrl"]
+            existing_tags = sqs_client.list_queue_tags(QueueUrl=queue_url).get(
+                "Tags", {}
+            )
+            tags_to_remove = list(set(existing_tags.keys()) - set(tags.keys()))
+
+            sqs_client.tag_queue(QueueUrl=queue_url, Tags=tags)
+            if tags_to_remove:
+                sqs_client.untag_queue(
+                    QueueUrl=queue_url, TagKeys=tags_to_remove
+                )
+
+            # Run create again to make sure everything matches.
+            return _create_queue()
+
+    def find_queue(self, name):
+        sqs_client = aws.get_client("sqs")
+
+        try:
+            queue_url = sqs_client.get_queue_url(QueueName=name)["QueueUrl"]
+        except sqs_client.exceptions.QueueDoesNotExist:
+            return None
+
+        return aws.get_resource("sqs").Queue(queue_url)
+
+    def get_queue(self, name):
+        return aws.get_resource("sqs").get_queue_by_name(QueueName=name)
+
+    def get_queue_tags(self, queue):
+        response = aws.get_client("sqs").list_queue_tags(QueueUrl=queue.url)
+        return response.get("Tags", {})
+
+    def tag_queue(self, queue, tags):
+        aws.get_client("sqs").tag_queue(QueueUrl=queue.url, Tags=tags)
+
+    def get_queue_attributes(self, queue, attribute_names):
+        response = aws.get_client("sqs").get_queue_attributes(
+            QueueUrl=queue.url, AttributeNames=attribute_names
+        )
+        return response["Attributes"]
+
+    def get_topic_arn(self, topic_name):
+        return aws.get_topic_arn(topic_name)
+
+    def list_topics(self):
+        paginator = aws.get_client("sns").get_paginator("list_topics")
+        for page in paginator.paginate():
+            for topic in page["Topics"]:
+                yield topic["TopicArn"].split(":")[-1]
+
+    def subscribe(self, topic_name, queue, *, raw_message_delivery):
+        sns_client = aws.get_client("sns")
+        topic_arn = aws.get_topic_arn(topic_name)
+        subscription_arn = sns_client.subscribe(
+            TopicArn=topic_arn,
+            Protocol="sqs",
+            Endpoint=queue.attributes["QueueArn"],
+            ReturnSubscriptionArn=True,
+        )["SubscriptionArn"]
+
+        # set separately, as existing subscriptions can't be updated through
+        # subscribe
+        sns_client.set_subscription_attributes(
+            SubscriptionArn=subscription_arn,
+            AttributeName="RawMessageDelivery",
+            AttributeValue=str(raw_message_delivery).lower(),
+        )
+        return topic_arn
+
+    def subscribe_bucket(self, bucket, queue):
+        aws.get_client("s3").put_bucket_notification_configuration(
+            Bucket=bucket,
+            NotificationConfiguration={
+                "QueueConfigurations": [
+                    {
+                        "Id": "tqp-subscription",
+                        "QueueArn": queue.attributes["QueueArn"],
+                        "Events": ["s3:ObjectCreated:*"],
+                    },
+                ],
+            },
+        )
+
+    def publish(self, topic_name, entry):
+        response = aws.get_client("sns").publish(
+            TopicArn=aws.get_topic_arn(topic_name), **entry
+        )
+        return response["MessageId"]
+
+    def publish_batch(self, topic_name, entries):
+        return aws.get_client("sns").publish_batch(
+            TopicArn=aws.get_topic_arn(topic_name),
+            PublishBatchRequestEntries=entries,
+        )
+
+
+DEFAULT_TRANSPORT = AWSTransport()
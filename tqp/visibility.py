@@ -0,0 +1,115 @@
+import logging
+import time
+from threading import Event, Lock, Thread
+
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger(name=__name__)
+
+# maximum allowed by the SQS batch APIs
+MAX_BATCH_SIZE = 10
+
+# -----------------------------------------------------------------------------
+
+
+class VisibilityManager(Thread):
+    """Keep in-flight messages invisible until they are done.
+
+    Messages are tracked individually from when they are received, and
+    their visibility timeout is extended shortly before it runs out, for as
+    long as they are tracked. Extensions due at the same time are batched
+    together, regardless of which receive the messages came from.
+    """
+
+    def __init__(self, queue, timeout, *, instrument=None, name=None):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.timeout = timeout
+
+        # called with the duration of each extension and number of messages
+        self.instrument = instrument
+
+        # extend visibility this many seconds before it runs out
+        self.margin = min(10, timeout / 2)
+
+        self.messages = {}
+        self.lock = Lock()
+        self.finished = Event()
+
+    def track(self, msg):
+        with self.lock:
+            self.messages[msg] = time.monotonic() + self.timeout
+
+    def untrack(self, msg):
+        with self.lock:
+            self.messages.pop(msg, None)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _extend(self, messages):
+        extended_at = time.monotonic()
+        started_at = time.perf_counter()
+        response = self.queue.change_message_visibility_batch(
+            Entries=[
+                {
+                    "Id": str(i),
+                    "ReceiptHandle": msg.receipt_handle,
+                    "VisibilityTimeout": self.timeout,
+                }
+                for i, msg in enumerate(messages)
+            ]
+        )
+        if self.instrument is not None:
+            self.instrument(time.perf_counter() - started_at, len(messages))
+
+        with self.lock:
+            for success in response.get("Successful", ()):
+                msg = messages[int(success["Id"])]
+                if msg in self.messages:
+                    self.messages[msg] = extended_at + self.timeout
+
+            for failure in response.get("Failed", ()):
+                msg = messages[int(failure["Id"])]
+                logger.warning(
+                    "could not extend visibility of message %s: %s",
+                    msg.message_id,
+                    failure.get("Message"),
+                )
+
+                # the receipt handle is no longer valid, stop trying
+                if failure["SenderFault"]:
+                    self.messages.pop(msg, None)
+
+    def extend_expiring(self):
+        expiring_at = time.monotonic() + self.margin
+        with self.lock:
+            messages = [
+                msg
+                for msg, expires_at in self.messages.items()
+                if expires_at <= expiring_at
+            ]
+
+        if not messages:
+            return
+
+        logger.debug("increasing visibility of %s message(s)", len(messages))
+        for i in range(0, len(messages), MAX_BATCH_SIZE):
+            try:
+                self._extend(messages[i : i + MAX_BATCH_SIZE])
+            except Exception:
+                logger.exception("could not extend message visibility")
+
+    def cancel(self):
+        self.finished.set()
+
+    def run(self):
+        while not self.finished.wait(self.margin / 2):
+            self.extend_expiring()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()